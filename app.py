@@ -5,7 +5,19 @@ Streamlitアプリの初期設定とページナビゲーションを管理す
 import os
 import streamlit as st
 from google.cloud import geminidataanalytics
-from state import init_state, fetch_messages_state, fetch_agents_state, create_convo, fetch_reference_data
+from state import (
+    init_state, fetch_messages_state, fetch_agents_state, fetch_more_convos_state, create_convo, fetch_reference_data,
+    prefetch_messages_state, reset_messages_state,
+)
+from utils.agent_catalog import get_agent_catalog
+from utils.clients import get_client_pool
+from utils.cost_estimator import (
+    SQL_DRY_RUN_ENABLED, format_bytes, get_cost_estimator, record_pending_sql_costs, session_total,
+)
+from utils.message_cache import get_message_cache
+from utils.render_cache import get_render_cache
+from utils.result_store import get_result_store
+from utils.search_index import get_search_index
 from utils.templates import list_templates, load_template
 
 
@@ -81,9 +93,11 @@ def main():
                     if template:
                         try:
                             # 古いエージェントを削除
+                            catalog = get_agent_catalog()
                             for ag in st.session_state.get("agents", []):
                                 delete_req = geminidataanalytics.DeleteDataAgentRequest(name=ag.name)
                                 operation = st.session_state.agent_client.delete_data_agent(request=delete_req)
+                                catalog.remove(ag.name)
 
                             # 新しいエージェントを作成
                             import uuid
@@ -112,13 +126,16 @@ def main():
                                 data_agent_id=agent_id,
                                 data_agent=agent
                             )
-                            st.session_state.agent_client.create_data_agent(request=create_req).result()
+                            created = st.session_state.agent_client.create_data_agent(request=create_req).result()
+                            catalog.upsert(created)
+                            # 削除・作成を反映した一覧を使いつつ、次回の取得時にAPIの一覧で確認し直す
+                            catalog.invalidate()
 
                             # 状態をリセットして新規チャット開始
                             fetch_agents_state(rerun=False)
                             st.session_state.current_agent = st.session_state.agents[0] if st.session_state.agents else None
                             st.session_state.convos = []
-                            st.session_state.convo_messages = []
+                            reset_messages_state()
                             # 新しい会話を作成
                             st.session_state.current_convo = create_convo(agent=st.session_state.current_agent)
                             st.success("エージェントを更新しました")
@@ -126,6 +143,33 @@ def main():
                         except Exception as e:
                             st.error(f"エラー: {e}")
 
+                # gRPCチャネルプールの利用状況
+                pool_stats = get_client_pool().stats()
+                st.caption(
+                    f"gRPCチャネル: {pool_stats['channels_created']}本作成 / "
+                    f"{pool_stats['reused']}回再利用 / 再接続{pool_stats['reconnects']}回 / "
+                    f"{pool_stats['sessions']}セッション"
+                )
+                # 取得結果の保存状況（メモリ上限を超えた分はディスクに退避）
+                result_stats = get_result_store().stats()
+                st.caption(
+                    f"取得結果: メモリ {format_bytes(result_stats['bytes_resident'])}"
+                    f"（{result_stats['resident_entries']}件） / "
+                    f"ディスク {format_bytes(result_stats['bytes_spilled'])}（{result_stats['spilled_entries']}件）"
+                )
+                # 描画キャッシュの利用状況（変換済みのDataFrame・チャート仕様・Markdown）
+                render_stats = get_render_cache().stats()
+                st.caption(
+                    f"描画キャッシュ: {render_stats['entries']}件 / {format_bytes(render_stats['bytes'])} / "
+                    f"ヒット{render_stats['hits']}回 / ミス{render_stats['misses']}回"
+                )
+                # メッセージの先読みキャッシュの利用状況
+                cache_stats = get_message_cache().stats()
+                st.caption(
+                    f"メッセージ先読み: {cache_stats['entries']}会話 / 読み込み中{cache_stats['inflight']}件 / "
+                    f"ヒット{cache_stats['hits']}回 / ミス{cache_stats['misses']}回 / 先読み{cache_stats['prefetched']}件"
+                )
+
                 st.divider()
 
             # 新規チャットボタン
@@ -137,6 +181,31 @@ def main():
                 st.session_state.start_new_chat = True
                 st.rerun()
 
+            # 会話履歴の検索（ローカルに保存済みの質問・SQL・回答が対象）
+            current_agent = st.session_state.get("current_agent")
+            search_query = st.text_input(
+                "会話履歴を検索",
+                key="history_search",
+                placeholder="🔍 会話履歴を検索（例: user_id ビデオ通話）",
+                label_visibility="collapsed",
+            )
+            if search_query.strip():
+                hits = get_search_index().search(
+                    search_query, agent_name=current_agent.name if current_agent else None,
+                )
+                if not hits:
+                    st.caption("一致する会話はありません")
+                for hit in hits:
+                    if st.button(
+                        f"🔎 {hit.convo.create_time.strftime('%m/%d %H:%M')}  {hit.snippet}",
+                        key=f"search_{hit.convo.name}",
+                        use_container_width=True,
+                        type="tertiary",
+                    ):
+                        st.session_state.current_convo = hit.convo
+                        fetch_messages_state(hit.convo, rerun=False)
+                        st.rerun()
+
             # 会話履歴
             convos = st.session_state.get("convos", [])
             if convos:
@@ -159,10 +228,28 @@ def main():
                     ):
                         # 会話を切り替え
                         st.session_state.current_convo = convo
-                        st.session_state.convo_messages = []
                         fetch_messages_state(convo, rerun=False)
                         st.rerun()
 
+                # 未取得の会話が残っていれば次のページを取得するボタンを表示
+                index = st.session_state.get("convo_index")
+                if index is not None and current_agent and index.has_more(current_agent.name):
+                    if st.button("さらに表示", key="more_convos_btn", use_container_width=True, type="tertiary"):
+                        fetch_more_convos_state(agent=current_agent)
+
+                # 上位の会話のメッセージをバックグラウンドで先読みする（切り替え時にすぐ表示できるように）
+                prefetch_messages_state()
+
+            # 生成SQLの推定スキャン量（このセッション・本日の全セッション）
+            if SQL_DRY_RUN_ENABLED:
+                record_pending_sql_costs()
+                session_count, session_bytes = session_total()
+                daily_count, daily_bytes = get_cost_estimator().daily_total()
+                st.caption(
+                    f"推定スキャン量: このセッション {format_bytes(session_bytes)}（{session_count}件） / "
+                    f"本日 {format_bytes(daily_bytes)}（{daily_count}件）"
+                )
+
             # 参照データ（referenceテーブル）
             st.markdown('<p class="chat-history-label">参照データ</p>', unsafe_allow_html=True)
             ref_data = fetch_reference_data()
@@ -6,6 +6,7 @@ import streamlit as st
 from google.api_core import exceptions as google_exceptions
 from google.cloud import geminidataanalytics
 from state import fetch_agents_state
+from utils.agent_catalog import get_agent_catalog
 from utils.agents import get_time_delta_string
 from utils.templates import list_templates, load_template
 import uuid
@@ -34,7 +35,7 @@ def agents_main():
         st.subheader("エージェント一覧")
         if st.button("Refresh agents"):
             with st.spinner("Refreshing..."):
-                fetch_agents_state()
+                fetch_agents_state(force=True)
 
     # エージェント一覧を表示するコンテナ
     with st.container(border=True, height=450):
@@ -98,6 +99,12 @@ def agents_main():
                                 operation = state.agent_client.update_data_agent(request=request)
                                 print(f"Operation開始: {operation.operation.name}")
                                 # .result()は呼ばない（Long-running Operationの完了を待たない）
+                                # 共有一覧は更新内容で直接書き換える（作成日時などは既存の値を引き継ぐ）
+                                updated = geminidataanalytics.DataAgent(ag)
+                                updated.display_name = display_name
+                                updated.description = description
+                                updated.data_analytics_agent.published_context.system_instruction = system_instruction
+                                get_agent_catalog().upsert(updated)
                                 fetch_agents_state()
                                 st.success("更新リクエストを送信しました（反映まで少し時間がかかる場合があります）")
                             except Exception as e:
@@ -112,6 +119,7 @@ def agents_main():
                                 print("削除リクエストを送信中...")
                                 operation = state.agent_client.delete_data_agent(request=request)
                                 print(f"Delete operation: {operation.operation.name}")
+                                get_agent_catalog().remove(ag.name)
                                 fetch_agents_state()
                                 st.rerun()
                             except Exception as e:
@@ -294,7 +302,8 @@ def agents_main():
                     del st.session_state[TABLES_KEY]
                 if PREAMBLE_KEY in st.session_state:
                     del st.session_state[PREAMBLE_KEY]
-                fetch_agents_state()
+                # 作成完了を待たないため、共有一覧を再取得する
+                fetch_agents_state(force=True)
             except google_exceptions.GoogleAPICallError as e:
                 st.error(f"API error creating agent: {e}")
             except Exception as e:
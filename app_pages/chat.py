@@ -2,13 +2,31 @@
 チャットページ
 エージェントとの対話UI、会話の選択・作成、メッセージの表示を行う
 """
+import threading
+
 import streamlit as st
 from google.cloud import geminidataanalytics
-from state import create_convo, fetch_messages_state
+from state import (
+    MAX_HISTORY_MESSAGES, PENDING_MESSAGES_KEY, REVALIDATE_MESSAGES_KEY, REVALIDATE_POLL_SECONDS, append_convo_message,
+    apply_pending_messages, apply_revalidated_messages, create_convo, fetch_earlier_messages_state, fetch_messages_state, reset_messages_state,
+)
+from utils.answer_cache import answer_cache_key, get_answer_cache
 from utils.chat import show_message
+from utils.chat_stream import ChatStreamWorker, format_timeline
+from utils.cost_estimator import SQL_DRY_RUN_ENABLED, start_sql_cost_estimate
+from utils.local_store import get_local_store
+from utils.message_cache import get_message_cache
+from utils.metrics import get_metrics, template_label
+from utils.render_cache import message_cache_key
 
 # セッション状態のキー定義
 CONVO_SELECT_KEY = "agent_convo_value"      # 会話選択用
+CHAT_WORKER_KEY = "chat_worker"             # 受信中の回答（ChatStreamWorker）
+CHAT_NOTICE_KEY = "chat_notice"             # 回答の停止・エラーの通知
+ANSWER_KEY_KEY = "chat_answer_key"          # 受信中の回答を保存する回答キャッシュのキー
+CHAT_AGENT_KEY = "chat_agent"               # 受信中の回答のエージェント（メトリクスのラベル用）
+CACHED_ANSWER_KEY = "cached_answer"         # 直前にキャッシュから再生した回答の情報
+LIVE_QUESTION_KEY = "live_question"         # キャッシュを使わずに再実行する質問
 
 
 def show_welcome_message():
@@ -94,7 +112,6 @@ def handle_convo_select():
     """
     state = st.session_state
     state.current_convo = state[CONVO_SELECT_KEY]
-    state.convo_messages = []
     st.spinner("Fetching past message")
     fetch_messages_state(state.current_convo, False)
 
@@ -107,7 +124,7 @@ def handle_create_convo():
     state = st.session_state
     st.spinner("Creating new convo")
     state.current_convo = create_convo(agent=state.current_agent)
-    state.convo_messages = []
+    reset_messages_state()
 
 
 def conversations_main():
@@ -130,66 +147,257 @@ def conversations_main():
         state.start_new_chat = False  # フラグをリセット
         handle_create_convo()
 
+    # 回答を受信中の場合は、完了するまで次の質問を受け付けない
+    # （入力欄は常に画面下部に固定されるため、ここで呼んでも表示位置は変わらない）
+    user_input = st.chat_input("What would you like to know?", disabled=CHAT_WORKER_KEY in state)
+    # キャッシュした回答の「最新データで再実行」が押された場合はその質問をキャッシュなしで実行
+    use_answer_cache = True
+    if not user_input and LIVE_QUESTION_KEY in state:
+        user_input = state.pop(LIVE_QUESTION_KEY)
+        use_answer_cache = False
+    if user_input:
+        state.pop(CACHED_ANSWER_KEY, None)
+
     # ========================================
     # チャット表示エリア
     # ========================================
+    # セッション開始時に取得を始めたメッセージを待って反映する（サイドバーは表示済み）
+    if PENDING_MESSAGES_KEY in state:
+        with st.spinner("Fetching past message"):
+            apply_pending_messages()
+
+    # キャッシュから再生した回答（表示中の会話で直前に再生したもののみ）
+    cached_answer = state.get(CACHED_ANSWER_KEY)
+    current_convo_name = state.current_convo.name if state.get("current_convo") else None
+    if user_input or not cached_answer or cached_answer["convo"] != current_convo_name:
+        cached_answer = None
+
     # 新規チャット時はウェルカムメッセージを表示
-    if not state.convo_messages:
+    if not state.convo_messages and not cached_answer:
         show_welcome_message()
 
+    # 以前のメッセージが残っている場合は読み込みボタンを表示（保持上限に達したら表示しない）
+    if state.get("convo_has_earlier"):
+        if len(state.convo_messages) >= MAX_HISTORY_MESSAGES:
+            st.caption("表示できる履歴の上限に達しました")
+        elif st.button("⬆️ 以前のメッセージを読み込む", key="load_earlier_btn"):
+            with st.spinner("Fetching past message"):
+                fetch_earlier_messages_state(state.current_convo)
+
     # チャット履歴を表示（ユーザーメッセージとアシスタントメッセージを区別）
-    for message in state.convo_messages:
+    for i, message in enumerate(state.convo_messages):
         if "system_message" in message:
             with st.chat_message("assistant"):
-                show_message(message)
+                show_message(message, history_widget_key(i))
         else:
             with st.chat_message("user"):
                 st.markdown(message.user_message.text)
 
+    # 先読みキャッシュから表示した会話は、最新の状態の確認が終わり次第、異なれば表示し直す
+    # （質問を送信した・回答の受信中の場合は、表示中のメッセージが最新のため確認結果を使わない）
+    if REVALIDATE_MESSAGES_KEY in state:
+        if user_input or CHAT_WORKER_KEY in state:
+            state.pop(REVALIDATE_MESSAGES_KEY)
+        elif apply_revalidated_messages():
+            poll_revalidated_messages()
+
+    # 直前の回答がキャッシュからの再生だった場合は、その質問と回答、再実行ボタンを表示
+    # （再生した回答はサーバーに送っていないため、履歴・ローカルの保存には追加せずセッション状態からだけ表示する）
+    if cached_answer:
+        with st.chat_message("user"):
+            st.markdown(cached_answer["question"])
+        with st.chat_message("assistant"):
+            for i, message in enumerate(cached_answer["messages"]):
+                show_message(message, f"replay:{i}")
+        with st.container(horizontal=True, vertical_alignment="center"):
+            st.caption(f"💾 本日{cached_answer['created_at']:%H:%M}に取得した回答を表示しています（会話履歴には保存されません）")
+            if st.button("🔄 最新データで再実行", key="rerun_live_btn"):
+                state[LIVE_QUESTION_KEY] = cached_answer["question"]
+                st.rerun()
+
+    # 前回の回答の停止・エラーの通知を1回だけ表示
+    notice = state.pop(CHAT_NOTICE_KEY, None)
+    if notice:
+        st.warning(notice)
+
+    # 受信中の回答があれば続きを受信して表示（再実行をまたいで継続する）
+    if CHAT_WORKER_KEY in state:
+        render_chat_turn()
+
     # ========================================
     # チャット入力エリア
     # ========================================
-    user_input = st.chat_input("What would you like to know?")
-
     if user_input:
+        # 同じ日に同じ質問があれば、キャッシュした回答を再生する（表示のみ、上の再生の表示で描画する）
+        answer_key = answer_cache_key(user_input, state.current_agent)
+        cached = get_answer_cache().get(answer_key) if use_answer_cache else None
+        if cached:
+            state[CACHED_ANSWER_KEY] = {
+                "question": user_input,
+                "created_at": cached.created_at,
+                "messages": cached.to_messages(),
+                "convo": state.current_convo.name if state.current_convo else None,
+            }
+            st.rerun()
+
         # 会話がない場合は新規作成
         if not state.current_convo:
             handle_create_convo()
 
         # ユーザーメッセージを履歴に追加して表示
-        state.convo_messages.append(geminidataanalytics.Message(user_message={"text": user_input}))
+        append_convo_message(geminidataanalytics.Message(user_message={"text": user_input}))
         with st.chat_message("user"):
             st.markdown(user_input)
 
-        # アシスタントのレスポンスを生成・表示
-        with st.chat_message("assistant"):
-            with st.spinner("Thinking... 🤖"):
-                # チャットリクエストを作成（ガードレール付きメッセージを使用）
-                augmented_message = build_guardrail_message(user_input, state.current_agent)
-                user_msg = geminidataanalytics.Message(user_message={"text": augmented_message})
-                convo_ref = geminidataanalytics.ConversationReference()
-                convo_ref.conversation = state.current_convo.name
-                convo_ref.data_agent_context.data_agent = state.current_agent.name
-
-                # Lookerエージェントの場合はOAuth認証情報を追加
-                if is_looker_agent(state.current_agent):
-                    credentials = geminidataanalytics.Credentials()
-                    credentials.oauth.secret.client_id = st.secrets.looker.client_id
-                    credentials.oauth.secret.client_secret = st.secrets.looker.client_secret
-                    convo_ref.data_agent_context.credentials = credentials
-
-                # APIにリクエストを送信し、ストリーミングでレスポンスを取得
-                req = geminidataanalytics.ChatRequest(
-                    parent=f"projects/{st.secrets.cloud.project_id}/locations/global",
-                    messages=[user_msg],
-                    conversation_reference=convo_ref,
-                )
-                # レスポンスを順次表示し、履歴に追加
-                for message in state.chat_client.chat(request=req):
-                    show_message(message)
-                    state.convo_messages.append(message)
-            # 画面を再描画して履歴を更新
-            st.rerun()
+        # バックグラウンドで回答の受信を開始し、届いたものから表示する
+        req = build_chat_request(user_input, state.current_agent, state.current_convo)
+        state[CHAT_WORKER_KEY] = ChatStreamWorker(state.chat_client, req)
+        state[ANSWER_KEY_KEY] = answer_key
+        state[CHAT_AGENT_KEY] = state.current_agent
+        render_chat_turn()
+
+
+@st.fragment(run_every=REVALIDATE_POLL_SECONDS)
+def poll_revalidated_messages():
+    """
+    会話の最新の状態の確認が終わるまで、この範囲だけを一定間隔で再実行して結果を反映する
+    （確認が終わった後は、次にページ全体を再実行するまで何もしない）
+    """
+    apply_revalidated_messages()
+
+
+def history_widget_key(index: int) -> str:
+    """
+    履歴のメッセージのウィジェットのキー（会話名と一覧内の位置）
+    同じ内容のメッセージ（同じ質問の回答の再生など）が並んでもキーが重ならないよう、メッセージの内容ではなく位置から作る
+    """
+    convo = st.session_state.get("current_convo")
+    return f"{convo.name if convo else 'new'}:{index}"
+
+
+def build_chat_request(user_input: str, agent, convo) -> geminidataanalytics.ChatRequest:
+    """
+    チャットリクエストを作成する（ガードレール付きメッセージを使用）
+
+    引数:
+        user_input: ユーザーが入力した質問
+        agent: 現在選択中のエージェント
+        convo: 現在の会話
+    """
+    augmented_message = build_guardrail_message(user_input, agent)
+    user_msg = geminidataanalytics.Message(user_message={"text": augmented_message})
+    convo_ref = geminidataanalytics.ConversationReference()
+    convo_ref.conversation = convo.name
+    convo_ref.data_agent_context.data_agent = agent.name
+
+    # Lookerエージェントの場合はOAuth認証情報を追加
+    if is_looker_agent(agent):
+        credentials = geminidataanalytics.Credentials()
+        credentials.oauth.secret.client_id = st.secrets.looker.client_id
+        credentials.oauth.secret.client_secret = st.secrets.looker.client_secret
+        convo_ref.data_agent_context.credentials = credentials
+
+    return geminidataanalytics.ChatRequest(
+        parent=f"projects/{st.secrets.cloud.project_id}/locations/global",
+        messages=[user_msg],
+        conversation_reference=convo_ref,
+    )
+
+
+def render_chat_turn():
+    """
+    受信中の回答を、届いたメッセージから順に表示する
+
+    - 進捗（スキーマ → SQL → データ → チャート）と経過時間を表示する
+    - 停止ボタンが押されるとgRPC呼び出しとBigQueryジョブをキャンセルする
+      （ボタンを押すと再実行され、その実行でキャンセル処理が行われる）
+    - 受信が完了したら画面を再描画して履歴に反映する
+    - 受信中に別の会話に切り替えた場合は表示せず、残りを回答元の会話にだけ保存する（detach_chat_turn）
+    """
+    state = st.session_state
+    worker = state[CHAT_WORKER_KEY]
+    current_convo = state.get("current_convo")
+    if current_convo is None or current_convo.name != worker.convo_name:
+        detach_chat_turn()
+        # 入力欄を有効にして描画し直す
+        st.rerun()
+
+    with st.chat_message("assistant"):
+        timeline = st.empty()
+        if st.button("⏹ 停止", key="stop_chat_btn"):
+            worker.cancel()
+
+        def update_timeline():
+            timeline.caption(format_timeline(worker))
+
+        update_timeline()
+        for message in worker.iter_messages(on_idle=update_timeline):
+            # 表示中に再実行で中断されても失われないよう、先に履歴へ追加する
+            append_convo_message(message)
+            # 履歴に追加した位置のキーを使う（受信完了後に履歴として描画し直しても表・エクスポートの状態を保つ）
+            show_message(message, history_widget_key(len(state.convo_messages) - 1))
+            record_message_cost(message)
+            update_timeline()
+
+    del state[CHAT_WORKER_KEY]
+    _finish_chat_turn(worker, state.pop(ANSWER_KEY_KEY, None), state.pop(CHAT_AGENT_KEY, None))
+
+    if worker.cancelled:
+        state[CHAT_NOTICE_KEY] = "回答の生成を停止しました"
+    elif worker.error:
+        state[CHAT_NOTICE_KEY] = f"回答の取得中にエラーが発生しました: {worker.error}"
+    # 画面を再描画して履歴を更新
+    st.rerun()
+
+
+def _finish_chat_turn(worker, answer_key, agent, metrics=None, answer_cache=None):
+    """
+    受信が完了した回答の計測値をメトリクスに記録し、正常に完了した回答は回答キャッシュに保存する
+    （スクリプトの外のスレッドから呼ぶ場合は、metrics・answer_cacheに共有オブジェクトを渡す）
+    """
+    # 最初のメッセージまでの時間・段階ごとの時間・取得行数をメトリクスに記録する
+    (metrics or get_metrics()).record_turn(
+        worker,
+        agent_label=agent.display_name if agent else "",
+        template=template_label(agent) if agent else "",
+    )
+    if answer_key and not worker.cancelled and not worker.error:
+        # 正常に完了した回答は同じ日の同じ質問のためにキャッシュする
+        (answer_cache or get_answer_cache()).put(answer_key, worker.messages)
+
+
+def detach_chat_turn():
+    """
+    受信中の回答をセッションから切り離し、残りのメッセージを回答元の会話にだけ仮保存する
+    （受信中に会話の切り替え・新規チャット・検索結果の選択をした場合、表示中の会話に混ざらないようにする）
+    受信はバックグラウンドで最後まで続け、完了したらメトリクス・回答キャッシュに記録する
+    """
+    state = st.session_state
+    worker = state.pop(CHAT_WORKER_KEY)
+    answer_key = state.pop(ANSWER_KEY_KEY, None)
+    agent = state.pop(CHAT_AGENT_KEY, None)
+    # スクリプトの外のスレッドではst.cache_resourceを呼ばないよう、共有オブジェクトを先に取得する
+    store = get_local_store()
+    message_cache = get_message_cache()
+    metrics = get_metrics()
+    answer_cache = get_answer_cache()
+
+    def drain():
+        for message in worker.iter_messages():
+            store.add_pending(worker.convo_name, message)
+            message_cache.invalidate(worker.convo_name)
+        _finish_chat_turn(worker, answer_key, agent, metrics, answer_cache)
+
+    threading.Thread(target=drain, daemon=True).start()
+
+
+def record_message_cost(message):
+    """受信した生成SQLの推定スキャン量をセッションと日付ごとの集計に加える"""
+    m = message.system_message
+    if not SQL_DRY_RUN_ENABLED or 'data' not in m or 'generated_sql' not in m.data:
+        return
+    # ドライランは描画を待たせないようバックグラウンドで行い、完了後の再実行で集計・表示する
+    start_sql_cost_estimate(message_cache_key(message), m.data.generated_sql)
 
 
 def is_looker_agent(agent) -> bool:
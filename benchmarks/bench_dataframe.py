@@ -0,0 +1,102 @@
+"""
+データレスポンス→DataFrame変換のベンチマーク
+従来の行×フィールドのループと、列指向の変換（utils.dataframes）を1k/10k/100k行で比較する
+
+実行方法（リポジトリのルートで）:
+    python -m benchmarks.bench_dataframe
+    python -m benchmarks.bench_dataframe --rows 1000 10000
+"""
+import argparse
+import random
+import time
+
+import pandas as pd
+from google.cloud import geminidataanalytics
+
+from utils.dataframes import data_result_to_dataframe
+
+DEFAULT_ROWS = [1_000, 10_000, 100_000]
+
+# ポイントログの集計結果を模したスキーマ
+FIXTURE_FIELDS = [
+    ("date", "DATE"),
+    ("user_id", "STRING"),
+    ("user_name", "STRING"),
+    ("user_gender", "INTEGER"),
+    ("user_app", "STRING"),
+    ("action_name", "STRING"),
+    ("total_point", "INTEGER"),
+    ("interaction_count", "INTEGER"),
+]
+_APPS = ["Jambo_iOS", "Jambo_Android", "Connect_iOS", "Connect_Android", "Chapple"]
+_ACTIONS = ["ビデオ通話", "メッセージ送信", "音声通話", "ギフト", "精算"]
+
+
+def build_data_message(rows: int, seed: int = 0) -> geminidataanalytics.DataMessage:
+    """指定行数のデータレスポンス（DataMessage）を作成する"""
+    rng = random.Random(seed)
+    msg = geminidataanalytics.DataMessage()
+    pb = geminidataanalytics.DataMessage.pb(msg)
+    for name, field_type in FIXTURE_FIELDS:
+        field = pb.result.schema.fields.add()
+        field.name = name
+        field.type_ = field_type
+    for i in range(rows):
+        pb.result.data.add().update({
+            "date": f"2025-01-{1 + i % 28:02d}",
+            "user_id": f"{rng.getrandbits(64):016x}",
+            "user_name": f"user{i}",
+            "user_gender": float(i % 2),
+            "user_app": _APPS[i % len(_APPS)],
+            "action_name": _ACTIONS[i % len(_ACTIONS)],
+            "total_point": str(rng.randint(-50_000, 50_000)),
+            "interaction_count": float(rng.randint(1, 500)),
+        })
+    return msg
+
+
+def legacy_dataframe(resp) -> pd.DataFrame:
+    """従来の変換処理（proto-plus経由で行×フィールドごとに値を追加する）"""
+    fields = [field.name for field in resp.result.schema.fields]
+    d = {}
+    for el in resp.result.data:
+        for field in fields:
+            if field in d:
+                d[field].append(el[field])
+            else:
+                d[field] = [el[field]]
+    return pd.DataFrame(d)
+
+
+def _time(func, repeat: int) -> float:
+    """funcをrepeat回実行し、最速の実行時間（秒）を返す"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'legacy [s]':>12} {'columnar [s]':>14} {'speedup':>9} {'legacy MB':>10} {'columnar MB':>12}")
+    for rows in args.rows:
+        resp = build_data_message(rows)
+        repeat = 1 if rows >= 100_000 else args.repeat
+        legacy_time = _time(lambda: legacy_dataframe(resp), repeat)
+        columnar_time = _time(lambda: data_result_to_dataframe(resp.result), repeat)
+        legacy_mb = legacy_dataframe(resp).memory_usage(deep=True).sum() / 1024 ** 2
+        columnar_mb = data_result_to_dataframe(resp.result).memory_usage(deep=True).sum() / 1024 ** 2
+        print(
+            f"{rows:>8} {legacy_time:>12.3f} {columnar_time:>14.3f} {legacy_time / columnar_time:>8.1f}x"
+            f" {legacy_mb:>10.1f} {columnar_mb:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+ユーザーデータのテキスト整形のベンチマーク
+従来のformat_user_data_text（re.split＋ユーザーごとのre.findall）と、
+utils.text_formatの整形（一括・パーツごとの逐次）を比較する
+（出力が従来と一致することは tests/test_text_format.py で確認する）
+
+実行方法（リポジトリのルートで）:
+    python -m benchmarks.bench_format_text
+    python -m benchmarks.bench_format_text --users 50 100
+"""
+import argparse
+import random
+import re
+import time
+
+from utils.text_format import UserDataFormatter, format_user_data_text
+
+DEFAULT_USERS = [10, 50, 100]
+
+_ACTIONS = ["ビデオ通話", "メッセージ送信", "音声通話", "ギフト", "精算"]
+
+
+def legacy_format_user_data_text(text: str) -> str:
+    """従来の整形処理（変更前のutils.chat.format_user_data_text）"""
+    user_pattern = r'(user_id:\s*[a-f0-9]+)'
+    parts = re.split(user_pattern, text)
+
+    if len(parts) <= 1:
+        return text
+
+    formatted_lines = []
+    i = 0
+    if parts[0].strip():
+        formatted_lines.append(parts[0].strip())
+        formatted_lines.append("")
+    i = 1
+
+    while i < len(parts):
+        if i + 1 < len(parts):
+            user_id = parts[i].strip()
+            data = parts[i + 1].strip()
+
+            items = re.findall(r'([^:]+?):\s*(\d+)回', data)
+
+            if items:
+                formatted_lines.append(f"**{user_id}**")
+                for item_name, count in items:
+                    item_name = item_name.strip()
+                    if item_name:
+                        formatted_lines.append(f"  - {item_name}: {count}回")
+                formatted_lines.append("")
+            else:
+                formatted_lines.append(f"**{user_id}** {data}")
+                formatted_lines.append("")
+            i += 2
+        else:
+            formatted_lines.append(parts[i])
+            i += 1
+
+    return "\n".join(formatted_lines)
+
+
+def build_answer(users: int, seed: int = 0) -> str:
+    """上位N名のユーザーデータを含むテキスト回答を作成する"""
+    rng = random.Random(seed)
+    lines = [f"ポイント獲得数の上位{users}名です。"]
+    for _ in range(users):
+        items = ", ".join(f"{a}: {rng.randint(0, 500)}回" for a in rng.sample(_ACTIONS, 3))
+        lines.append(f"user_id: {rng.getrandbits(64):016x} {items}")
+    return "\n".join(lines)
+
+
+def split_parts(text: str, rng: random.Random, max_parts: int = 8) -> list:
+    """テキストをランダムな位置でパーツに分割する（ストリーミングの受信を模す）"""
+    cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(0, max_parts))))
+    return [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+
+def _time(func, repeat: int) -> float:
+    """funcをrepeat回実行し、1回あたりの平均実行時間（秒）を返す"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def _legacy_streamed(parts):
+    """パーツが届くたびに、それまでの全テキストを従来の処理で整形し直す"""
+    text = ""
+    for part in parts:
+        text += part
+        legacy_format_user_data_text(text)
+
+
+def _incremental_streamed(parts):
+    """パーツが届くたびに逐次整形し、その時点の整形結果を作る"""
+    formatter = UserDataFormatter()
+    for part in parts:
+        formatter.feed(part)
+        formatter.markdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=DEFAULT_USERS)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    print("一括: 全テキストを1回整形 / 逐次: 1行ずつ届くたびに、その時点の整形結果を作る")
+    print(
+        f"{'users':>6} {'一括 従来 [us]':>14} {'一括 新 [us]':>12}"
+        f" {'逐次 従来 [us]':>14} {'逐次 新 [us]':>12} {'逐次 speedup':>12}"
+    )
+    for users in args.users:
+        text = build_answer(users)
+        parts = [line + "\n" for line in text.split("\n")]
+        repeat = max(1, args.repeat // users)
+        legacy = _time(lambda: legacy_format_user_data_text(text), args.repeat)
+        single = _time(lambda: format_user_data_text(text), args.repeat)
+        legacy_streamed = _time(lambda: _legacy_streamed(parts), repeat)
+        streamed = _time(lambda: _incremental_streamed(parts), repeat)
+        print(
+            f"{users:>6} {legacy * 1e6:>14.1f} {single * 1e6:>12.1f}"
+            f" {legacy_streamed * 1e6:>14.1f} {streamed * 1e6:>12.1f} {legacy_streamed / streamed:>11.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
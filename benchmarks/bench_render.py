@@ -0,0 +1,354 @@
+"""
+メッセージ描画（utils.chat.show_message）のベンチマーク
+保存したメッセージ（geminidataanalytics.Messageをシリアライズしたファイル）を読み込み、
+Streamlitをスタブに置き換えてshow_messageを実行し、メッセージの種類（ハンドラ）ごとの実行時間とメモリ割り当てを計測する
+
+- 初回描画（キャッシュなし）と再実行時の描画（キャッシュあり）を分けて計測する
+- --save-baselineで結果を保存し、--compareで保存した結果より遅く（多く）なった場合は終了コード1で終了する
+  （悪化したメッセージは--retriesの回数まで計測し直し、各回の最小値で判定する。一時的な揺れでは失敗しない）
+
+実行方法（リポジトリのルートで）:
+    python -m benchmarks.bench_render --write-fixtures      # 代表的なメッセージをfixtures/に作成
+    python -m benchmarks.bench_render --save-baseline benchmarks/baseline_render.json
+    python -m benchmarks.bench_render --compare benchmarks/baseline_render.json
+
+fixtures/が空の場合は代表的なメッセージ（固定のシードで作成）を保存してから計測する
+実際のAPIから取得したメッセージ（type(msg).serialize(msg)の内容）を.pbファイルとして置いてもよい
+"""
+import argparse
+import gc
+import glob
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+import pyarrow as pa
+from google.cloud import geminidataanalytics
+
+import utils.chat as chat
+import utils.result_export as result_export
+import utils.result_grid as result_grid
+from benchmarks.bench_dataframe import build_data_message
+from benchmarks.bench_format_text import build_answer
+from utils.chat_stream import message_kind
+from utils.render_cache import get_render_cache
+from utils.result_store import get_result_store
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# 計測値の比較で無視する差（小さい値の揺れで失敗しないように）
+MIN_TIME_DELTA_MS = 1.0
+# 初回描画の時間はキャッシュの破棄・メモリの確保の影響で揺れが大きいため、無視する差も大きくする
+MIN_COLD_DELTA_MS = 5.0
+MIN_ALLOC_DELTA_KB = 64
+# 許容する悪化の割合の既定値（初回描画はキャッシュの破棄やGCの影響で揺れが大きいため広くする）
+DEFAULT_TOLERANCE = 0.3
+DEFAULT_COLD_TOLERANCE = 0.5
+
+# 取得結果の名前付けに使うマスタ（BigQueryには接続しない）
+REFERENCE_DATA = {
+    "application_name": pd.DataFrame({
+        "application_id": [str(i) for i in range(1, 6)],
+        "application_name": ["Jambo_iOS", "Jambo_Android", "Connect_iOS", "Connect_Android", "Chapple"],
+    }),
+    "log_point_type": pd.DataFrame({
+        "type": [str(i) for i in range(1, 6)],
+        "action_name": ["ビデオ通話", "メッセージ送信", "音声通話", "ギフト", "精算"],
+    }),
+}
+
+
+class _StubElement:
+    """Streamlitの要素・コンテナのスタブ（with文にも対応）"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def __getattr__(self, name):
+        return StubStreamlit.__getattr__(STUB_ST, name)
+
+
+class _SessionState(dict):
+    """属性としても参照できるセッション状態のスタブ"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+class StubStreamlit:
+    """
+    描画処理で使うStreamlitの関数のスタブ
+
+    ウィジェットは既定値を返し、表・チャートはブラウザに送る形式（Arrow・JSON）への変換だけを行う
+    """
+
+    def __init__(self):
+        self.session_state = _SessionState()
+        self.secrets = {}
+
+    def __getattr__(self, name):
+        # markdown・captionなど、表示するだけの要素
+        return lambda *args, **kwargs: _StubElement()
+
+    def columns(self, spec, **kwargs):
+        return [_StubElement() for _ in range(spec if isinstance(spec, int) else len(spec))]
+
+    def dataframe(self, df, **kwargs):
+        pa.Table.from_pandas(df)
+        return _StubElement()
+
+    def vega_lite_chart(self, spec, **kwargs):
+        json.dumps(spec)
+        return _StubElement()
+
+    def selectbox(self, label, options, **kwargs):
+        return options[0]
+
+    def radio(self, label, options, **kwargs):
+        return options[0]
+
+    def text_input(self, label, **kwargs):
+        return ""
+
+    def number_input(self, label, min_value=0, **kwargs):
+        return min_value
+
+    def button(self, *args, **kwargs):
+        return False
+
+
+STUB_ST = StubStreamlit()
+
+
+def install_stub():
+    """描画処理のモジュールのStreamlitをスタブに置き換える"""
+    for module in (chat, result_grid, result_export):
+        module.st = STUB_ST
+    # st.fragmentはScriptRunContextなしでは関数を実行しないため、元の関数を直接呼ぶ
+    chat.display_result_grid = result_grid.display_result_grid.__wrapped__
+    chat.display_result_export = result_export.display_result_export.__wrapped__
+    chat.display_query_export = result_export.display_query_export.__wrapped__
+    chat.SQL_DRY_RUN_ENABLED = False
+    chat.load_reference_data = lambda project_id: (REFERENCE_DATA, {})
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+
+def _message(system_message: geminidataanalytics.SystemMessage) -> geminidataanalytics.Message:
+    return geminidataanalytics.Message(system_message=system_message)
+
+
+def build_chart_message(points: int, seed: int = 0) -> geminidataanalytics.Message:
+    """データを埋め込んだ（inline data）Vega-Liteのチャートメッセージ"""
+    rng = random.Random(seed)
+    chart = geminidataanalytics.ChartMessage()
+    pb = geminidataanalytics.ChartMessage.pb(chart)
+    pb.result.vega_config.update({
+        "$schema": "https://vega.github.io/schema/vega-lite/v5.json",
+        "mark": "line",
+        "encoding": {
+            "x": {"field": "date", "type": "temporal"},
+            "y": {"field": "total_point", "type": "quantitative"},
+            "color": {"field": "user_app", "type": "nominal"},
+        },
+        "data": {"values": [
+            {"date": f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}", "total_point": rng.randint(0, 10_000),
+             "user_app": f"app{i % 5}"}
+            for i in range(points)
+        ]},
+    })
+    return _message(geminidataanalytics.SystemMessage(chart=chart))
+
+
+def build_fixtures() -> dict:
+    """代表的なメッセージ（名前 → Message）"""
+    text = geminidataanalytics.TextMessage(parts=[build_answer(100)])
+    sql = geminidataanalytics.DataMessage(generated_sql=(
+        "SELECT user_id, application_id, type, SUM(point) AS total_point\n"
+        "FROM `proj.ds.log_point`\n"
+        "WHERE timestamp_jst >= '2025-01-01' AND timestamp_jst < '2025-02-01'\n"
+        "GROUP BY 1, 2, 3 ORDER BY total_point DESC LIMIT 100"
+    ))
+    return {
+        "text_100_users": _message(geminidataanalytics.SystemMessage(text=text)),
+        "sql": _message(geminidataanalytics.SystemMessage(data=sql)),
+        "data_small": _message(geminidataanalytics.SystemMessage(data=build_data_message(100))),
+        "data_large": _message(geminidataanalytics.SystemMessage(data=build_data_message(20_000))),
+        "chart_inline_5k": build_chart_message(5_000),
+    }
+
+
+def write_fixtures(directory: str = FIXTURES_DIR):
+    """代表的なメッセージをシリアライズしてファイルに保存する"""
+    os.makedirs(directory, exist_ok=True)
+    for name, msg in build_fixtures().items():
+        path = os.path.join(directory, f"{name}.pb")
+        with open(path, "wb") as f:
+            f.write(geminidataanalytics.Message.serialize(msg))
+        print(f"wrote {path} ({os.path.getsize(path) / 1024:.0f} KB)")
+
+
+def load_fixtures(directory: str = FIXTURES_DIR) -> dict:
+    """保存したメッセージを読み込む（名前 → Message）"""
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.pb"))):
+        with open(path, "rb") as f:
+            fixtures[os.path.splitext(os.path.basename(path))[0]] = geminidataanalytics.Message.deserialize(f.read())
+    return fixtures
+
+
+def _clear_caches():
+    """描画キャッシュと結果の保存を空にする（初回描画の計測用）"""
+    get_render_cache.clear()
+    get_result_store.clear()
+
+
+def measure(msg, repeat: int) -> dict:
+    """
+    1つのメッセージの描画を計測する
+
+    時間は他の処理の割り込みによる揺れを除くため、repeat回の最小値とする
+    （timeitと同じく、計測中はGCを止める。前の計測のゴミは初回描画の計測ごとに回収しておく）
+
+    戻り値:
+        {"cold_ms": 初回描画の時間, "warm_ms": 再実行時の時間, "cold_alloc_kb": 初回描画のメモリ割り当てのピーク}
+    """
+    cold, warm = [], []
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            _clear_caches()
+            gc.collect()
+            start = time.perf_counter()
+            chat.show_message(msg)
+            cold.append(time.perf_counter() - start)
+
+        for _ in range(repeat):
+            start = time.perf_counter()
+            chat.show_message(msg)
+            warm.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+
+    _clear_caches()
+    tracemalloc.start()
+    chat.show_message(msg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "cold_ms": min(cold) * 1e3,
+        "warm_ms": min(warm) * 1e3,
+        "cold_alloc_kb": peak / 1024,
+    }
+
+
+def compare(
+    results: dict,
+    baseline: dict,
+    tolerance: float = DEFAULT_TOLERANCE,
+    cold_tolerance: float = DEFAULT_COLD_TOLERANCE,
+) -> list:
+    """
+    保存した結果と比較し、悪化した項目（メッセージ名, 計測項目, 基準値, 計測値）のリストを返す
+
+    悪化: 値が基準値の(1 + 許容割合)倍を超え、かつ差が最小の差（揺れの範囲）を超えたもの
+    初回描画の時間（cold_ms）にはcold_tolerance、それ以外にはtoleranceを使う
+    """
+    regressions = []
+    for name, values in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric, value in values.items():
+            if metric not in base:
+                continue
+            if metric == "cold_ms":
+                allowed, min_delta = cold_tolerance, MIN_COLD_DELTA_MS
+            else:
+                allowed = tolerance
+                min_delta = MIN_ALLOC_DELTA_KB if metric.endswith("_kb") else MIN_TIME_DELTA_MS
+            if value > base[metric] * (1 + allowed) and value - base[metric] > min_delta:
+                regressions.append((name, metric, base[metric], value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="メッセージのファイルを置いたディレクトリ")
+    parser.add_argument("--write-fixtures", action="store_true", help="代表的なメッセージを作成して終了する")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--save-baseline", metavar="PATH", help="計測結果をJSONで保存する")
+    parser.add_argument("--compare", metavar="PATH", help="保存した計測結果と比較する")
+    parser.add_argument(
+        "--tolerance", type=float, default=DEFAULT_TOLERANCE, help="許容する悪化の割合（0.3 = 30%%）"
+    )
+    parser.add_argument("--retries", type=int, default=3, help="悪化したメッセージを計測し直す回数")
+    parser.add_argument(
+        "--cold-tolerance", type=float, default=DEFAULT_COLD_TOLERANCE, help="初回描画の時間に許容する悪化の割合"
+    )
+    args = parser.parse_args()
+
+    if args.write_fixtures:
+        write_fixtures(args.fixtures)
+        return
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        # メッセージのファイルがない場合は代表的なメッセージを作成して保存する
+        write_fixtures(args.fixtures)
+        fixtures = load_fixtures(args.fixtures)
+    install_stub()
+
+    print(f"{'fixture':<20} {'handler':<8} {'初回 [ms]':>10} {'再実行 [ms]':>12} {'割り当て [KB]':>14}")
+    results = {}
+    for name, msg in fixtures.items():
+        results[name] = measure(msg, args.repeat)
+        r = results[name]
+        print(
+            f"{name:<20} {message_kind(msg) or '-':<8} {r['cold_ms']:>10.2f} {r['warm_ms']:>12.3f}"
+            f" {r['cold_alloc_kb']:>14.0f}"
+        )
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"saved baseline to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.cold_tolerance)
+        for _ in range(args.retries):
+            if not regressions:
+                break
+            for name in {r[0] for r in regressions}:
+                remeasured = measure(fixtures[name], args.repeat)
+                results[name] = {k: min(v, remeasured[k]) for k, v in results[name].items()}
+            regressions = compare(results, baseline, args.tolerance, args.cold_tolerance)
+        if regressions:
+            print("regressions:")
+            for name, metric, base, value in regressions:
+                print(f"  {name} {metric}: {base:.2f} → {value:.2f}")
+            sys.exit(1)
+        print(
+            f"no regressions against {args.compare}"
+            f" (tolerance {args.tolerance:.0%}, cold {args.cold_tolerance:.0%})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+BigQueryのドライランAPIのローカルスタブ
+生成SQLのコスト見積もり（utils.cost_estimator）を、BigQueryに接続せずに確認するためのHTTPサーバー
+
+jobs.insert（POST /bigquery/v2/projects/{project}/jobs）にドライランのジョブとして応答する
+推定スキャン量はSQLの長さから決まる固定値で、"FAIL"を含むSQLには構文エラー（400）を返す
+
+実行方法（リポジトリのルートで）:
+    python -m devtools.bq_stub --port 9050
+    BQ_API_ENDPOINT=http://localhost:9050 streamlit run app.py
+"""
+import argparse
+import json
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# SQLの1文字あたりの推定スキャン量（バイト）
+BYTES_PER_CHAR = 10 * 1024 * 1024
+
+_JOBS_PATH = re.compile(r"^/bigquery/v2/projects/([^/]+)/jobs/?$")
+
+
+def estimated_bytes(sql: str) -> int:
+    """スタブが返す推定スキャン量"""
+    return len(sql) * BYTES_PER_CHAR
+
+
+class DryRunHandler(BaseHTTPRequestHandler):
+    """ドライランのjobs.insertだけに応答するハンドラ"""
+
+    # 受け付けたリクエストの件数（テストでの確認用）
+    requests = 0
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int, reason: str, message: str):
+        self._send_json(status, {
+            "error": {"code": status, "message": message, "errors": [{"reason": reason, "message": message}]},
+        })
+
+    def do_POST(self):
+        match = _JOBS_PATH.match(self.path.split("?", 1)[0])
+        if not match:
+            self._send_error(404, "notFound", f"Not found: {self.path}")
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        configuration = body.get("configuration", {})
+        if not configuration.get("dryRun"):
+            self._send_error(400, "invalid", "This stub only supports dry-run queries")
+            return
+        type(self).requests += 1
+
+        sql = configuration.get("query", {}).get("query", "")
+        if "FAIL" in sql:
+            self._send_error(400, "invalidQuery", "Syntax error: Unexpected keyword FAIL")
+            return
+        total_bytes = str(estimated_bytes(sql))
+        job_reference = dict(body.get("jobReference", {}), projectId=match.group(1))
+        self._send_json(200, {
+            "kind": "bigquery#job",
+            "jobReference": job_reference,
+            "configuration": configuration,
+            "status": {"state": "DONE"},
+            "statistics": {
+                "totalBytesProcessed": total_bytes,
+                "query": {"totalBytesProcessed": total_bytes, "cacheHit": False, "statementType": "SELECT"},
+            },
+        })
+
+    def log_message(self, format, *args):
+        # リクエストごとのログは出力しない
+        pass
+
+
+def serve(port: int = 9050, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """スタブのサーバーを作成する（serve_forever()で開始）"""
+    return ThreadingHTTPServer((host, port), DryRunHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9050)
+    args = parser.parse_args()
+
+    server = serve(args.port, args.host)
+    print(f"BigQuery dry-run stub: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
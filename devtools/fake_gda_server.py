@@ -0,0 +1,386 @@
+"""
+Gemini Data Analytics APIのローカルスタブ（gRPCサーバー）
+エージェントの実行やBigQueryの料金を発生させずに、アプリの動作確認・負荷試験を行うためのサーバー
+
+DataAgentService・DataChatServiceの以下のRPCに、メモリ上のデータで応答する
+- エージェント: ListDataAgents / GetDataAgent / CreateDataAgent / DeleteDataAgent（操作は完了済みで返す）
+- 会話: ListConversations / GetConversation / CreateConversation（agent_idのフィルタに対応）
+- メッセージ: ListMessages（create_timeのフィルタに対応） / Chat（台本のメッセージを指定の間隔で返す）
+
+実行方法（リポジトリのルートで）:
+    python -m devtools.fake_gda_server --port 50051 --seed-conversations 5
+    GDA_API_ENDPOINT=http://localhost:50051 streamlit run app.py
+
+--scriptに保存したメッセージ（.pbファイル、benchmarks/fixturesと同じ形式）のディレクトリを指定すると、
+その内容をファイル名順にChatの回答として返す
+"""
+import argparse
+import datetime
+import glob
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent import futures
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import grpc
+from google.cloud import geminidataanalytics
+from google.longrunning import operations_pb2
+from google.protobuf import any_pb2, empty_pb2
+
+from benchmarks.bench_dataframe import build_data_message
+
+_AGENT_SERVICE = "google.cloud.geminidataanalytics.v1alpha.DataAgentService"
+_CHAT_SERVICE = "google.cloud.geminidataanalytics.v1alpha.DataChatService"
+
+# 一覧の既定のページサイズ
+DEFAULT_PAGE_SIZE = 50
+# Chatの台本の各段階までの既定の待ち時間（秒）：スキーマ解決 → SQL生成 → データ取得 → チャート生成 → 回答
+DEFAULT_STEP_DELAYS = [1.0, 2.0, 3.0, 1.5, 1.0]
+# 台本のデータ取得の行数
+DEFAULT_RESULT_ROWS = 100
+
+_AGENT_FILTER = re.compile(r'agent_id\s*=\s*"([^"]+)"')
+_TIME_FILTER = re.compile(r'create_time\s*([<>])\s*"([^"]+)"')
+
+
+@dataclass
+class ScriptStep:
+    """Chatの回答の1メッセージと、その前の待ち時間（秒）"""
+    delay: float
+    message: geminidataanalytics.Message
+
+
+def _system(**kwargs) -> geminidataanalytics.Message:
+    return geminidataanalytics.Message(system_message=geminidataanalytics.SystemMessage(**kwargs))
+
+
+def default_script(delays: List[float] = DEFAULT_STEP_DELAYS, rows: int = DEFAULT_RESULT_ROWS) -> List[ScriptStep]:
+    """実際のエージェントの回答を模した台本（スキーマ → SQL → データ → チャート → テキスト）"""
+    sql = (
+        "SELECT user_id, user_name, action_name, SUM(total_point) AS total_point\n"
+        "FROM `proj.ds.log_point`\n"
+        "WHERE date = DATE_SUB(CURRENT_DATE('Asia/Tokyo'), INTERVAL 1 DAY)\n"
+        "GROUP BY 1, 2, 3 ORDER BY total_point DESC LIMIT 100"
+    )
+    chart = geminidataanalytics.ChartMessage()
+    geminidataanalytics.ChartMessage.pb(chart).result.vega_config.update({
+        "$schema": "https://vega.github.io/schema/vega-lite/v5.json",
+        "mark": "bar",
+        "encoding": {
+            "x": {"field": "user_name", "type": "nominal"},
+            "y": {"field": "total_point", "type": "quantitative"},
+        },
+        "data": {"values": [{"user_name": f"user{i}", "total_point": 1000 - i * 10} for i in range(20)]},
+    })
+    messages = [
+        _system(schema=geminidataanalytics.SchemaMessage(
+            query=geminidataanalytics.SchemaQuery(question="昨日最もポイントを消費したユーザー"),
+        )),
+        _system(data=geminidataanalytics.DataMessage(generated_sql=sql)),
+        _system(data=build_data_message(rows)),
+        _system(chart=chart),
+        _system(text=geminidataanalytics.TextMessage(parts=["昨日最もポイントを消費したのはuser0でした。"])),
+    ]
+    return [ScriptStep(delay, message) for delay, message in zip(delays, messages)]
+
+
+def load_script(directory: str, delay: float) -> List[ScriptStep]:
+    """保存したメッセージ（.pbファイル）をファイル名順に読み込み、台本にする"""
+    steps = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.pb"))):
+        with open(path, "rb") as f:
+            steps.append(ScriptStep(delay, geminidataanalytics.Message.deserialize(f.read())))
+    return steps
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _rfc3339_to_datetime(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _page(items: list, page_size: int, page_token: str):
+    """一覧の1ページ分と次のページトークン（トークンは先頭からの位置）"""
+    start = int(page_token or 0)
+    end = start + (page_size or DEFAULT_PAGE_SIZE)
+    return items[start:end], str(end) if end < len(items) else ""
+
+
+class FakeDataAnalytics:
+    """
+    エージェント・会話・メッセージをメモリに保持し、RPCに応答するスタブ
+
+    引数:
+        script: Chatで返す台本
+        rpc_latency: Chat以外のRPCの応答までの待ち時間（秒、APIの往復時間を模す）
+    """
+
+    def __init__(self, script: Optional[List[ScriptStep]] = None, rpc_latency: float = 0.0):
+        self.script = script if script is not None else default_script()
+        self.rpc_latency = rpc_latency
+        self._lock = threading.Lock()
+        self._agents: Dict[str, geminidataanalytics.DataAgent] = {}
+        self._convos: Dict[str, geminidataanalytics.Conversation] = {}
+        # 会話名 → 時系列順のメッセージ
+        self._messages: Dict[str, List[geminidataanalytics.Message]] = {}
+        # RPC名 → 呼び出し回数
+        self.calls: Dict[str, int] = {}
+
+    def _called(self, method: str):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if self.rpc_latency:
+            time.sleep(self.rpc_latency)
+
+    # ---- エージェント ----
+
+    def add_agent(self, agent: geminidataanalytics.DataAgent) -> geminidataanalytics.DataAgent:
+        agent = geminidataanalytics.DataAgent(agent)
+        agent.create_time = agent.update_time = _now()
+        with self._lock:
+            self._agents[agent.name] = agent
+        return agent
+
+    def list_data_agents(self, request: geminidataanalytics.ListDataAgentsRequest, context):
+        self._called("ListDataAgents")
+        with self._lock:
+            agents = [a for a in self._agents.values() if a.name.startswith(f"{request.parent}/")]
+        page, token = _page(agents, request.page_size, request.page_token)
+        return geminidataanalytics.ListDataAgentsResponse(data_agents=page, next_page_token=token)
+
+    def get_data_agent(self, request: geminidataanalytics.GetDataAgentRequest, context):
+        self._called("GetDataAgent")
+        with self._lock:
+            agent = self._agents.get(request.name)
+        if agent is None:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"DataAgent {request.name} not found")
+        return agent
+
+    def create_data_agent(self, request: geminidataanalytics.CreateDataAgentRequest, context):
+        self._called("CreateDataAgent")
+        agent = geminidataanalytics.DataAgent(request.data_agent)
+        agent.name = f"{request.parent}/dataAgents/{request.data_agent_id or f'a{uuid.uuid4()}'}"
+        agent = self.add_agent(agent)
+        return self._done_operation(geminidataanalytics.DataAgent.pb(agent))
+
+    def delete_data_agent(self, request: geminidataanalytics.DeleteDataAgentRequest, context):
+        self._called("DeleteDataAgent")
+        with self._lock:
+            self._agents.pop(request.name, None)
+        return self._done_operation(empty_pb2.Empty())
+
+    @staticmethod
+    def _done_operation(response) -> operations_pb2.Operation:
+        """完了済みの長時間実行オペレーション（クライアントはポーリングせずに結果を返す）"""
+        packed = any_pb2.Any()
+        packed.Pack(response)
+        return operations_pb2.Operation(name=f"operations/{uuid.uuid4()}", done=True, response=packed)
+
+    # ---- 会話 ----
+
+    def add_conversation(self, parent: str, agent_name: str) -> geminidataanalytics.Conversation:
+        now = _now()
+        convo = geminidataanalytics.Conversation(
+            name=f"{parent}/conversations/{uuid.uuid4()}",
+            agents=[agent_name],
+            create_time=now,
+            last_used_time=now,
+        )
+        with self._lock:
+            self._convos[convo.name] = convo
+            self._messages[convo.name] = []
+        return convo
+
+    def create_conversation(self, request: geminidataanalytics.CreateConversationRequest, context):
+        self._called("CreateConversation")
+        agent_name = request.conversation.agents[0] if request.conversation.agents else ""
+        return self.add_conversation(request.parent, agent_name)
+
+    def get_conversation(self, request: geminidataanalytics.GetConversationRequest, context):
+        self._called("GetConversation")
+        with self._lock:
+            convo = self._convos.get(request.name)
+        if convo is None:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"Conversation {request.name} not found")
+        return convo
+
+    def list_conversations(self, request: geminidataanalytics.ListConversationsRequest, context):
+        self._called("ListConversations")
+        match = _AGENT_FILTER.search(request.filter)
+        with self._lock:
+            convos = [
+                c for c in self._convos.values()
+                if c.name.startswith(f"{request.parent}/")
+                and (match is None or any(a.split("/")[-1] == match.group(1) for a in c.agents))
+            ]
+        convos.sort(key=lambda c: c.create_time, reverse=True)
+        page, token = _page(convos, request.page_size, request.page_token)
+        return geminidataanalytics.ListConversationsResponse(conversations=page, next_page_token=token)
+
+    # ---- メッセージ ----
+
+    def _append(self, convo_name: str, message: geminidataanalytics.Message) -> geminidataanalytics.Message:
+        message = geminidataanalytics.Message(message)
+        message.message_id = str(uuid.uuid4())
+        message.timestamp = _now()
+        with self._lock:
+            self._messages.setdefault(convo_name, []).append(message)
+            convo = self._convos.get(convo_name)
+            if convo is not None:
+                convo.last_used_time = message.timestamp
+        return message
+
+    def list_messages(self, request: geminidataanalytics.ListMessagesRequest, context):
+        self._called("ListMessages")
+        with self._lock:
+            msgs = list(self._messages.get(request.parent, []))
+        for op, value in _TIME_FILTER.findall(request.filter):
+            bound = _rfc3339_to_datetime(value)
+            msgs = [m for m in msgs if (m.timestamp < bound if op == "<" else m.timestamp > bound)]
+        # APIと同じく新しい順で返す
+        msgs.reverse()
+        page, token = _page(msgs, request.page_size, request.page_token)
+        return geminidataanalytics.ListMessagesResponse(
+            messages=[geminidataanalytics.StorageMessage(message_id=m.message_id, message=m) for m in page],
+            next_page_token=token,
+        )
+
+    def seed(self, agent: geminidataanalytics.DataAgent, conversations: int, turns: int = 1) -> List[str]:
+        """
+        エージェントと、台本の回答を含む会話を作成しておく（会話一覧・履歴の読み込みの確認用）
+
+        戻り値:
+            作成した会話の名前（古い順）
+        """
+        agent = self.add_agent(agent)
+        parent = agent.name.rsplit("/dataAgents/", 1)[0]
+        names = []
+        for i in range(conversations):
+            convo = self.add_conversation(parent, agent.name)
+            for turn in range(turns):
+                self._append(convo.name, geminidataanalytics.Message(user_message={"text": f"質問{i}-{turn}"}))
+                for step in self.script:
+                    self._append(convo.name, step.message)
+            names.append(convo.name)
+        return names
+
+    def chat(self, request: geminidataanalytics.ChatRequest, context):
+        """台本のメッセージを待ち時間を置いて順に返す（クライアントがキャンセルしたら止める）"""
+        self._called("Chat")
+        convo_name = request.conversation_reference.conversation
+        for message in request.messages:
+            self._append(convo_name, message)
+        for step in self.script:
+            if step.delay and not _sleep_while_active(context, step.delay):
+                return
+            yield self._append(convo_name, step.message) if convo_name else step.message
+
+
+def _sleep_while_active(context, seconds: float) -> bool:
+    """指定秒数待つ（途中でRPCが終了した場合はFalse）"""
+    deadline = time.monotonic() + seconds
+    while context.is_active():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return True
+        time.sleep(min(remaining, 0.05))
+    return False
+
+
+def _handler(method, request_type, response_type, streaming: bool = False):
+    """proto-plusの型でシリアライズするRPCハンドラ"""
+    if response_type is None:
+        serializer = None
+    elif hasattr(response_type, "serialize"):
+        serializer = response_type.serialize
+    else:
+        serializer = response_type.SerializeToString
+    factory = grpc.unary_stream_rpc_method_handler if streaming else grpc.unary_unary_rpc_method_handler
+    return factory(method, request_deserializer=request_type.deserialize, response_serializer=serializer)
+
+
+def generic_handlers(fake: FakeDataAnalytics) -> list:
+    """スタブの各RPCをgRPCサーバーに登録するハンドラ"""
+    g = geminidataanalytics
+    agent_handlers = {
+        "ListDataAgents": _handler(fake.list_data_agents, g.ListDataAgentsRequest, g.ListDataAgentsResponse),
+        "GetDataAgent": _handler(fake.get_data_agent, g.GetDataAgentRequest, g.DataAgent),
+        "CreateDataAgent": _handler(fake.create_data_agent, g.CreateDataAgentRequest, operations_pb2.Operation),
+        "DeleteDataAgent": _handler(fake.delete_data_agent, g.DeleteDataAgentRequest, operations_pb2.Operation),
+    }
+    chat_handlers = {
+        "Chat": _handler(fake.chat, g.ChatRequest, g.Message, streaming=True),
+        "CreateConversation": _handler(fake.create_conversation, g.CreateConversationRequest, g.Conversation),
+        "GetConversation": _handler(fake.get_conversation, g.GetConversationRequest, g.Conversation),
+        "ListConversations": _handler(
+            fake.list_conversations, g.ListConversationsRequest, g.ListConversationsResponse,
+        ),
+        "ListMessages": _handler(fake.list_messages, g.ListMessagesRequest, g.ListMessagesResponse),
+    }
+    return [
+        grpc.method_handlers_generic_handler(_AGENT_SERVICE, agent_handlers),
+        grpc.method_handlers_generic_handler(_CHAT_SERVICE, chat_handlers),
+    ]
+
+
+def serve(fake: FakeDataAnalytics, port: int = 50051, host: str = "127.0.0.1", max_workers: int = 64):
+    """
+    スタブのgRPCサーバーを開始する
+
+    戻り値:
+        (grpc.Server, 待ち受けているポート番号)（port=0の場合は空いているポートを使う）
+    """
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    server.add_generic_rpc_handlers(generic_handlers(fake))
+    bound = server.add_insecure_port(f"{host}:{port}")
+    server.start()
+    return server, bound
+
+
+def default_agent(project_id: str) -> geminidataanalytics.DataAgent:
+    """固定エージェント（state.DEFAULT_AGENT_NAME）と同じ表示名のエージェント"""
+    agent = geminidataanalytics.DataAgent(
+        name=f"projects/{project_id}/locations/global/dataAgents/a{uuid.uuid4()}",
+        display_name="JamboGPT",
+    )
+    agent.data_analytics_agent.published_context.system_instruction = "回答は日本語で行う"
+    return agent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--project", default="test-project", help="作成しておくエージェントのプロジェクトID")
+    parser.add_argument("--seed-conversations", type=int, default=0, help="作成しておく会話の数（0ならエージェントも作成しない）")
+    parser.add_argument("--script", metavar="DIR", help="Chatで返すメッセージ（.pbファイル）のディレクトリ")
+    parser.add_argument("--delay-scale", type=float, default=1.0, help="Chatの待ち時間の倍率（0で待たない）")
+    parser.add_argument("--rpc-latency", type=float, default=0.0, help="Chat以外のRPCの応答までの待ち時間（秒）")
+    args = parser.parse_args()
+
+    if args.script:
+        script = load_script(args.script, 1.0 * args.delay_scale)
+    else:
+        script = default_script([d * args.delay_scale for d in DEFAULT_STEP_DELAYS])
+    fake = FakeDataAnalytics(script, rpc_latency=args.rpc_latency)
+    if args.seed_conversations:
+        fake.seed(default_agent(args.project), args.seed_conversations)
+
+    server, port = serve(fake, args.port, args.host)
+    print(f"Gemini Data Analytics stub: http://{args.host}:{port}")
+    try:
+        server.wait_for_termination()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop(grace=None)
+
+
+if __name__ == "__main__":
+    main()
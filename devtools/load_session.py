@@ -0,0 +1,56 @@
+"""
+負荷試験（devtools.load_test）の1セッション分の操作
+Streamlitのスクリプトとして実行し、init_state → 履歴の表示 → create_convo → チャット（1回の質問）の各段階の時間を
+セッション状態のload_timingsに記録する
+
+質問はload_test側がセッション状態のload_questionに設定する
+"""
+import time
+
+import streamlit as st
+from google.cloud import geminidataanalytics
+
+from app_pages.chat import build_chat_request
+from state import PENDING_MESSAGES_KEY, append_convo_message, apply_pending_messages, create_convo, init_state
+from utils.chat_stream import ChatStreamWorker
+
+
+def run():
+    state = st.session_state
+    if "initialized" not in state:
+        state.load_started = time.perf_counter()
+        # 初期化の最後にst.rerun()で再実行される
+        init_state()
+
+    # init_stateはサイドバーを表示できる時点（エージェント・会話一覧の取得後）で終わる
+    timings = {"init_state": time.perf_counter() - state.load_started}
+    state.load_timings = timings
+    if PENDING_MESSAGES_KEY in state:
+        apply_pending_messages()
+    timings["history"] = time.perf_counter() - state.load_started
+    if not state.current_agent:
+        state.load_error = "エージェントを取得できませんでした"
+        return
+
+    start = time.perf_counter()
+    convo = create_convo(agent=state.current_agent)
+    timings["create_convo"] = time.perf_counter() - start
+    if convo is None:
+        state.load_error = "会話を作成できませんでした"
+        return
+    state.current_convo = convo
+
+    question = state.load_question
+    start = time.perf_counter()
+    append_convo_message(geminidataanalytics.Message(user_message={"text": question}))
+    worker = ChatStreamWorker(state.chat_client, build_chat_request(question, state.current_agent, convo))
+    for message in worker.iter_messages():
+        append_convo_message(message)
+    timings["chat"] = time.perf_counter() - start
+    if worker.first_message_at is not None:
+        timings["first_message"] = worker.first_message_at
+    if worker.error:
+        state.load_error = f"回答の取得中にエラーが発生しました: {worker.error}"
+
+
+run()
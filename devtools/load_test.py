@@ -0,0 +1,264 @@
+"""
+同時セッションの負荷試験
+Gemini Data Analytics APIのスタブ（devtools.fake_gda_server）に対して、Streamlitのセッションを並行に実行し、
+init_state → create_convo → チャット（1回の質問）の各段階の時間とプロセスのメモリ使用量を計測する
+
+- 各セッションはstreamlit.testingのスクリプト実行で動かす（セッション状態・st.cache_resourceは実際のアプリと同じ）
+- 全セッションが同じプロセスで動くため、プロセスのメモリ使用量は1つのPodのメモリ使用量の目安になる
+- --memory-limit-mbを指定すると、メモリ上限から1つのPodで同時に処理できるセッション数を見積もる
+
+実行方法（リポジトリのルートで）:
+    python -m devtools.load_test --sessions 50 --concurrency 10
+    python -m devtools.load_test --sessions 200 --concurrency 50 --delay-scale 0.2 --memory-limit-mb 2048
+
+--endpointを指定した場合は、別に起動したスタブ（python -m devtools.fake_gda_server）に接続する
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from unittest.mock import MagicMock
+
+import streamlit as st
+from streamlit import logger as streamlit_logger
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.pages_manager import PagesManager
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.runtime.secrets import Secrets
+from streamlit.runtime.state.common import TESTING_KEY
+from streamlit.runtime.state.safe_session_state import SafeSessionState
+from streamlit.runtime.state.session_state import SessionState
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+from streamlit.testing.v1.util import patch_config_options
+
+from devtools.fake_gda_server import DEFAULT_STEP_DELAYS, FakeDataAnalytics, default_agent, default_script, serve
+
+# 計測する段階（表示順）
+PHASES = ["init_state", "history", "create_convo", "first_message", "chat", "session"]
+# メモリ使用量を記録する間隔（秒）
+MEMORY_SAMPLE_SECONDS = 0.2
+# 1セッション分の操作（Streamlitのスクリプト）
+SESSION_SCRIPT = os.path.join(os.path.dirname(__file__), "load_session.py")
+# 1セッションの実行の上限（秒）
+SESSION_TIMEOUT_SECONDS = 300
+
+
+class PodRuntime:
+    """
+    複数のセッションを同じプロセスで実行するための、Streamlitの実行環境（with文の間だけ有効）
+
+    AppTestは実行のたびにプロセス全体の設定（Runtime・st.secrets）を差し替えるため並行に実行できない
+    ここでは設定を最初に1回だけ行い、セッションごとにスクリプトの実行（LocalScriptRunner）だけを作る
+    """
+
+    def __init__(self, project_id: str):
+        self._project_id = project_id
+        self._saved_secrets = None
+        self._config = None
+
+    def __enter__(self):
+        runtime = MagicMock(spec=Runtime)
+        runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+        runtime.cache_storage_manager = MemoryCacheStorageManager()
+        Runtime._instance = runtime
+        self._saved_secrets = st.secrets
+        secrets = Secrets()
+        secrets._secrets = {"cloud": {"project_id": self._project_id}}
+        st.secrets = secrets
+        self._config = patch_config_options({"global.appTest": True})
+        self._config.__enter__()
+        # セッションの外（スクリプトの実行前）でセッション状態を作る際の警告を出さない
+        streamlit_logger.get_logger("streamlit.runtime.scriptrunner_utils.script_run_context").disabled = True
+        return self
+
+    def __exit__(self, *args):
+        self._config.__exit__(*args)
+        st.secrets = self._saved_secrets
+        Runtime._instance = None
+        return False
+
+    def run_session(self, index: int) -> dict:
+        """
+        1セッションを実行する（devtools/load_session.py）
+
+        戻り値:
+            {"init_state": 秒, "history": 秒, "create_convo": 秒, "first_message": 秒, "chat": 秒, "session": 秒, "error": 文字列}
+            （エラーで到達しなかった段階は含まない）
+        """
+        session_state = SessionState()
+        session_state[TESTING_KEY] = {}
+        session_state["load_question"] = f"昨日のポイント消費上位10名（{index}）"
+        state = SafeSessionState(session_state, lambda: None)
+        runner = LocalScriptRunner(
+            SESSION_SCRIPT, state, PagesManager(SESSION_SCRIPT, ScriptCache(), setup_watcher=False),
+        )
+        start = time.perf_counter()
+        try:
+            tree = runner.run(timeout=SESSION_TIMEOUT_SECONDS)
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+        result = dict(state["load_timings"]) if "load_timings" in state else {}
+        result["session"] = time.perf_counter() - start
+        errors = [e.value for e in tree.error] + [e.value for e in tree.exception]
+        if "load_error" in state:
+            errors.append(state["load_error"])
+        if errors:
+            result["error"] = " / ".join(str(e) for e in errors)
+        return result
+
+
+def percentile(values: List[float], p: float) -> float:
+    """値のpパーセンタイル（最近順位法）"""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def _read_rss_bytes() -> Optional[int]:
+    """プロセスの常駐メモリ（RSS）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _read_cgroup_bytes() -> Optional[int]:
+    """コンテナ（cgroup）全体のメモリ使用量（Podのメモリ上限と比較する値、取得できなければNone）"""
+    for path in ("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory/memory.usage_in_bytes"):
+        try:
+            with open(path) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+class MemorySampler:
+    """一定間隔でメモリ使用量を記録し、最大値を保持する"""
+
+    def __init__(self, interval: float = MEMORY_SAMPLE_SECONDS):
+        self._interval = interval
+        self._stop = threading.Event()
+        self.baseline = {"rss": _read_rss_bytes(), "cgroup": _read_cgroup_bytes()}
+        self.peak = dict(self.baseline)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.sample()
+
+    def sample(self):
+        for name, value in (("rss", _read_rss_bytes()), ("cgroup", _read_cgroup_bytes())):
+            if value is not None and (self.peak[name] is None or value > self.peak[name]):
+                self.peak[name] = value
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+        return False
+
+
+def summarize(results: List[dict], elapsed: float, memory: MemorySampler, concurrency: int) -> dict:
+    """各段階の時間のパーセンタイル、エラー数、メモリ使用量をまとめる"""
+    summary = {"sessions": len(results), "elapsed": elapsed, "phases": {}, "memory": {}}
+    for phase in PHASES:
+        values = [r[phase] for r in results if phase in r]
+        if values:
+            summary["phases"][phase] = {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": max(values),
+            }
+    errors = [r["error"] for r in results if "error" in r]
+    summary["errors"] = len(errors)
+    summary["error_samples"] = sorted(set(errors))[:5]
+    for name in ("rss", "cgroup"):
+        if memory.baseline[name] is not None:
+            summary["memory"][name] = {"baseline": memory.baseline[name], "peak": memory.peak[name]}
+    rss = summary["memory"].get("rss")
+    if rss:
+        # 同時に実行したセッション1つあたりの増加分
+        summary["memory"]["per_session"] = max(0, rss["peak"] - rss["baseline"]) / max(1, concurrency)
+    return summary
+
+
+def print_summary(summary: dict, memory_limit_mb: Optional[float] = None):
+    mb = 1024 * 1024
+    print(f"{summary['sessions']}セッション / {summary['elapsed']:.1f}秒 / エラー{summary['errors']}件")
+    for error in summary["error_samples"]:
+        print(f"  {error}")
+    print(f"{'段階':<14} {'件数':>6} {'p50 [s]':>9} {'p95 [s]':>9} {'p99 [s]':>9} {'最大 [s]':>9}")
+    for phase, s in summary["phases"].items():
+        print(f"{phase:<14} {s['count']:>6} {s['p50']:>9.3f} {s['p95']:>9.3f} {s['p99']:>9.3f} {s['max']:>9.3f}")
+    for name, label in (("rss", "プロセスRSS"), ("cgroup", "コンテナ")):
+        m = summary["memory"].get(name)
+        if m:
+            print(f"{label}: 開始時 {m['baseline'] / mb:.0f} MB → 最大 {m['peak'] / mb:.0f} MB")
+    per_session = summary["memory"].get("per_session")
+    if per_session:
+        print(f"同時セッション1つあたり: {per_session / mb:.1f} MB")
+        if memory_limit_mb:
+            available = memory_limit_mb * mb - summary["memory"]["rss"]["baseline"]
+            print(f"メモリ上限{memory_limit_mb:.0f} MBのPodで同時に処理できるセッション数の目安: {int(available // per_session)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20, help="実行するセッションの総数")
+    parser.add_argument("--concurrency", type=int, default=5, help="同時に実行するセッション数")
+    parser.add_argument("--endpoint", help="接続するスタブ（例: http://localhost:50051、省略時はこのプロセスで起動）")
+    parser.add_argument("--project", default="test-project")
+    parser.add_argument("--seed-conversations", type=int, default=5, help="スタブに作成しておく会話の数")
+    parser.add_argument("--delay-scale", type=float, default=1.0, help="スタブのChatの待ち時間の倍率")
+    parser.add_argument("--rpc-latency", type=float, default=0.05, help="スタブのChat以外のRPCの待ち時間（秒）")
+    parser.add_argument("--cache-dir", help="ローカルの保存先（省略時は一時ディレクトリ）")
+    parser.add_argument("--memory-limit-mb", type=float, help="Podのメモリ上限（同時セッション数の見積もりに使う）")
+    parser.add_argument("--json", metavar="PATH", help="結果をJSONで保存する")
+    args = parser.parse_args()
+
+    server = None
+    endpoint = args.endpoint
+    if endpoint is None:
+        script = default_script([d * args.delay_scale for d in DEFAULT_STEP_DELAYS])
+        fake = FakeDataAnalytics(script, rpc_latency=args.rpc_latency)
+        if args.seed_conversations:
+            fake.seed(default_agent(args.project), args.seed_conversations)
+        server, port = serve(fake, port=0)
+        endpoint = f"http://127.0.0.1:{port}"
+    # アプリのモジュール（utils.clients・utils.local_store）は読み込み時に接続先・保存先を決めるため、先に設定する
+    os.environ["GDA_API_ENDPOINT"] = endpoint
+    os.environ["JAMBOGPT_CACHE_DIR"] = args.cache_dir or tempfile.mkdtemp(prefix="jambogpt-load-")
+
+    print(f"{endpoint}に{args.sessions}セッション（同時{args.concurrency}）を実行します")
+    start = time.perf_counter()
+    with PodRuntime(args.project) as pod, MemorySampler() as memory:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(pod.run_session, range(args.sessions)))
+    summary = summarize(results, time.perf_counter() - start, memory, min(args.concurrency, args.sessions))
+    if server is not None:
+        server.stop(grace=None)
+
+    print_summary(summary, args.memory_limit_mb)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        print(f"saved results to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,62 +2,150 @@
 グローバル状態管理モジュール
 st.session_stateを使用してAPIクライアント、エージェント、会話、メッセージを管理する
 """
+import time
 import uuid
 import streamlit as st
 from google.cloud import geminidataanalytics
-from google.cloud import bigquery
 from google.api_core import exceptions as google_exceptions
+from utils.agent_catalog import get_agent_catalog
+from utils.bootstrap import Speculation, get_bootstrap_executor
+from utils.clients import get_client_pool
+from utils.conversations import CONVO_PAGE_SIZE, ConversationIndex
+from utils.local_store import get_local_store, micros_to_rfc3339, to_micros
+from utils.message_cache import PREFETCH_TOP_K, convo_version, get_message_cache, get_prefetch_executor
+from utils.reference_data import load_reference_data
 from utils.templates import load_template
 
 # 固定エージェント用のテンプレートファイル名
 DEFAULT_TEMPLATE = "jambo_default.yaml"
 # 固定エージェントの表示名
 DEFAULT_AGENT_NAME = "JamboGPT"
+# 会話を開いたとき・過去分を読み込むときに1回で取得するメッセージ数
+MESSAGE_PAGE_SIZE = 50
+# セッションに保持するメッセージ数の上限（長い会話でもメモリ使用量を一定に保つ）
+MAX_HISTORY_MESSAGES = 300
+# 保存済みの会話を同期するときに取得するページ数の上限（超える分は過去分の読み込みで補う）
+MAX_SYNC_PAGES = MAX_HISTORY_MESSAGES // MESSAGE_PAGE_SIZE
+# ローカルに保存した会話一覧を、APIに問い合わせずにそのまま使う期間（秒）
+CONVO_SYNC_INTERVAL_SECONDS = 60
+# 前回のセッションで使ったエージェントの名前を保存するキー（次のセッション開始時の先読みに使う）
+LAST_AGENT_META_KEY = "last_agent_name"
+# init_stateで取得を開始したメッセージ（会話名, Future）を保持するセッション状態のキー
+PENDING_MESSAGES_KEY = "pending_messages"
+# 先読みキャッシュから表示した会話の最新の状態の確認（会話名, Future）を保持するセッション状態のキー
+REVALIDATE_MESSAGES_KEY = "revalidate_messages"
+# キャッシュから表示した会話の確認が終わったかを調べる間隔（秒）。確認中はキャッシュの内容のまま表示し、待たない
+REVALIDATE_POLL_SECONDS = 0.5
 
 def init_state():
     """
     セッション状態を初期化する（セッション開始時に1回だけ実行）
 
     処理内容:
-    1. APIクライアント（DataAgentServiceClient, DataChatServiceClient）を作成
+    1. プロセス共有のクライアントプールからAPIクライアントを取得
     2. 既存のエージェントを取得、なければテンプレートから自動作成
     3. 固定エージェントの会話一覧を取得
-    4. 最新の会話を選択し、そのメッセージ一覧を取得
+    4. 最新の会話を選択し、そのメッセージ一覧の取得を開始
+
+    2〜4は共有のスレッドプールで並列に実行する
+    前回のセッションで使ったエージェントが分かっている場合は、エージェント一覧の取得と同時に
+    その会話一覧と最新の会話のメッセージを先読みする
+    メッセージの取得は待たずに画面を再描画し（サイドバーを先に表示する）、
+    チャット画面がapply_pending_messagesで結果を反映する
     """
     state = st.session_state
 
     state.agents = []
     state.convos = []
-    state.convo_messages = []
-
-    state.agent_client = geminidataanalytics.DataAgentServiceClient()
-    state.chat_client = geminidataanalytics.DataChatServiceClient()
+    reset_messages_state()
+
+    # 全セッションで共有するチャネルプール経由のクライアントを使用
+    pool = get_client_pool()
+    pool.register_session()
+    state.agent_client = pool.agent_client
+    state.chat_client = pool.chat_client
+
+    executor = get_bootstrap_executor()
+    store = get_local_store()
+    cache = get_message_cache()
+    chat_client = state.chat_client
+    parent = f"projects/{st.secrets.cloud.project_id}/locations/global"
+
+    # エージェント一覧の取得と同時に、前回のエージェントの会話一覧・最新の会話のメッセージを先読みする
+    agents_future = executor.submit(_list_agents, state.agent_client, parent)
+    last_agent = store.get_meta(LAST_AGENT_META_KEY)
+    convos_spec = Speculation()
+    messages_spec = Speculation()
+    if last_agent:
+        convos_spec = Speculation(
+            last_agent, executor.submit(_load_convo_index, chat_client, store, parent, last_agent),
+        )
+        local_latest = store.conversations(last_agent, 1)
+        if local_latest:
+            messages_spec = Speculation(
+                _convo_version(local_latest[0]),
+                executor.submit(_load_recent_messages, chat_client, store, local_latest[0], cache),
+            )
 
-    fetch_agents_state(rerun=False)
+    try:
+        state.agents = agents_future.result()
+    except google_exceptions.GoogleAPICallError as e:
+        st.error(f"API error fetching agents: {e}")
+    except Exception as e:
+        st.error(f"Unexpected error: {e}")
 
     # エージェントがなければテンプレートから自動作成
     if not state.agents:
         _create_default_agent()
-        fetch_agents_state(rerun=False)
+        fetch_agents_state(rerun=False, force=True)
 
     # 固定エージェントを設定
     state.current_agent = state.agents[0] if state.agents else None
 
     if state.current_agent:
-        fetch_convos_state(agent=state.current_agent, rerun=False)
+        agent_name = state.current_agent.name
+        if agent_name != last_agent:
+            store.set_meta(LAST_AGENT_META_KEY, agent_name)
+        future = convos_spec.take(
+            agent_name, lambda: executor.submit(_load_convo_index, chat_client, store, parent, agent_name),
+        )
+        try:
+            state.convo_index, error = future.result()
+            state.convos = state.convo_index.conversations(agent_name)
+            if error is not None:
+                _show_fetch_error("convos", error)
+        except Exception as e:
+            _show_fetch_error("convos", e)
 
     state.current_convo = None
     if state.convos:
         state.current_convo = state.convos[0]
 
     if state.current_convo:
-        fetch_messages_state(convo=state.current_convo, rerun=False)
+        convo = state.current_convo
+        future = messages_spec.take(
+            _convo_version(convo), lambda: executor.submit(_load_recent_messages, chat_client, store, convo, cache),
+        )
+        state[PENDING_MESSAGES_KEY] = (convo.name, future)
 
     # 初期化完了フラグを設定し、画面を再描画
     state.initialized = True
     st.rerun()
 
 
+def _convo_version(convo):
+    """会話とその最終利用時刻の組（メッセージの先読みの前提。最終利用時刻が変わっていれば読み直す）"""
+    return convo.name, convo_version(convo)
+
+
+def _show_fetch_error(target: str, e: Exception):
+    """取得処理のエラーを表示する"""
+    if isinstance(e, google_exceptions.GoogleAPICallError):
+        st.error(f"API error fetching {target}: {e}")
+    else:
+        st.error(f"Unexpected error: {e}")
+
+
 def _create_default_agent():
     """
     デフォルトテンプレートからエージェントを自動作成する
@@ -111,22 +199,20 @@ def _create_default_agent():
         st.error(f"予期しないエラー: {e}")
 
 
-def fetch_agents_state(rerun=True):
+def fetch_agents_state(rerun=True, force=False):
     """
     全てのデータエージェントを取得してセッション状態に保存する
+    一覧は全セッション共有のキャッシュから取得し、期限切れ・未取得の場合のみAPIを呼ぶ
 
     引数:
         rerun: Trueの場合、取得後に画面を再描画する
+        force: Trueの場合、キャッシュを使わずにAPIから再取得する
     """
     state = st.session_state
-    client = state.agent_client
-    project_id = st.secrets.cloud.project_id
+    parent = f"projects/{st.secrets.cloud.project_id}/locations/global"
 
     try:
-        request = geminidataanalytics.ListDataAgentsRequest(
-            parent=f"projects/{project_id}/locations/global"
-        )
-        agents = list(client.list_data_agents(request=request))
+        agents = _list_agents(state.agent_client, parent, force=force)
         state.agents = agents if len(agents) > 0 else []
         if rerun:
             st.rerun()
@@ -136,9 +222,17 @@ def fetch_agents_state(rerun=True):
         st.error(f"Unexpected error: {e}")
 
 
+def _list_agents(agent_client, parent, force=False):
+    """エージェント一覧を全セッション共有のキャッシュから取得する（スレッドプールからも呼べる）"""
+    request = geminidataanalytics.ListDataAgentsRequest(parent=parent)
+    return get_agent_catalog().get(lambda: agent_client.list_data_agents(request=request), force=force)
+
+
 def fetch_convos_state(agent=None, rerun=True):
     """
-    指定されたエージェントの会話一覧を取得する（最大100件）
+    指定されたエージェントの会話一覧を取得する
+    ローカルに保存済みの会話を先に一覧に入れ、保存から時間が経っている場合のみ最初のページをAPIから取得する
+    会話の索引（エージェント→会話一覧）を作り直し、以降はfetch_more_convos_stateで追加取得する
 
     引数:
         agent: 対象のエージェント（Noneの場合は何もしない）
@@ -148,33 +242,171 @@ def fetch_convos_state(agent=None, rerun=True):
         return
 
     state = st.session_state
-    state.convos = []
-    client = state.chat_client
-    project_id = st.secrets.cloud.project_id
+    parent = f"projects/{st.secrets.cloud.project_id}/locations/global"
+    state.convo_index, error = _load_convo_index(state.chat_client, get_local_store(), parent, agent.name)
+    state.convos = state.convo_index.conversations(agent.name)
+    if error is not None:
+        _show_fetch_error("convos", error)
+    if rerun:
+        st.rerun()
+
 
+def _load_convo_index(client, store, parent, agent_name):
+    """
+    会話の索引を作成し、エージェントの会話一覧を読み込む（セッション状態を使わないため、スレッドプールからも呼べる）
+    ローカルに保存済みの会話を先に索引に入れ、保存から時間が経っている場合のみ最初のページをAPIから取得する
+
+    戻り値:
+        (ConversationIndex, APIからの取得で発生したエラー（なければNone）)
+    """
+    index = ConversationIndex(parent=parent)
+    local = store.conversations(agent_name, CONVO_PAGE_SIZE)
+    index.seed(local)
+
+    synced_key = f"convos_synced_at:{agent_name}"
+    if local and store.seconds_since(synced_key) < CONVO_SYNC_INTERVAL_SECONDS:
+        return index, None
     try:
-        # 会話一覧を取得（TODO: フィルタ機能が動作したら修正）
-        request = geminidataanalytics.ListConversationsRequest(
-            parent=f"projects/{project_id}/locations/global",
-            page_size=100,
-        )
+        store.put_conversations(index.load_more(client, agent_name))
+    except Exception as e:
+        return index, e
+    store.set_meta(synced_key, str(time.time()))
+    return index, None
+
+
+def fetch_more_convos_state(agent=None, rerun=True):
+    """
+    指定されたエージェントの会話一覧を次のページから追加で取得する
+
+    引数:
+        agent: 対象のエージェント（Noneの場合は何もしない）
+        rerun: Trueの場合、取得後に画面を再描画する
+    """
+    if agent is None:
+        return
+    if "convo_index" not in st.session_state:
+        fetch_convos_state(agent=agent, rerun=rerun)
+        return
+    _load_convos(agent, rerun)
 
-        convos = list(client.list_conversations(request=request))
-        # 指定されたエージェントに属する会話のみをフィルタリング
-        convos = [c for c in convos if c.agents[0] == agent.name]
-        state.convos = convos if len(convos) > 0 else []
+
+def _load_convos(agent, rerun) -> bool:
+    """
+    会話の索引から次のページを取得し、セッション状態の会話一覧を更新する
+    取得した会話はローカルにも保存する
+
+    戻り値:
+        取得に成功した場合True
+    """
+    state = st.session_state
+    client = state.chat_client
+    index = state.convo_index
+
+    try:
+        fetched = index.load_more(client, agent.name)
+        get_local_store().put_conversations(fetched)
+        state.convos = index.conversations(agent.name)
         if rerun:
             st.rerun()
+        return True
 
     except google_exceptions.GoogleAPICallError as e:
         st.error(f"API error fetching convos: {e}")
     except Exception as e:
         st.error(f"Unexpected error: {e}")
+    return False
+
+
+def reset_messages_state():
+    """
+    表示中のメッセージ一覧と、過去分の読み込み位置をリセットする
+    """
+    state = st.session_state
+    state.convo_messages = []
+    # 取得中のメッセージ（init_stateで開始したもの・キャッシュから表示した会話の確認）は反映しない
+    state.pop(PENDING_MESSAGES_KEY, None)
+    state.pop(REVALIDATE_MESSAGES_KEY, None)
+    # 過去分を取得するときの基準時刻（表示中の最古のメッセージの時刻、UNIX時間のマイクロ秒）
+    state.convo_earlier_before = None
+    state.convo_has_earlier = False
+
+
+def _oldest_timestamp(msgs):
+    """メッセージ一覧の中で時刻が分かる最古のもの（UNIX時間のマイクロ秒、なければNone）"""
+    return next((to_micros(m.timestamp) for m in msgs if m.timestamp), None)
+
+
+def _list_messages_page(client, convo, page_token="", before=None, after=None):
+    """
+    会話のメッセージを新しい順に1ページ分取得する
+
+    引数:
+        client: DataChatServiceClient
+        convo: 対象の会話
+        page_token: 続きを取得する場合のページトークン
+        before: 指定した場合、この時刻（UNIX時間のマイクロ秒）より前のメッセージのみ取得する
+        after: 指定した場合、この時刻（UNIX時間のマイクロ秒）より後のメッセージのみ取得する
+
+    戻り値:
+        (時系列順のメッセージのリスト, 次のページトークン)
+    """
+    conditions = []
+    if before is not None:
+        conditions.append(f'create_time < "{micros_to_rfc3339(before)}"')
+    if after is not None:
+        conditions.append(f'create_time > "{micros_to_rfc3339(after)}"')
+    request = geminidataanalytics.ListMessagesRequest(
+        parent=convo.name,
+        page_size=MESSAGE_PAGE_SIZE,
+        page_token=page_token,
+        filter=" AND ".join(conditions),
+    )
+    # ページャーは最初のページだけを取得した状態で返る（以降のページは必要になるまで取得しない）
+    response = client.list_messages(request=request)
+    # メッセージオブジェクトから実際のメッセージ内容を取得
+    msgs = [m.message for m in response.messages]
+    # 時系列順に並び替え（APIは新しい順で返すため逆順にする）
+    return list(reversed(msgs)), response.next_page_token
+
+
+def _sync_messages(client, convo, store):
+    """
+    ローカルに保存したメッセージをAPIと同期する
+
+    - 未保存の会話：最新の1ページを取得して保存する
+    - 保存済みの会話：最後に保存したメッセージより新しいものだけを取得する
+      MAX_SYNC_PAGES を超える場合は保存済みの分を破棄し、取得した最新の分だけを保存する
+      （間が空かないようにするため。それより前は過去分の読み込みで取得する）
+    いずれの場合も、チャット中に仮保存したメッセージはAPIの内容で置き換える
+    """
+    latest = store.latest_synced_timestamp(convo.name)
+    if latest is None:
+        msgs, next_token = _list_messages_page(client, convo)
+        store.add_synced(convo.name, msgs, replace_pending=True)
+        store.mark_synced(convo, complete=not next_token)
+        return
+
+    new_msgs, page_token = [], ""
+    for _ in range(MAX_SYNC_PAGES):
+        msgs, page_token = _list_messages_page(client, convo, page_token=page_token, after=latest)
+        new_msgs = msgs + new_msgs
+        if not page_token:
+            break
+    if page_token:
+        store.add_synced(convo.name, new_msgs, replace_all=True)
+        store.mark_synced(convo, complete=False)
+        return
+    store.add_synced(convo.name, new_msgs, replace_pending=True)
+    store.mark_synced(convo)
 
 
 def fetch_messages_state(convo=None, rerun=True):
     """
-    指定された会話のメッセージ一覧を取得する
+    指定された会話の最新のメッセージを1ページ分（MESSAGE_PAGE_SIZE件）表示する
+    先読みキャッシュにある会話はその内容をすぐに表示し、最新の状態の確認をバックグラウンドで開始する
+    （チャット画面がapply_revalidated_messagesで結果を反映する）
+    キャッシュにない会話はローカルに保存したメッセージから読み込み、会話が更新されている場合のみ新しいメッセージをAPIから取得する
+    それより前のメッセージはfetch_earlier_messages_stateで必要になったときに取得する
 
     引数:
         convo: 対象の会話（Noneの場合は何もしない）
@@ -184,16 +416,182 @@ def fetch_messages_state(convo=None, rerun=True):
         return
 
     state = st.session_state
-    state.convo_messages = []
+    reset_messages_state()
+    store = get_local_store()
+    cache = get_message_cache()
+
+    cached = cache.get(convo.name)
+    if cached is not None:
+        _apply_messages((cached.messages, cached.has_earlier))
+        state[REVALIDATE_MESSAGES_KEY] = (
+            convo.name,
+            get_bootstrap_executor().submit(_revalidate_messages, state.chat_client, store, cache, convo.name),
+        )
+        if rerun:
+            st.rerun()
+        return
+
+    try:
+        _apply_messages(_load_recent_messages(state.chat_client, store, convo, cache))
+        if rerun:
+            st.rerun()
+    except google_exceptions.GoogleAPICallError as e:
+        st.error(f"API error fetching messages: {e}")
+    except Exception as e:
+        st.error(f"Unexpected error: {e}")
+
+
+def _load_recent_messages(client, store, convo, cache=None):
+    """
+    会話の最新のメッセージを1ページ分読み込む（セッション状態を使わないため、スレッドプールからも呼べる）
+    会話が更新されている場合のみ新しいメッセージをAPIから取得して保存する
+
+    引数:
+        cache: 指定した場合、読み込んだメッセージを先読みキャッシュにも保存する
+
+    戻り値:
+        (時系列順のメッセージのリスト, 以前のメッセージが残っている可能性があるかどうか)
+    """
+    if not store.is_fresh(convo):
+        _sync_messages(client, convo, store)
+    msgs = store.recent_messages(convo.name, MESSAGE_PAGE_SIZE)
+    loaded = msgs, len(msgs) >= MESSAGE_PAGE_SIZE or not store.is_complete(convo.name)
+    if cache is not None:
+        cache.put(convo.name, convo_version(convo), loaded)
+    return loaded
+
+
+def _revalidate_messages(client, store, cache, convo_name):
+    """
+    会話の最新の状態をAPIから取得し、最新のメッセージを読み込み直す（スレッドプールから呼ぶ）
+    最終利用時刻が変わっていなければローカルの保存から読み込むだけで、メッセージの取得は行わない
+    """
+    convo = client.get_conversation(request=geminidataanalytics.GetConversationRequest(name=convo_name))
+    store.put_conversations([convo])
+    return _load_recent_messages(client, store, convo, cache)
+
+
+def _apply_messages(loaded):
+    """読み込んだメッセージを表示中のメッセージ一覧にする（キャッシュと共有しないようリストはコピーする）"""
+    state = st.session_state
+    msgs, has_earlier = loaded
+    state.convo_messages = list(msgs)
+    state.convo_earlier_before = _oldest_timestamp(msgs)
+    state.convo_has_earlier = state.convo_earlier_before is not None and has_earlier
+
+
+def _message_times(msgs):
+    """メッセージの時刻の一覧（表示中の内容が変わったかどうかの判定に使う）"""
+    return [to_micros(m.timestamp) for m in msgs]
+
+
+def apply_pending_messages():
+    """
+    init_stateで開始したメッセージの取得を待ち、結果を表示中のメッセージ一覧に反映する
+    取得中に別の会話に切り替えた場合（reset_messages_stateで取り消し済み）は何もしない
+    """
+    state = st.session_state
+    pending = state.pop(PENDING_MESSAGES_KEY, None)
+    if pending is None:
+        return
+    convo_name, future = pending
+    if not state.get("current_convo") or state.current_convo.name != convo_name:
+        return
+
+    try:
+        _apply_messages(future.result())
+    except google_exceptions.GoogleAPICallError as e:
+        st.error(f"API error fetching messages: {e}")
+    except Exception as e:
+        st.error(f"Unexpected error: {e}")
+
+
+def apply_revalidated_messages() -> bool:
+    """
+    先読みキャッシュから表示した会話の、最新の状態の確認結果を反映する（確認中の場合は待たない）
+    表示中の内容と異なる場合は反映して画面を再描画する（確認に失敗した場合はキャッシュの内容のまま）
+
+    戻り値:
+        確認がまだ終わっていない場合はTrue（REVALIDATE_POLL_SECONDS秒ごとに呼び直す）
+    """
+    state = st.session_state
+    pending = state.get(REVALIDATE_MESSAGES_KEY)
+    if pending is None:
+        return False
+    convo_name, future = pending
+    if not state.get("current_convo") or state.current_convo.name != convo_name:
+        state.pop(REVALIDATE_MESSAGES_KEY)
+        return False
+    if not future.done():
+        return True
+
+    state.pop(REVALIDATE_MESSAGES_KEY)
+    try:
+        loaded = future.result()
+    except Exception as e:
+        print(f"Error revalidating messages for {convo_name}: {e}")
+        return False
+    if _message_times(loaded[0]) != _message_times(state.convo_messages):
+        _apply_messages(loaded)
+        st.rerun()
+    return False
+
+
+def prefetch_messages_state():
+    """
+    サイドバーの会話のうち新しいものから順にPREFETCH_TOP_K件のメッセージを、先読みキャッシュにバックグラウンドで読み込む
+    （キャッシュ済みで最終利用時刻が変わっていない会話は読み込まない）
+    """
+    state = st.session_state
+    convos = state.get("convos") or []
+    if not convos or "chat_client" not in state:
+        return
     client = state.chat_client
-    request = geminidataanalytics.ListMessagesRequest(parent=convo.name)
+    store = get_local_store()
+    get_message_cache().prefetch(
+        convos[:PREFETCH_TOP_K],
+        lambda convo: _load_recent_messages(client, store, convo),
+        get_prefetch_executor(),
+    )
+
+
+def fetch_earlier_messages_state(convo=None, rerun=True):
+    """
+    表示中のメッセージより前のメッセージを1ページ分読み込み、先頭に追加する
+    ローカルに保存されていない分はAPIから取得して保存する
+    保持件数がMAX_HISTORY_MESSAGESを超えないよう、読み込む件数は残りの件数までにする（達している場合は何もしない）
+
+    引数:
+        convo: 対象の会話（Noneの場合は何もしない）
+        rerun: Trueの場合、取得後に画面を再描画する
+    """
+    state = st.session_state
+    if convo is None or not state.get("convo_has_earlier"):
+        return
+    limit = min(MESSAGE_PAGE_SIZE, MAX_HISTORY_MESSAGES - len(state.convo_messages))
+    if limit <= 0:
+        return
+
+    store = get_local_store()
+    before = state.convo_earlier_before
 
     try:
-        msgs = list(client.list_messages(request=request))
-        # メッセージオブジェクトから実際のメッセージ内容を取得
-        msgs = [m.message for m in msgs]
-        # 時系列順に並び替え（APIは新しい順で返すため逆順にする）
-        state.convo_messages = list(reversed(msgs)) if len(msgs) > 0 else []
+        msgs = store.messages_before(convo.name, before, limit)
+        if len(msgs) < limit and not store.is_complete(convo.name):
+            # ローカルに保存済みの最古のメッセージより前をAPIから取得する
+            page, next_token = _list_messages_page(
+                state.chat_client, convo, before=store.oldest_synced_timestamp(convo.name),
+            )
+            store.add_synced(convo.name, page)
+            if not next_token:
+                store.mark_complete(convo.name)
+            msgs = store.messages_before(convo.name, before, limit)
+
+        state.convo_messages = msgs + state.convo_messages
+        state.convo_earlier_before = _oldest_timestamp(msgs) or before
+        state.convo_has_earlier = bool(msgs) and (
+            len(msgs) >= limit or not store.is_complete(convo.name)
+        )
         if rerun:
             st.rerun()
     except google_exceptions.GoogleAPICallError as e:
@@ -202,6 +600,31 @@ def fetch_messages_state(convo=None, rerun=True):
         st.error(f"Unexpected error: {e}")
 
 
+def append_convo_message(message):
+    """
+    メッセージを表示中の一覧の末尾に追加し、ローカルにも仮保存する
+    保持件数がMAX_HISTORY_MESSAGESを超えた場合は古いものから1ページ分（MESSAGE_PAGE_SIZE件）余分に破棄し、
+    破棄した分は以降「以前のメッセージ」として再度読み込めるようにする
+    （上限ちょうどまで詰めると、以前のメッセージの読み込みが上限に達していて使えないため）
+
+    引数:
+        message: 追加するメッセージ
+    """
+    state = st.session_state
+    state.convo_messages.append(message)
+    if state.get("current_convo"):
+        get_local_store().add_pending(state.current_convo.name, message)
+        # 先読みキャッシュの内容は古くなるため破棄する（次に開いたときにローカルの保存から読み込む）
+        get_message_cache().invalidate(state.current_convo.name)
+
+    if len(state.convo_messages) <= MAX_HISTORY_MESSAGES:
+        return
+    overflow = len(state.convo_messages) - max(1, MAX_HISTORY_MESSAGES - MESSAGE_PAGE_SIZE)
+    del state.convo_messages[:overflow]
+    state.convo_earlier_before = _oldest_timestamp(state.convo_messages)
+    state.convo_has_earlier = state.convo_earlier_before is not None
+
+
 def create_convo(agent=None):
     """
     新しい会話を作成し、会話一覧の先頭に追加する
@@ -228,7 +651,12 @@ def create_convo(agent=None):
     try:
         # 会話を作成し、一覧の先頭に追加
         convo = client.create_conversation(request=request)
-        state.convos.insert(0, convo)
+        get_local_store().put_conversations([convo])
+        if "convo_index" in state:
+            state.convo_index.add(agent.name, convo)
+            state.convos = state.convo_index.conversations(agent.name)
+        else:
+            state.convos.insert(0, convo)
         return convo
     except google_exceptions.GoogleAPICallError as e:
         st.error(f"API error creating convo: {e}")
@@ -236,10 +664,12 @@ def create_convo(agent=None):
         st.error(f"Unexpected error: {e}")
 
 
-@st.cache_data(ttl=3600)
 def fetch_reference_data():
     """
-    referenceデータセットのマスタテーブルを取得する（1時間キャッシュ）
+    referenceデータセットのマスタテーブルを取得する
+
+    2つのテーブルを並列に取得し、メモリとディスクに1時間キャッシュする
+    期限切れ後は古いデータを返しつつバックグラウンドで取得し直す（utils.reference_data）
 
     戻り値:
         dict: {
@@ -247,33 +677,8 @@ def fetch_reference_data():
             "log_point_type": DataFrame（アクション種別のマスタ）
         }
     """
-    project_id = st.secrets.cloud.project_id
-    client = bigquery.Client(project=project_id)
-
-    result = {}
-
-    # application_nameテーブルを取得
-    try:
-        query_app = f"""
-            SELECT application_id, application_name
-            FROM `{project_id}.reference.application_name`
-            ORDER BY CAST(application_id AS INT64)
-        """
-        result["application_name"] = client.query(query_app).to_dataframe(create_bqstorage_client=False)
-    except Exception as e:
-        st.error(f"application_name取得エラー: {e}")
-        result["application_name"] = None
-
-    # log_point_typeテーブルを取得
-    try:
-        query_type = f"""
-            SELECT type, action_name
-            FROM `{project_id}.reference.log_point_type`
-            ORDER BY CAST(type AS INT64)
-        """
-        result["log_point_type"] = client.query(query_type).to_dataframe(create_bqstorage_client=False)
-    except Exception as e:
-        st.error(f"log_point_type取得エラー: {e}")
-        result["log_point_type"] = None
-
-    return result
+    data, errors = load_reference_data(st.secrets.cloud.project_id)
+    for name, df in data.items():
+        if df is None and name in errors:
+            st.error(f"{name}取得エラー: {errors[name]}")
+    return data
@@ -0,0 +1,112 @@
+"""
+utils.cost_estimatorの見積もりキャッシュと集計を、BigQueryのドライランのスタブ（devtools.bq_stub）に対して確認する
+
+実行方法（リポジトリのルートで）:
+    python -m pytest -q tests/test_cost_estimator.py
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pytest
+from google.api_core.client_options import ClientOptions
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import bigquery
+
+from devtools.bq_stub import DryRunHandler, estimated_bytes, serve
+from utils.answer_cache import JST
+from utils.cost_estimator import CostEstimate, CostEstimator
+
+SQL = "SELECT user_id FROM `p.d.events`"
+
+
+def _client(endpoint: str) -> bigquery.Client:
+    return bigquery.Client(
+        project="test-project",
+        credentials=AnonymousCredentials(),
+        client_options=ClientOptions(api_endpoint=endpoint),
+    )
+
+
+@pytest.fixture(scope="module")
+def endpoint():
+    server = serve(port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(endpoint):
+    DryRunHandler.requests = 0
+    return _client(endpoint)
+
+
+def test_same_sql_is_served_from_cache(client):
+    estimator = CostEstimator()
+    first = estimator.estimate(SQL, client)
+    # 前後の空白だけが異なるSQLも同じ見積もりを使う
+    second = estimator.estimate(f"  {SQL}\n", client)
+    assert first == second == CostEstimate(bytes_processed=estimated_bytes(SQL))
+    assert estimator.peek(SQL) == first
+    assert DryRunHandler.requests == 1
+
+
+def test_inflight_dry_runs_are_coalesced(client):
+    estimator = CostEstimator()
+    gate = threading.Event()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # 先に実行中の処理でスレッドを塞ぎ、ドライランを実行中のままにする
+        executor.submit(gate.wait)
+        first = estimator.estimate_async(SQL, client, executor)
+        second = estimator.estimate_async(SQL, client, executor)
+        other = estimator.estimate_async(SQL + " LIMIT 10", client, executor)
+        gate.set()
+        assert first is second
+        assert other is not first
+        assert first.result(timeout=10).bytes_processed == estimated_bytes(SQL)
+        other.result(timeout=10)
+    assert DryRunHandler.requests == 2
+    # 完了後はキャッシュから返す
+    assert estimator.estimate(SQL, client) == first.result()
+    assert DryRunHandler.requests == 2
+
+
+def test_syntax_errors_are_cached(client):
+    estimator = CostEstimator()
+    sql = "SELECT FAIL"
+    first = estimator.estimate(sql, client)
+    assert "Syntax error" in first.error
+    assert estimator.estimate(sql, client) == first
+    assert DryRunHandler.requests == 1
+
+
+def test_other_errors_are_not_cached(endpoint, client):
+    estimator = CostEstimator()
+    # スタブが応答しないパス（404）に送り、400以外のエラーにする
+    failed = estimator.estimate(SQL, _client(f"{endpoint}/unknown"))
+    assert failed.error
+    assert estimator.peek(SQL) is None
+    assert estimator.estimate(SQL, client) == CostEstimate(bytes_processed=estimated_bytes(SQL))
+    assert DryRunHandler.requests == 1
+
+
+def test_daily_totals_follow_jst_dates():
+    estimator = CostEstimator()
+    estimate = CostEstimate(bytes_processed=100)
+    # 2026-10-17 23:30 JST / 2026-10-18 00:30 JST
+    before_midnight = datetime(2026, 10, 17, 14, 30, tzinfo=timezone.utc)
+    after_midnight = datetime(2026, 10, 17, 15, 30, tzinfo=timezone.utc)
+
+    estimator.record("a", estimate, now=before_midnight)
+    estimator.record("a", estimate, now=before_midnight)
+    estimator.record("b", estimate, now=before_midnight.astimezone(JST))
+    estimator.record("c", CostEstimate(error="failed"), now=before_midnight)
+    assert estimator.daily_total(before_midnight) == (2, 200)
+
+    # JSTで日付が変わると新しい日の集計になり、前日の集計は破棄される
+    estimator.record("a", estimate, now=after_midnight)
+    assert estimator.daily_total(after_midnight) == (1, 100)
+    assert estimator.daily_total(before_midnight) == (0, 0)
@@ -0,0 +1,45 @@
+"""
+utils.result_gridの絞り込み・並べ替えの行の位置を確認する
+
+実行方法（リポジトリのルートで）:
+    python -m pytest -q tests/test_result_grid.py
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.result_grid import filter_positions, sort_positions, view_positions
+
+
+@pytest.fixture
+def df():
+    # 取得結果のカテゴリ列と同じく、カテゴリを初出順に並べる（コードの順と値の順が異なる）
+    categories = ["pear", "apple", "orange", "banana"]
+    return pd.DataFrame({
+        "name": pd.Categorical.from_codes([0, 1, -1, 2, 1, 3], categories),
+        "count": [3, 1, 5, 2, 4, 6],
+    })
+
+
+@pytest.mark.parametrize("ascending", [True, False])
+def test_categorical_sort_matches_value_order(df, ascending):
+    positions = np.arange(len(df))
+    expected = df["name"].astype(object).sort_values(ascending=ascending, kind="stable", na_position="last")
+    sorted_positions = sort_positions(df, positions, "name", ascending)
+    assert sorted_positions.tolist() == expected.index.tolist()
+
+
+def test_categorical_sort_of_filtered_positions(df):
+    positions = filter_positions(df, "an")
+    assert positions.tolist() == [3, 5]
+    assert sort_positions(df, positions, "name", True).tolist() == [5, 3]
+
+
+def test_ordered_categorical_keeps_declared_order(df):
+    df["name"] = df["name"].cat.set_categories(["pear", "orange", "banana", "apple"], ordered=True)
+    sorted_positions = sort_positions(df, np.arange(len(df)), "name", True)
+    assert sorted_positions.tolist() == [0, 3, 5, 1, 4, 2]
+
+
+def test_view_positions_filters_then_sorts(df):
+    assert view_positions(df, "p", "name", "count", ascending=False).tolist() == [4, 0, 1]
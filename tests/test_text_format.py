@@ -0,0 +1,61 @@
+"""
+utils.text_formatの整形結果が、従来のformat_user_data_textの出力と一致することを確認する
+
+実行方法（リポジトリのルートで）:
+    python -m pytest -q tests/test_text_format.py
+"""
+import random
+
+import pytest
+
+from benchmarks.bench_format_text import build_answer, legacy_format_user_data_text, split_parts
+from utils.text_format import UserDataFormatter, format_user_data_text
+
+# 出力の一致を確認する代表的な入力（区切りの前後・回数データなし・空の種類名など）
+GOLDEN_CASES = [
+    "",
+    "該当するユーザーはいません",
+    "user_id: abc",
+    "user_id:",
+    "上位3名です。\nuser_id: 0a1b ビデオ通話: 3回, ギフト: 10回\nuser_id: ff 音声通話: 1回",
+    "user_id: 12 回数データなし user_id: 34 : 5回",
+    "user_id: 12  : 5回 ::7回 名前: 回",
+    "user_id: abcUSER user_id: 9 精算:\n 2回 ギフト: 0回\n\n",
+    "前置き user_id:   deadbeef\n  - ビデオ通話: 3回\nuser_id: xyz 最後",
+    "user_id: 1 a: 1回 user_id: 1 a: 1回",
+]
+# 出力の一致を確認するランダム入力の数
+RANDOM_CASES = 2000
+
+
+def _random_text(rng: random.Random) -> str:
+    """区切りや回数データの断片をランダムに並べたテキスト"""
+    pieces = ["user_id:", "user_id: ", "abc", "f0", "12", " ", "\n", ":", "回", "ギフト", "x", ": 3回", "、"]
+    return "".join(rng.choice(pieces) for _ in range(rng.randint(0, 40)))
+
+
+def _assert_matches_legacy(text: str, rng: random.Random):
+    """一括・逐次の整形結果が従来の出力と一致することを確認する"""
+    expected = legacy_format_user_data_text(text)
+    assert format_user_data_text(text) == expected, repr(text)
+    formatter = UserDataFormatter()
+    parts = split_parts(text, rng)
+    for part in parts:
+        formatter.feed(part)
+    assert formatter.finish() == expected, repr(parts)
+
+
+@pytest.mark.parametrize("text", GOLDEN_CASES)
+def test_golden_cases(text):
+    _assert_matches_legacy(text, random.Random(0))
+
+
+@pytest.mark.parametrize("users", [1, 5, 50])
+def test_generated_answers(users):
+    _assert_matches_legacy(build_answer(users, seed=users), random.Random(users))
+
+
+def test_random_texts():
+    rng = random.Random(0)
+    for _ in range(RANDOM_CASES):
+        _assert_matches_legacy(_random_text(rng), rng)
@@ -0,0 +1,137 @@
+"""
+エージェント一覧の共有キャッシュ
+全セッションで1つのエージェント一覧を共有し、list_data_agentsの呼び出しを減らす
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Iterable, List, Optional
+
+import streamlit as st
+
+# エージェント一覧のキャッシュ有効期間（秒）
+CATALOG_TTL_SECONDS = int(os.environ.get("AGENT_CATALOG_TTL", "300"))
+
+
+class AgentCatalog:
+    """
+    TTL付きのエージェント一覧キャッシュ
+
+    - 有効期間内はメモリ上の一覧を返す（RPCなし）
+    - 期限切れの場合は古い一覧を返しつつ、バックグラウンドで再取得する
+    - 同時に発生したキャッシュミスは1回の取得処理にまとめる
+    - 作成・更新・削除時はupsert/remove/invalidateで一覧を直接更新する
+    """
+
+    def __init__(self, ttl: int = CATALOG_TTL_SECONDS):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._agents: Optional[List] = None
+        self._loaded_at = 0.0
+        self._inflight: Optional[Future] = None
+        # 一覧を書き換えるたびに増える世代番号（取得中に書き換えがあった結果を捨てるため）
+        self._generation = 0
+        # 取得処理の通し番号と、一覧に反映した最後の番号（後から終わった古い取得で上書きしないため）
+        self._load_seq = 0
+        self._applied_seq = 0
+
+    def get(self, loader: Callable[[], Iterable], force: bool = False) -> List:
+        """
+        エージェント一覧を返す
+
+        引数:
+            loader: 一覧を取得する関数（list_data_agentsの呼び出し）
+            force: Trueの場合、キャッシュ・取得中の処理を使わずに新たに取得する
+                   （作成・削除の直後など、それ以前に始まった取得の結果では足りない場合）
+
+        戻り値:
+            エージェントのリスト（呼び出し側で変更しても共有一覧には影響しない）
+        """
+        with self._lock:
+            if self._agents is not None and not force:
+                if time.monotonic() - self._loaded_at >= self._ttl:
+                    # 期限切れ：古い一覧を返し、裏で再取得する
+                    self._start_load(loader, background=True)
+                return list(self._agents)
+            future, owner = self._start_load(loader, force=force)
+
+        # 最初にキャッシュミスした呼び出し元だけが取得し、他はその結果を待つ
+        if owner:
+            self._run_load(future, loader)
+        return list(future.result())
+
+    def _start_load(self, loader, background=False, force=False):
+        """
+        取得処理を開始する（ロック取得中に呼ぶ）
+        forceでなければ取得中の処理があればそれを使う
+
+        戻り値:
+            (Future, 呼び出し側が取得処理を実行すべきかどうか)
+        """
+        if self._inflight is not None and not force:
+            return self._inflight, False
+        self._load_seq += 1
+        future = Future()
+        future.generation = self._generation
+        future.seq = self._load_seq
+        self._inflight = future
+        if background:
+            threading.Thread(target=self._run_load, args=(future, loader), daemon=True).start()
+            return future, False
+        return future, True
+
+    def _run_load(self, future, loader):
+        try:
+            agents = list(loader())
+        except Exception as e:
+            print(f"Error loading agents: {e}")
+            with self._lock:
+                if self._inflight is future:
+                    self._inflight = None
+            future.set_exception(e)
+            return
+
+        with self._lock:
+            if self._inflight is future:
+                self._inflight = None
+            if future.seq > self._applied_seq and (future.generation == self._generation or self._agents is None):
+                self._agents = agents
+                self._loaded_at = time.monotonic()
+                self._applied_seq = future.seq
+            elif self._agents is not None:
+                # 取得中に一覧が書き換えられた・後から始めた取得が先に反映された場合は、現在の一覧を優先する
+                agents = list(self._agents)
+        future.set_result(agents)
+
+    def upsert(self, agent):
+        """作成・更新されたエージェントを一覧に反映する（同名があれば置き換え、なければ先頭に追加）"""
+        with self._lock:
+            if self._agents is None:
+                return
+            self._generation += 1
+            for i, ag in enumerate(self._agents):
+                if ag.name == agent.name:
+                    self._agents[i] = agent
+                    return
+            self._agents.insert(0, agent)
+
+    def remove(self, name: str):
+        """削除されたエージェントを一覧から取り除く"""
+        with self._lock:
+            if self._agents is None:
+                return
+            self._generation += 1
+            self._agents = [ag for ag in self._agents if ag.name != name]
+
+    def invalidate(self):
+        """一覧を期限切れにする（次回の取得時に再取得される）"""
+        with self._lock:
+            self._generation += 1
+            self._loaded_at = 0.0
+
+
+@st.cache_resource(show_spinner=False)
+def get_agent_catalog() -> AgentCatalog:
+    """プロセス共有のエージェント一覧キャッシュを返す"""
+    return AgentCatalog()
@@ -0,0 +1,120 @@
+"""
+繰り返しの質問に対する回答キャッシュ
+正規化した質問文・エージェント・システム指示・日付（JST）をキーに回答メッセージを全セッションで共有し、
+同じ質問には再度エージェントを呼ばずに回答を再生する（日付が変わると期限切れ）
+"""
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+import streamlit as st
+from google.cloud import geminidataanalytics
+
+JST = timezone(timedelta(hours=9))
+# キャッシュする回答の最大件数
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "200"))
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+_TRAILING_PUNCTUATION_PATTERN = re.compile(r"[?？!！。．.、,，\s]+$")
+
+
+def normalize_question(text: str) -> str:
+    """
+    質問文を正規化する（全角/半角の統一、小文字化、空白の統一、末尾の句読点・疑問符の除去）
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _WHITESPACE_PATTERN.sub(" ", text).strip()
+    return _TRAILING_PUNCTUATION_PATTERN.sub("", text)
+
+
+def answer_cache_key(question: str, agent, now: Optional[datetime] = None) -> Tuple[str, str, str, str]:
+    """
+    回答キャッシュのキーを作成する
+
+    戻り値:
+        (正規化した質問文, エージェント名, システム指示のハッシュ, JSTの日付)
+    """
+    system_instruction = ""
+    try:
+        system_instruction = agent.data_analytics_agent.published_context.system_instruction or ""
+    except AttributeError:
+        pass
+    instruction_hash = hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()[:16]
+    today = (now or datetime.now(JST)).astimezone(JST).date().isoformat()
+    return normalize_question(question), agent.name, instruction_hash, today
+
+
+def _next_jst_midnight(now: datetime) -> datetime:
+    """次の日付の変わり目（JSTの0時）"""
+    tomorrow = now.astimezone(JST).date() + timedelta(days=1)
+    return datetime(tomorrow.year, tomorrow.month, tomorrow.day, tzinfo=JST)
+
+
+@dataclass
+class CachedAnswer:
+    """キャッシュされた回答（シリアライズしたメッセージのリスト）"""
+    messages: List[bytes]
+    created_at: datetime
+    expires_at: datetime
+
+    def to_messages(self) -> List[geminidataanalytics.Message]:
+        """保存したメッセージを復元する"""
+        return [geminidataanalytics.Message.deserialize(b) for b in self.messages]
+
+
+class AnswerCache:
+    """
+    件数上限付きのLRU回答キャッシュ（日付が変わった時点で期限切れ）
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key) -> Optional[CachedAnswer]:
+        """有効期限内の回答を返す（なければNone）"""
+        now = datetime.now(JST)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if now >= entry.expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, messages: List[geminidataanalytics.Message]):
+        """
+        回答を保存する（エラーを含む回答は保存しない）
+
+        引数:
+            key: answer_cache_keyで作成したキー
+            messages: 1回の回答で受信したシステムメッセージのリスト
+        """
+        if not messages or any('error' in m.system_message for m in messages):
+            return
+        now = datetime.now(JST)
+        entry = CachedAnswer(
+            messages=[geminidataanalytics.Message.serialize(m) for m in messages],
+            created_at=now,
+            expires_at=_next_jst_midnight(now),
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+
+@st.cache_resource(show_spinner=False)
+def get_answer_cache() -> AnswerCache:
+    """プロセス共有の回答キャッシュを返す"""
+    return AnswerCache()
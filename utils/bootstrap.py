@@ -0,0 +1,52 @@
+"""
+セッション開始時の並列取得
+init_stateの取得処理（エージェント一覧・会話一覧・メッセージ）のうち、互いに依存しないものを
+全セッションで共有するスレッドプールで同時に実行する
+
+- 前回のセッションで使ったエージェントの名前をローカルに保存し、次のセッションでは
+  エージェント一覧の取得を待たずに、その会話一覧と最新の会話のメッセージを先読みする
+- 先読みした対象が実際の取得結果と異なる場合は結果を捨てて取得し直す（先読みした分はローカルの保存に残る）
+"""
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+import streamlit as st
+
+# 並列取得に使うスレッド数（全セッションで共有）
+BOOTSTRAP_WORKERS = int(os.environ.get("BOOTSTRAP_WORKERS", "8"))
+
+
+class Speculation:
+    """
+    先読みした取得処理と、その前提（先読みした対象を表すキー）の組
+
+    引数:
+        key: 先読みの前提（エージェント名など、Noneの場合は先読みしていない）
+        future: 取得処理のFuture（Noneの場合は先読みしていない）
+    """
+
+    def __init__(self, key=None, future: Optional[Future] = None):
+        self.key = key
+        self.future = future
+        # 先読みが使われたかどうか（計測用）
+        self.hit = False
+
+    def take(self, key, submit: Callable[[], Future]) -> Future:
+        """
+        前提が一致すれば先読みした取得処理を、一致しなければ新たに開始した取得処理を返す
+
+        引数:
+            key: 実際の対象を表すキー
+            submit: 取得処理を開始してFutureを返す関数（前提が一致しない場合に呼ぶ）
+        """
+        if self.future is not None and self.key == key:
+            self.hit = True
+            return self.future
+        return submit()
+
+
+@st.cache_resource(show_spinner=False)
+def get_bootstrap_executor() -> ThreadPoolExecutor:
+    """プロセス共有の並列取得用スレッドプールを返す"""
+    return ThreadPoolExecutor(max_workers=BOOTSTRAP_WORKERS, thread_name_prefix="bootstrap")
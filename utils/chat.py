@@ -4,101 +4,82 @@
 
 参考: https://cloud.google.com/gemini/docs/conversational-analytics-api/build-agent-sdk#define_helper_functions
 """
+import os
+import time
 import pandas as pd
-import json
-import re
 import altair as alt
-from typing import List
 
-import proto
 from google.protobuf.json_format import MessageToDict
 
 import streamlit as st
 
-# 表示行数の上限
-MAX_DISPLAY_ROWS = 20
-
-
-def format_user_data_text(text: str) -> str:
+from utils.chat_stream import message_kind
+from utils.cost_estimator import SQL_DRY_RUN_ENABLED, get_cost_estimator
+from utils.dataframes import data_result_to_dataframe
+from utils.metrics import get_metrics
+from utils.reference_data import load_reference_data
+from utils.reference_lookup import get_reference_lookup, referenced_columns
+from utils.render_cache import cached_render, message_cache_key
+from utils.result_export import display_query_export, display_result_export
+from utils.result_grid import display_result_grid
+from utils.result_store import get_result_store
+from utils.sql_analyzer import SqlAnalysis, analyze_sql
+from utils.text_format import UserDataFormatter
+
+# チャートのVega-Lite仕様をAltairで検証するかどうか（デバッグ用、通常は検証しない）
+VALIDATE_CHART_SPEC = bool(os.environ.get("VEGA_LITE_VALIDATE"))
+# 生成SQLのリスク → (バッジの表示, 色, アイコン)
+SQL_RISK_BADGES = {
+    "high": ("コスト高リスク", "red", "🔥"),
+    "medium": ("要確認", "orange", "⚠️"),
+    "low": ("コストOK", "green", "✅"),
+}
+
+
+def build_text_markdown(resp) -> str:
     """
-    ユーザーデータを含むテキストを見やすく整形する
-
-    user_id:で始まる複数ユーザーの情報を改行で区切り、
-    各種類の回数を箇条書き形式に整形する
+    テキストレスポンスを表示用のMarkdownに変換する
+    複数のパーツがある場合は結合し、ユーザーデータを含む場合は見やすく整形する
     """
-    # user_id: パターンで分割（最初の空マッチを除去）
-    user_pattern = r'(user_id:\s*[a-f0-9]+)'
-    parts = re.split(user_pattern, text)
+    parts = getattr(resp, 'parts')
+    text = ''.join(parts)
 
-    # user_id:パターンが見つからない場合はそのまま返す
-    if len(parts) <= 1:
+    # user_id:を含む場合は整形（パーツごとに渡し、整形済みのユーザーは再走査しない）
+    if 'user_id:' not in text:
         return text
+    formatter = UserDataFormatter()
+    for part in parts:
+        formatter.feed(part)
+    return formatter.finish()
 
-    formatted_lines = []
-    i = 0
-    # 最初の部分（user_id:より前のテキスト）
-    if parts[0].strip():
-        formatted_lines.append(parts[0].strip())
-        formatted_lines.append("")
-    i = 1
-
-    while i < len(parts):
-        if i + 1 < len(parts):
-            user_id = parts[i].strip()
-            data = parts[i + 1].strip()
-
-            # 回数データを「:」と「回」で分割して箇条書きに
-            # パターン: "種類名: N回" を検出
-            items = re.findall(r'([^:]+?):\s*(\d+)回', data)
-
-            if items:
-                formatted_lines.append(f"**{user_id}**")
-                for item_name, count in items:
-                    item_name = item_name.strip()
-                    if item_name:
-                        formatted_lines.append(f"  - {item_name}: {count}回")
-                formatted_lines.append("")
-            else:
-                # パターンにマッチしない場合はそのまま
-                formatted_lines.append(f"**{user_id}** {data}")
-                formatted_lines.append("")
-            i += 2
-        else:
-            formatted_lines.append(parts[i])
-            i += 1
-
-    return "\n".join(formatted_lines)
-
-
-def handle_text_response(resp):
+
+def handle_text_response(resp, cache_key=None):
     """
-    テキストレスポンスを表示する
-    複数のパーツがある場合は結合してMarkdownで表示
-    ユーザーデータを含む場合は見やすく整形する
+    テキストレスポンスをMarkdownで表示する
     """
-    parts = getattr(resp, 'parts')
-    text = ''.join(parts)
-
-    # user_id:を含む場合は整形
-    if 'user_id:' in text:
-        text = format_user_data_text(text)
-
-    st.markdown(text)
+    st.markdown(cached_render(cache_key, "text", lambda: build_text_markdown(resp)))
 
 
-def display_schema(data):
+def build_schema_dataframe(data) -> pd.DataFrame:
     """
-    データスキーマ（カラム定義）を展開可能なテーブルとして表示する
+    データスキーマ（カラム定義）をDataFrameに変換する
 
-    表示内容: カラム名、データ型、説明、モード（NULLABLE等）
+    内容: カラム名、データ型、説明、モード（NULLABLE等）
     """
     fields = getattr(data, 'fields')
-    df = pd.DataFrame({
+    return pd.DataFrame({
         "Column": map(lambda field: getattr(field, 'name'), fields),
         "Type": map(lambda field: getattr(field, 'type'), fields),
         "Description": map(lambda field: getattr(field, 'description', '-'), fields),
         "Mode": map(lambda field: getattr(field, 'mode'), fields)
     })
+
+
+def display_schema(data, cache_key=None):
+    """
+    データスキーマ（カラム定義）を展開可能なテーブルとして表示する
+    """
+    df = cached_render(cache_key, "schema", lambda: build_schema_dataframe(data))
     with st.expander("**Schema**:"):
         st.dataframe(df)
 
@@ -114,37 +95,19 @@ def format_bq_table_ref(table_ref):
     return '{}.{}.{}'.format(table_ref.project_id, table_ref.dataset_id, table_ref.table_id)
 
 
-def extract_referenced_tables(sql: str) -> List[str]:
+def display_sql_risk(analysis: SqlAnalysis):
+    """
+    生成SQLの実行コストのリスクをバッジで表示し、ルール違反があれば内容を表示する
     """
-    SQLからFROM/JOIN句のテーブル名を抽出する
+    if not analysis.tables:
+        return
+    label, color, icon = SQL_RISK_BADGES[analysis.risk]
+    st.badge(label, icon=icon, color=color)
+    for issue in analysis.issues:
+        st.caption(f"⚠️ {issue}")
 
-    引数:
-        sql: 解析対象のSQL文字列
 
-    戻り値:
-        参照されているテーブル名のリスト（ソート済み、重複なし）
-    """
-    if not sql:
-        return []
-    tables = set()
-    # FROM句からテーブル名を抽出（バッククォート対応）
-    from_matches = re.findall(
-        r'FROM\s+`?([a-zA-Z0-9_\-]+(?:\.[a-zA-Z0-9_\-]+){0,2})`?',
-        sql,
-        re.IGNORECASE
-    )
-    tables.update(from_matches)
-    # JOIN句からテーブル名を抽出（バッククォート対応）
-    join_matches = re.findall(
-        r'JOIN\s+`?([a-zA-Z0-9_\-]+(?:\.[a-zA-Z0-9_\-]+){0,2})`?',
-        sql,
-        re.IGNORECASE
-    )
-    tables.update(join_matches)
-    return sorted(list(tables))
-
-
-def display_datasource(datasource):
+def display_datasource(datasource, cache_key=None):
     """
     データソース情報を表示する
 
@@ -161,10 +124,15 @@ def display_datasource(datasource):
         source_name = format_bq_table_ref(getattr(datasource, 'bigquery_table_reference'))
 
     st.markdown("**Data source**: " + source_name)
-    display_schema(datasource.schema)
+    display_schema(datasource.schema, cache_key)
 
 
-def handle_schema_response(resp):
+def _sub_key(cache_key, index):
+    """1つのメッセージに含まれる複数要素（データソースなど）ごとのキャッシュキー"""
+    return None if cache_key is None else (cache_key, index)
+
+
+def handle_schema_response(resp, cache_key=None):
     """
     スキーマレスポンスを表示する
 
@@ -174,89 +142,104 @@ def handle_schema_response(resp):
         st.markdown("**Query:** " + resp.query.question)
     elif 'result' in resp:
         st.markdown("**Schema resolved.**")
-        for datasource in resp.result.datasources:
-            display_datasource(datasource)
+        for i, datasource in enumerate(resp.result.datasources):
+            display_datasource(datasource, _sub_key(cache_key, i))
 
 
-def handle_data_response(resp):
+def enrich_with_reference(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    取得結果のアプリID・アクション種別の列の隣に、マスタテーブルの名前の列を追加する
+
+    マスタを取得できない場合は名前を追加せずにそのまま返す
+    """
+    if not referenced_columns(df):
+        return df
+    try:
+        reference_data, _ = load_reference_data(st.secrets.cloud.project_id)
+    except Exception:
+        return df
+    return get_reference_lookup(reference_data).enrich(df)
+
+
+def handle_data_response(resp, cache_key=None, widget_key=None):
     """
     データレスポンスを表示する
 
     処理内容:
     1. クエリ情報（名前、質問、データソース）を表示
     2. 生成されたSQLを展開可能なコードブロックで表示
-    3. 取得したデータをDataFrameテーブルとして表示
+    3. 取得したデータを並べ替え・絞り込み・ページ送りできる表で表示（コード列にはマスタの名前の列を追加）
+
+    引数:
+        widget_key: ウィジェットのキーに使う表示位置ごとに一意な文字列（Noneの場合はcache_keyを使う）
     """
+    widget_key = widget_key or cache_key
     if 'query' in resp:
         # クエリ情報を表示
         query = resp.query
         st.markdown("**Retrieval query**")
         st.markdown('**Query name:** {}'.format(query.name))
         st.markdown('**Question:** {}'.format(query.question))
-        for datasource in query.datasources:
-            display_datasource(datasource)
+        for i, datasource in enumerate(query.datasources):
+            display_datasource(datasource, _sub_key(cache_key, i))
     elif 'generated_sql' in resp:
         sql = resp.generated_sql
-        # 参照テーブルを表示
-        referenced_tables = extract_referenced_tables(sql)
-        if referenced_tables:
-            st.markdown("**参照テーブル:** " + ", ".join(f"`{t}`" for t in referenced_tables))
+        # 参照テーブルと実行コストのリスクを表示（結果が届く前に確認できるようにする）
+        analysis = cached_render(cache_key, "sql_analysis", lambda: analyze_sql(sql))
+        if analysis.tables:
+            st.markdown("**参照テーブル:** " + ", ".join(f"`{t}`" for t in analysis.tables))
+        if SQL_DRY_RUN_ENABLED:
+            # ドライランによるスキャン量の見積もり（受信時にバックグラウンドで実行したもの、描画中はドライランしない）
+            estimate = get_cost_estimator().peek(sql)
+            if estimate is not None:
+                st.caption(estimate.summary())
+        display_sql_risk(analysis)
         # 生成されたSQLを展開可能なブロックで表示
         with st.expander("**SQL generated:**"):
             st.code(sql, language="sql")
+            # LIMITなしで再実行した結果をファイルに書き出す
+            display_query_export(sql, widget_key=f"query_export_{widget_key}")
     elif 'result' in resp:
         # 取得したデータをDataFrameとして表示
         st.markdown('**Data retrieved:**')
 
-        # レスポンスからフィールド名を取得
-        fields = [field.name for field in resp.result.schema.fields]
-        # データを辞書形式に変換（カラム名: 値のリスト）
-        d = {}
-        for el in resp.result.data:
-            for field in fields:
-                if field in d:
-                    d[field].append(el[field])
-                else:
-                    d[field] = [el[field]]
+        # DataFrameを作成して表示（変換済みのものがあれば再利用、古いものはディスクに退避される）
+        def load_result():
+            return get_result_store().get_or_create(
+                cache_key, lambda: enrich_with_reference(data_result_to_dataframe(resp.result)),
+            )
 
-        # DataFrameを作成して表示
-        df = pd.DataFrame(d)
-        total_rows = len(df)
+        # 表示中のページの行だけを送る
+        display_result_grid(load_result, cache_key, widget_key=f"grid_{widget_key}")
+        display_result_export(load_result, cache_key, widget_key=f"export_{widget_key}")
 
-        # 行数が上限を超える場合は制限して表示
-        if total_rows > MAX_DISPLAY_ROWS:
-            display_df = df.head(MAX_DISPLAY_ROWS)
-            st.info(f"表示: {MAX_DISPLAY_ROWS}件 / 全{total_rows}件")
-        else:
-            display_df = df
+        # 後で参照できるように結果のキーをセッション状態に保存（DataFrame自体はセッションに持たない）
+        st.session_state.last_result_key = cache_key
 
-        st.dataframe(display_df)
 
-        # 後で参照できるようにセッション状態に保存
-        st.session_state.lastDataFrame = df
+def build_chart_spec(resp, validate: bool = VALIDATE_CHART_SPEC) -> dict:
+    """
+    チャートレスポンスのVega-Lite設定を描画用の辞書に変換する
 
+    protobufのStructを1回の走査で辞書に変換し、そのままst.vega_lite_chartに渡す
+    （Altairを経由した検証・再シリアライズは行わない）
 
-def handle_chart_response(resp):
+    引数:
+        resp: チャートレスポンス
+        validate: Trueの場合、Altairでスキーマ検証を行う（不正な仕様なら例外を送出）
     """
-    チャートレスポンスを表示する
+    spec = MessageToDict(type(resp.result).pb(resp.result).vega_config)
+    if validate:
+        alt.Chart.from_dict(spec)
+    return spec
 
-    Vega-Lite形式のチャート設定をAltairで描画
+
+def handle_chart_response(resp, cache_key=None):
     """
-    def _convert(v):
-        """
-        protoオブジェクトをPythonのネイティブ型に再帰的に変換する
-
-        MapComposite → dict、RepeatedComposite → list、その他 → MessageToDict
-        """
-        if isinstance(v, proto.marshal.collections.maps.MapComposite):
-            return {k: _convert(v) for k, v in v.items()}
-        elif isinstance(v, proto.marshal.collections.RepeatedComposite):
-            return [_convert(el) for el in v]
-        elif isinstance(v, (int, float, str, bool)):
-            return v
-        else:
-            return MessageToDict(v)
+    チャートレスポンスを表示する
 
+    Vega-Lite形式のチャート設定を描画
+    """
     if 'query' in resp:
         # クエリの指示を表示
         st.markdown(resp.query.instructions)
@@ -265,11 +248,10 @@ def handle_chart_response(resp):
         # 注: st.altair_chartの問題回避のためvega_lite_chartを使用
         # 参考: https://github.com/streamlit/streamlit/issues/6269
         # TODO: 上記issueが解決されたらst.altair_chartに切り替え
-        chart = alt.Chart.from_dict(_convert(resp.result.vega_config))
-        st.vega_lite_chart(json.loads(chart.to_json()))
+        st.vega_lite_chart(cached_render(cache_key, "vega", lambda: build_chart_spec(resp)))
 
 
-def show_message(msg):
+def show_message(msg, widget_key=None):
     """
     メッセージをタイプに応じて適切に表示する
 
@@ -278,13 +260,27 @@ def show_message(msg):
     - schema: スキーマ情報
     - data: データテーブル
     - chart: チャート/グラフ
+
+    変換結果はメッセージ単位でキャッシュし、再実行時は新しいメッセージのみ変換する
+    タイプごとの描画時間はメトリクスに記録する
+
+    引数:
+        msg: 表示するメッセージ
+        widget_key: 表・エクスポートのウィジェットのキーに使う、表示位置ごとに一意な文字列
+                    （会話名と一覧内の位置など。同じ内容のメッセージを1回の実行で複数表示してもキーが重ならないようにする）
+                    Noneの場合はメッセージのキャッシュキーを使う
     """
+    started = time.perf_counter()
     m = msg.system_message
-    if 'text' in m:
-        handle_text_response(getattr(m, 'text'))
-    elif 'schema' in m:
-        handle_schema_response(getattr(m, 'schema'))
-    elif 'data' in m:
-        handle_data_response(getattr(m, 'data'))
-    elif 'chart' in m:
-        handle_chart_response(getattr(m, 'chart'))
+    cache_key = message_cache_key(msg)
+    kind = message_kind(msg)
+    if kind == 'text':
+        handle_text_response(getattr(m, 'text'), cache_key)
+    elif kind == 'schema':
+        handle_schema_response(getattr(m, 'schema'), cache_key)
+    elif kind == 'data':
+        handle_data_response(getattr(m, 'data'), cache_key, widget_key or cache_key)
+    elif kind == 'chart':
+        handle_chart_response(getattr(m, 'chart'), cache_key)
+    if kind:
+        get_metrics().observe_render(kind, time.perf_counter() - started)
@@ -0,0 +1,194 @@
+"""
+チャットレスポンスのバックグラウンド受信
+chat()のストリームを別スレッドで受信してキューに積み、画面側は届いたメッセージから順に描画する
+停止時はgRPC呼び出しをキャンセルし、実行中のBigQueryジョブも中断する
+"""
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from google.api_core import exceptions as google_exceptions
+
+from utils.clients import get_bigquery_client
+
+# 回答生成の段階（表示順）
+STAGES = [
+    ("schema", "スキーマ解決"),
+    ("sql", "SQL生成"),
+    ("data", "データ取得"),
+    ("chart", "チャート生成"),
+]
+
+# 画面の更新間隔（秒）：メッセージが届かない間もこの間隔で経過時間を更新する
+POLL_INTERVAL_SECONDS = 0.5
+
+
+def message_stage(msg) -> Optional[str]:
+    """
+    システムメッセージがどの段階のものかを返す
+
+    戻り値:
+        "schema" / "sql" / "data" / "chart"（テキストなど段階に属さないものはNone）
+    """
+    m = msg.system_message
+    if 'schema' in m:
+        return "schema"
+    if 'data' in m:
+        data = m.data
+        if 'result' in data or 'big_query_job' in data:
+            return "data"
+        return "sql"
+    if 'chart' in m:
+        return "chart"
+    return None
+
+
+def message_kind(msg) -> Optional[str]:
+    """システムメッセージの種類（"text" / "schema" / "data" / "chart"、それ以外はNone）"""
+    m = msg.system_message
+    for kind in ("text", "schema", "data", "chart"):
+        if kind in m:
+            return kind
+    return None
+
+
+def cancel_bigquery_job(job):
+    """エージェントが実行したBigQueryジョブをキャンセルする"""
+    client = get_bigquery_client(job.project_id)
+    client.cancel_job(job.job_id, project=job.project_id, location=job.location or None)
+
+
+class ChatStreamWorker:
+    """
+    1回分のチャット（1つの質問に対する回答）をバックグラウンドで受信する
+
+    セッション状態に保持しておけば、Streamlitの再実行をまたいで受信を続けられる
+    """
+
+    def __init__(self, chat_client, request, on_cancel_job: Callable = cancel_bigquery_job):
+        self._queue = queue.Queue()
+        self._stream = None
+        self._lock = threading.Lock()
+        self._on_cancel_job = on_cancel_job
+        self._bigquery_jobs: List = []
+
+        # 回答を受信する会話（受信中に別の会話に切り替えた場合、この会話にだけ保存する）
+        self.convo_name: str = request.conversation_reference.conversation
+        self.started_at = time.monotonic()
+        # 開始時刻（UNIX時刻、トレースの記録用）
+        self.started_wall = time.time()
+        self.first_message_at: Optional[float] = None
+        # 受信が終わった時点（開始からの秒数）
+        self.finished_at: Optional[float] = None
+        # 段階 → 最初のメッセージを受信した時点（開始からの秒数）
+        self.stage_times: Dict[str, float] = {}
+        # 受信したシステムメッセージの種類（text/schema/data/chart）と時点（開始からの秒数）
+        self.message_times: List[Tuple[str, float]] = []
+        # 取得結果の行数の合計
+        self.rows_retrieved = 0
+        self.current_stage: Optional[str] = None
+        # 受信したメッセージ（回答キャッシュへの保存などに使う）
+        self.messages: List = []
+        self.cancelled = False
+        self.done = False
+        self.error: Optional[Exception] = None
+
+        self._thread = threading.Thread(target=self._run, args=(chat_client, request), daemon=True)
+        self._thread.start()
+
+    def _run(self, chat_client, request):
+        try:
+            stream = chat_client.chat(request=request)
+            with self._lock:
+                self._stream = stream
+                cancelled = self.cancelled
+            # 最初のメッセージを待っている間に停止された場合
+            if cancelled:
+                stream.cancel()
+                return
+
+            for message in stream:
+                self._record(message)
+                self.messages.append(message)
+                self._queue.put(message)
+        except google_exceptions.Cancelled:
+            pass
+        except Exception as e:
+            if not self.cancelled:
+                self.error = e
+        finally:
+            self.finished_at = time.monotonic() - self.started_at
+            self.done = True
+
+    def _record(self, message):
+        """受信したメッセージの段階と時刻、BigQueryジョブを記録する"""
+        now = time.monotonic() - self.started_at
+        if self.first_message_at is None:
+            self.first_message_at = now
+        if 'system_message' not in message:
+            return
+        kind = message_kind(message)
+        if kind:
+            self.message_times.append((kind, now))
+        stage = message_stage(message)
+        if stage:
+            self.stage_times.setdefault(stage, now)
+            self.current_stage = stage
+        data = message.system_message.data
+        if 'big_query_job' in data:
+            self._bigquery_jobs.append(data.big_query_job)
+        if 'result' in data:
+            self.rows_retrieved += len(data.result.data)
+
+    def elapsed(self) -> float:
+        """開始からの経過秒数"""
+        return time.monotonic() - self.started_at
+
+    def cancel(self):
+        """gRPC呼び出しとBigQueryジョブをキャンセルする"""
+        with self._lock:
+            if self.cancelled or self.done:
+                return
+            self.cancelled = True
+            stream = self._stream
+        if stream is not None:
+            stream.cancel()
+        for job in list(self._bigquery_jobs):
+            try:
+                self._on_cancel_job(job)
+            except Exception as e:
+                print(f"Error cancelling BigQuery job {job.job_id}: {e}")
+
+    def iter_messages(self, on_idle: Optional[Callable[[], None]] = None) -> Iterator:
+        """
+        受信したメッセージを順に返す（受信が完了するまで待つ）
+
+        引数:
+            on_idle: メッセージが届かない間、POLL_INTERVAL_SECONDSごとに呼ぶ関数（経過時間の更新など）
+        """
+        while True:
+            try:
+                yield self._queue.get(timeout=POLL_INTERVAL_SECONDS)
+            except queue.Empty:
+                if self.done and self._queue.empty():
+                    return
+                if on_idle:
+                    on_idle()
+
+
+def format_timeline(worker: ChatStreamWorker) -> str:
+    """
+    回答生成の進捗（スキーマ → SQL → データ → チャート）を1行の文字列にする
+
+    例: "✅ スキーマ解決 1.2s → ⏳ SQL生成 → ・データ取得 → ・チャート生成 ｜ 経過 3.4s"
+    """
+    items = []
+    for stage, label in STAGES:
+        if stage not in worker.stage_times:
+            items.append(f"・{label}")
+        elif stage == worker.current_stage and not worker.done:
+            items.append(f"⏳ {label}")
+        else:
+            items.append(f"✅ {label} {worker.stage_times[stage]:.1f}s")
+    return " → ".join(items) + f" ｜ 経過 {worker.elapsed():.1f}s"
@@ -0,0 +1,253 @@
+"""
+Gemini Data Analytics APIクライアントのプール
+全てのStreamlitセッションで固定本数のgRPCチャネルを共有し、
+セッションごとのチャネル確立・TLSハンドシェイク・認証情報の取得を省く
+
+BigQueryクライアントもプロジェクトごとに1つ作成して全セッションで共有する
+"""
+import functools
+import itertools
+import os
+import threading
+
+import google.auth
+import grpc
+import streamlit as st
+from google.api_core.client_options import ClientOptions
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import bigquery
+from google.cloud import geminidataanalytics
+from google.cloud.geminidataanalytics_v1alpha.services.data_agent_service.transports import DataAgentServiceGrpcTransport
+from google.cloud.geminidataanalytics_v1alpha.services.data_chat_service.transports import DataChatServiceGrpcTransport
+
+# プール内のチャネル数（1チャネルで複数のRPCを多重化する）
+POOL_SIZE = int(os.environ.get("GDA_CHANNEL_POOL_SIZE", "4"))
+# 接続先のエンドポイント（ローカルのスタブに向ける場合はhttp://から指定、例: http://localhost:50051）
+API_ENDPOINT = os.environ.get("GDA_API_ENDPOINT", "geminidataanalytics.googleapis.com:443")
+# http://で指定した場合はTLS・認証なしで接続する（devtools.fake_gda_serverなど）
+API_INSECURE = API_ENDPOINT.startswith("http://")
+
+# BigQuery APIの接続先（ローカルのスタブに向ける場合に指定、例: http://localhost:9050）
+BQ_API_ENDPOINT = os.environ.get("BQ_API_ENDPOINT")
+
+# チャネルオプション（メッセージサイズ無制限＋キープアライブ）
+CHANNEL_OPTIONS = [
+    ("grpc.max_send_message_length", -1),
+    ("grpc.max_receive_message_length", -1),
+    # アイドル中もPINGを送り、コネクションの切断を早期に検知する
+    ("grpc.keepalive_time_ms", 60_000),
+    ("grpc.keepalive_timeout_ms", 20_000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+]
+
+# 利用不可とみなすチャネル状態
+_UNHEALTHY_STATES = (
+    grpc.ChannelConnectivity.TRANSIENT_FAILURE,
+    grpc.ChannelConnectivity.SHUTDOWN,
+)
+
+
+class _ChannelSlot:
+    """
+    1本のgRPCチャネルと、それを共有するエージェント/チャットクライアントの組
+    """
+
+    def __init__(self, credentials):
+        if API_INSECURE:
+            self.channel = grpc.insecure_channel(API_ENDPOINT[len("http://"):], options=CHANNEL_OPTIONS)
+        else:
+            self.channel = DataChatServiceGrpcTransport.create_channel(
+                API_ENDPOINT,
+                credentials=credentials,
+                options=CHANNEL_OPTIONS,
+            )
+        self.connectivity = grpc.ChannelConnectivity.IDLE
+        # 実行中の呼び出し数（作り直す際は、これが0になってからチャネルを閉じる）
+        self._lock = threading.Lock()
+        self._active = 0
+        self._retired = False
+        self._closed = False
+        # 接続状態の変化を監視する（ヘルスチェック用）
+        self.channel.subscribe(self._on_connectivity_change, try_to_connect=False)
+
+        self.agent_client = geminidataanalytics.DataAgentServiceClient(
+            transport=DataAgentServiceGrpcTransport(channel=self.channel)
+        )
+        self.chat_client = geminidataanalytics.DataChatServiceClient(
+            transport=DataChatServiceGrpcTransport(channel=self.channel)
+        )
+
+    def _on_connectivity_change(self, connectivity):
+        self.connectivity = connectivity
+
+    @property
+    def healthy(self) -> bool:
+        return self.connectivity not in _UNHEALTHY_STATES
+
+    def call(self, method, *args, **kwargs):
+        """
+        RPCを呼び出し、終わるまでこのチャネルの実行中の呼び出しとして数える
+        ストリーミング（chat）は戻り値のgrpc.Callに終了時のコールバックを登録し、受信が終わるまで数える
+        """
+        with self._lock:
+            self._active += 1
+        try:
+            result = method(*args, **kwargs)
+        except BaseException:
+            self._end_call()
+            raise
+        # add_callbackは呼び出しが既に終わっている場合Falseを返す（コールバックは呼ばれない）
+        if not isinstance(result, grpc.Call) or not result.add_callback(self._end_call):
+            self._end_call()
+        return result
+
+    def _end_call(self):
+        with self._lock:
+            self._active -= 1
+            drained = self._retired and self._active == 0
+        if drained:
+            self.close()
+
+    def retire(self):
+        """新しい呼び出しには使わないようにし、実行中の呼び出しが全て終わった時点でチャネルを閉じる"""
+        with self._lock:
+            self._retired = True
+            drained = self._active == 0
+        if drained:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self.channel.unsubscribe(self._on_connectivity_change)
+        self.channel.close()
+
+
+class _PooledClient:
+    """
+    呼び出しのたびにプールから健全なチャネルを選び、そのクライアントに委譲するプロキシ
+
+    セッションはこのオブジェクトを通常のクライアントと同じように扱える
+    （例: state.chat_client.chat(request=req)）
+    """
+
+    def __init__(self, pool, attr: str):
+        self._pool = pool
+        self._attr = attr
+
+    def __getattr__(self, name):
+        slot = self._pool.acquire()
+        attr = getattr(getattr(slot, self._attr), name)
+        if not callable(attr):
+            return attr
+        # 呼び出しが終わるまで、作り直しでチャネルが閉じられないようにする
+        return functools.partial(slot.call, attr)
+
+
+class ClientPool:
+    """
+    プロセス全体で共有するAPIクライアントのプール
+
+    - チャネルは最初に使われた時点で作成し、以降は全セッションで使い回す
+    - ラウンドロビンで呼び出しを分散し、TRANSIENT_FAILUREのチャネルは避ける
+    - SHUTDOWNになったチャネル、または全チャネルが不調な場合は作り直す（再接続）
+    - 作り直した古いチャネルは、他のセッションの実行中の呼び出し（chatのストリームなど）が終わってから閉じる
+    """
+
+    def __init__(self, size: int = POOL_SIZE):
+        self._size = max(1, size)
+        self._lock = threading.Lock()
+        self._credentials = None
+        self._slots = [None] * self._size
+        self._cursor = itertools.count()
+        self._counters = {
+            "sessions": 0,
+            "calls": 0,
+            "channels_created": 0,
+            "reconnects": 0,
+        }
+
+        self.agent_client = _PooledClient(self, "agent_client")
+        self.chat_client = _PooledClient(self, "chat_client")
+
+    def _new_slot(self) -> _ChannelSlot:
+        # 認証情報は1回だけ取得し、全チャネルでトークンの更新を共有する
+        if self._credentials is None and not API_INSECURE:
+            self._credentials, _ = google.auth.default(scopes=DataChatServiceGrpcTransport.AUTH_SCOPES)
+        self._counters["channels_created"] += 1
+        return _ChannelSlot(self._credentials)
+
+    def _replace_slot(self, index: int) -> _ChannelSlot:
+        old = self._slots[index]
+        if old is not None:
+            old.retire()
+            self._counters["reconnects"] += 1
+        self._slots[index] = self._new_slot()
+        return self._slots[index]
+
+    def acquire(self) -> _ChannelSlot:
+        """
+        次に使うチャネルを選ぶ
+
+        戻り値:
+            健全なチャネルのスロット（必要に応じて新規作成・再接続したもの）
+        """
+        with self._lock:
+            self._counters["calls"] += 1
+            start = next(self._cursor) % self._size
+            for offset in range(self._size):
+                index = (start + offset) % self._size
+                slot = self._slots[index]
+                if slot is None or slot.connectivity == grpc.ChannelConnectivity.SHUTDOWN:
+                    return self._replace_slot(index)
+                if slot.healthy:
+                    return slot
+            # 全チャネルが不調の場合は選んだチャネルを作り直す
+            return self._replace_slot(start)
+
+    def register_session(self):
+        """新しいセッションがプールの利用を開始したことを記録する"""
+        with self._lock:
+            self._counters["sessions"] += 1
+
+    def stats(self) -> dict:
+        """
+        プールの利用状況を返す
+
+        戻り値:
+            dict: セッション数、呼び出し数、作成したチャネル数、再接続数、
+                  チャネルの再利用回数（呼び出し数 - 作成数）、各チャネルの接続状態
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["reused"] = stats["calls"] - stats["channels_created"]
+            stats["channel_states"] = [
+                slot.connectivity.name if slot else "UNUSED" for slot in self._slots
+            ]
+        return stats
+
+
+@st.cache_resource(show_spinner=False)
+def get_client_pool() -> ClientPool:
+    """プロセス共有のクライアントプールを返す（初回呼び出し時に作成）"""
+    return ClientPool()
+
+
+@st.cache_resource(show_spinner=False)
+def get_bigquery_client(project_id: str) -> bigquery.Client:
+    """
+    プロジェクトのBigQueryクライアントを返す（プロセス共有、初回呼び出し時に作成）
+
+    BQ_API_ENDPOINTにhttp://のURLを指定した場合は、認証なしでそのエンドポイント（スタブ）に接続する
+    """
+    if not BQ_API_ENDPOINT:
+        return bigquery.Client(project=project_id)
+    credentials = AnonymousCredentials() if BQ_API_ENDPOINT.startswith("http://") else None
+    return bigquery.Client(
+        project=project_id,
+        credentials=credentials,
+        client_options=ClientOptions(api_endpoint=BQ_API_ENDPOINT),
+    )
@@ -0,0 +1,154 @@
+"""
+会話一覧のページング取得ユーティリティ
+ページトークンを辿って必要な分だけ会話を取得し、エージェントごとの会話一覧（索引）を保持する
+"""
+from dataclasses import dataclass
+from typing import Dict, List
+
+from google.api_core import exceptions as google_exceptions
+from google.cloud import geminidataanalytics
+
+# 1ページあたりの取得件数
+CONVO_PAGE_SIZE = 20
+# 1回の追加読み込みで辿る最大ページ数（クライアント側フィルタ時に空ページが続く場合の上限）
+MAX_PAGES_PER_LOAD = 5
+
+# サーバー側フィルタ（agent_id）が使えるかどうか（使えないと分かった時点でプロセス全体で無効にする）
+_server_filter_supported = True
+
+
+@dataclass
+class _Cursor:
+    """1つの一覧取得（フィルタ条件）ごとのページ位置"""
+    page_token: str = ""
+    exhausted: bool = False
+
+
+def _agent_filter(agent_name: str) -> str:
+    """エージェントのリソース名からListConversationsのフィルタ式を作成する"""
+    agent_id = agent_name.split("/")[-1]
+    return f'agent_id = "{agent_id}"'
+
+
+def _create_time_key(convo) -> float:
+    return convo.create_time.timestamp() if convo.create_time else 0.0
+
+
+class ConversationIndex:
+    """
+    エージェント→会話一覧の索引
+
+    - サーバー側フィルタが使える場合はエージェントごとにページを辿る
+    - 使えない場合はプロジェクト全体の一覧を1本のカーソルで辿り、
+      取得した会話を全てエージェント別に振り分ける（他エージェントの会話も無駄にしない）
+    """
+
+    def __init__(self, parent: str):
+        self.parent = parent
+        self._by_agent: Dict[str, List] = {}
+        self._seen = set()
+        # キー: エージェント名（サーバー側フィルタ時）または ""（フィルタなしの全体一覧）
+        self._cursors: Dict[str, _Cursor] = {}
+
+    def conversations(self, agent_name: str) -> List:
+        """エージェントの取得済み会話一覧を返す"""
+        return self._by_agent.setdefault(agent_name, [])
+
+    def _cursor(self, agent_name: str) -> _Cursor:
+        key = agent_name if _server_filter_supported else ""
+        return self._cursors.setdefault(key, _Cursor())
+
+    def has_more(self, agent_name: str) -> bool:
+        """まだ取得していない会話が残っている可能性があるかどうか"""
+        return not self._cursor(agent_name).exhausted
+
+    def add(self, agent_name: str, convo):
+        """新しく作成した会話を一覧の先頭に追加する"""
+        if convo.name in self._seen:
+            return
+        self._seen.add(convo.name)
+        self.conversations(agent_name).insert(0, convo)
+
+    def seed(self, convos):
+        """ローカルに保存済みの会話を、APIから取得する前に一覧に入れておく"""
+        self._ingest(convos)
+
+    def _ingest(self, convos):
+        """取得した会話をエージェント別に振り分ける（取得済みの会話は新しく取得した内容で置き換える）"""
+        touched = set()
+        for c in convos:
+            if not c.agents:
+                continue
+            if c.name in self._seen:
+                # ローカルの会話（seed）をAPIの最新の内容（last_used_timeなど）で置き換える（並び順は保つ）
+                self._replace(c)
+                continue
+            self._seen.add(c.name)
+            self.conversations(c.agents[0]).append(c)
+            touched.add(c.agents[0])
+        # ローカルの会話とAPIの会話が混ざっても新しい順になるように並べ直す
+        for agent_name in touched:
+            self._by_agent[agent_name].sort(key=_create_time_key, reverse=True)
+
+    def _replace(self, convo):
+        """一覧内の同名の会話を置き換える"""
+        convos = self.conversations(convo.agents[0])
+        for i, c in enumerate(convos):
+            if c.name == convo.name:
+                convos[i] = convo
+                return
+
+    def load_more(self, client, agent_name: str, want: int = CONVO_PAGE_SIZE):
+        """
+        指定エージェントの会話を次のページから追加で取得する
+
+        引数:
+            client: DataChatServiceClient
+            agent_name: 対象エージェントのリソース名
+            want: 追加で取得したい件数（この件数に達するか一覧の末尾まで辿ったら終了）
+
+        戻り値:
+            APIから取得した会話のリスト（他エージェントの会話・取得済みの会話を含む）
+        """
+        global _server_filter_supported
+
+        fetched = []
+        found = 0
+        for _ in range(MAX_PAGES_PER_LOAD):
+            use_filter = _server_filter_supported
+            cursor = self._cursor(agent_name)
+            if cursor.exhausted:
+                break
+
+            request = geminidataanalytics.ListConversationsRequest(
+                parent=self.parent,
+                page_size=CONVO_PAGE_SIZE,
+                page_token=cursor.page_token,
+                filter=_agent_filter(agent_name) if use_filter else "",
+            )
+            try:
+                # ページャーは最初のページだけを取得した状態で返る（以降のページは辿らない）
+                response = client.list_conversations(request=request)
+            except (google_exceptions.InvalidArgument, google_exceptions.FailedPrecondition):
+                if not use_filter:
+                    raise
+                # フィルタ非対応：以降はフィルタなしの全体一覧＋クライアント側の振り分けで取得する
+                _server_filter_supported = False
+                continue
+
+            convos = list(response.conversations)
+            fetched.extend(convos)
+            before = len(self.conversations(agent_name))
+            self._ingest(convos)
+            found += len(self.conversations(agent_name)) - before
+
+            if use_filter and any(c.agents and c.agents[0] != agent_name for c in convos):
+                # フィルタが無視されている：取得分は振り分け済みなので、以降は全体一覧を辿る
+                _server_filter_supported = False
+                continue
+
+            cursor.page_token = response.next_page_token
+            cursor.exhausted = not cursor.page_token
+            if found >= want:
+                break
+        return fetched
@@ -0,0 +1,267 @@
+"""
+生成SQLの実行コスト見積もり（BigQueryのドライラン）
+生成SQLをドライランしてスキャン量を取得し、オンデマンド料金に換算する
+
+- 見積もりはSQLのハッシュをキーに全セッションで共有する（同じSQLは再度ドライランしない）
+- ドライランは受信中の回答のSQLについてだけ、描画とは別のスレッドで行う（過去の履歴を開いたときは実行しない）
+- 実際に生成されたSQLのスキャン量は日付（JST）ごとに集計する
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+import streamlit as st
+from google.cloud import bigquery
+
+from utils.answer_cache import JST
+from utils.clients import get_bigquery_client
+
+# ドライランを行うかどうか（SQL_DRY_RUN=0で無効化）
+SQL_DRY_RUN_ENABLED = os.environ.get("SQL_DRY_RUN", "1") != "0"
+# ドライランのタイムアウト（秒）
+DRY_RUN_TIMEOUT_SECONDS = 10.0
+# オンデマンド料金（USD / TiB）。リージョンの料金に合わせて設定する
+ON_DEMAND_USD_PER_TIB = float(os.environ.get("BQ_ON_DEMAND_USD_PER_TIB", "6.25"))
+# キャッシュする見積もりの最大件数
+COST_CACHE_MAX_ENTRIES = 1000
+# セッションごとの集計（メッセージのキャッシュキー → 推定スキャン量）
+SESSION_COST_KEY = "sql_cost_totals"
+# 見積もり中のSQL（メッセージのキャッシュキー, Future）のリストを保持するセッション状態のキー
+PENDING_COST_KEY = "sql_cost_pending"
+# LIMITを外した再実行（エクスポート）を許可する推定スキャン量の上限（バイト）。BigQueryの課金上限（maximum_bytes_billed）にも使う
+QUERY_MAX_BYTES_BILLED = int(float(os.environ.get("QUERY_MAX_GB_BILLED", "100")) * 1024 ** 3)
+# ドライランに使うスレッド数（全セッションで共有）
+DRY_RUN_WORKERS = int(os.environ.get("SQL_DRY_RUN_WORKERS", "4"))
+
+_TIB = 1024 ** 4
+
+
+def sql_hash(sql: str) -> str:
+    """見積もりキャッシュのキー（前後の空白を除いたSQLのハッシュ）"""
+    return hashlib.sha256(sql.strip().encode("utf-8")).hexdigest()
+
+
+def format_bytes(num_bytes: int) -> str:
+    """バイト数を読みやすい単位に変換する（例: 1.5 GB）"""
+    value = float(num_bytes)
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if value < 1024 or unit == "TB":
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} TB"
+
+
+@dataclass(frozen=True)
+class CostEstimate:
+    """1つのSQLの見積もり結果"""
+    bytes_processed: int = 0
+    # ドライランに失敗した場合のエラー内容
+    error: Optional[str] = None
+
+    @property
+    def usd(self) -> float:
+        """オンデマンド料金での推定費用（USD）"""
+        return self.bytes_processed / _TIB * ON_DEMAND_USD_PER_TIB
+
+    def summary(self) -> str:
+        """
+        表示用の1行（例: 推定スキャン量 1.5 GB（オンデマンド換算 約$0.0092））
+
+        ドライランではスロット使用量は得られないため、スキャン量からオンデマンド料金に換算する
+        """
+        if self.error:
+            return f"推定スキャン量: 取得できませんでした（{self.error}）"
+        return f"推定スキャン量 {format_bytes(self.bytes_processed)}（オンデマンド換算 約${self.usd:.4f}）"
+
+
+class CostEstimator:
+    """
+    ドライランによる見積もりのキャッシュと、日付ごとの集計
+    """
+
+    def __init__(self, max_entries: int = COST_CACHE_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._estimates = OrderedDict()
+        # 実行中のドライラン（SQLのハッシュ → Future、同じSQLのドライランをまとめる）
+        self._inflight: Dict[str, Future] = {}
+        # 日付 → (件数, スキャン量)、集計済みのキー
+        self._daily: Dict[str, Tuple[int, int]] = {}
+        self._recorded: Dict[str, Set[str]] = {}
+
+    def estimate(self, sql: str, client: bigquery.Client) -> CostEstimate:
+        """
+        SQLをドライランしてスキャン量を見積もる（同じSQLはキャッシュから返す）
+
+        引数:
+            sql: 見積もるSQL
+            client: ドライランに使うBigQueryクライアント
+        """
+        key = sql_hash(sql)
+        with self._lock:
+            if key in self._estimates:
+                self._estimates.move_to_end(key)
+                return self._estimates[key]
+
+        try:
+            job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+            job = client.query(sql, job_config=job_config, timeout=DRY_RUN_TIMEOUT_SECONDS)
+            estimate = CostEstimate(bytes_processed=int(job.total_bytes_processed or 0))
+        except Exception as e:
+            # APIエラーはリクエストURLなどを除いたエラー内容だけを表示する
+            errors = getattr(e, "errors", None)
+            estimate = CostEstimate(error=errors[0].get("message") if errors else str(e))
+            # 構文エラーなど（400）は同じSQLなら結果も同じためキャッシュし、通信エラーなどはキャッシュしない
+            if getattr(e, "code", None) != 400:
+                return estimate
+
+        with self._lock:
+            self._estimates[key] = estimate
+            while len(self._estimates) > self._max_entries:
+                self._estimates.popitem(last=False)
+        return estimate
+
+    def peek(self, sql: str) -> Optional[CostEstimate]:
+        """キャッシュ済みの見積もりを返す（なければNone、ドライランは行わない）"""
+        with self._lock:
+            return self._estimates.get(sql_hash(sql))
+
+    def estimate_async(self, sql: str, client: bigquery.Client, executor) -> Future:
+        """
+        SQLのドライランをスレッドプールで開始する（同じSQLのドライランが実行中ならそのFutureを返す）
+
+        戻り値:
+            CostEstimateを結果に持つFuture
+        """
+        key = sql_hash(sql)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            future = executor.submit(self.estimate, sql, client)
+            self._inflight[key] = future
+        future.add_done_callback(lambda f: self._end_inflight(key, f))
+        return future
+
+    def _end_inflight(self, key: str, future: Future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def record(self, record_key: str, estimate: CostEstimate, now: Optional[datetime] = None):
+        """
+        実際に生成されたSQLの見積もりを日付ごとの集計に加える（同じキーは1回だけ）
+
+        引数:
+            record_key: 集計の重複を防ぐキー（メッセージのキャッシュキーなど）
+            estimate: 見積もり結果
+        """
+        if estimate.error:
+            return
+        today = (now or datetime.now(JST)).astimezone(JST).date().isoformat()
+        with self._lock:
+            recorded = self._recorded.setdefault(today, set())
+            if record_key in recorded:
+                return
+            recorded.add(record_key)
+            count, total = self._daily.get(today, (0, 0))
+            self._daily[today] = (count + 1, total + estimate.bytes_processed)
+            # 前日以前の集計は保持しない
+            for day in [d for d in self._daily if d != today]:
+                del self._daily[day]
+                self._recorded.pop(day, None)
+
+    def daily_total(self, now: Optional[datetime] = None) -> Tuple[int, int]:
+        """
+        本日（JST）の集計
+
+        戻り値:
+            (SQLの件数, 推定スキャン量の合計)
+        """
+        today = (now or datetime.now(JST)).astimezone(JST).date().isoformat()
+        with self._lock:
+            return self._daily.get(today, (0, 0))
+
+
+@st.cache_resource(show_spinner=False)
+def get_cost_estimator() -> CostEstimator:
+    """プロセス共有の見積もりキャッシュを返す"""
+    return CostEstimator()
+
+
+@st.cache_resource(show_spinner=False)
+def get_dry_run_executor() -> ThreadPoolExecutor:
+    """プロセス共有のドライラン用スレッドプールを返す"""
+    return ThreadPoolExecutor(max_workers=DRY_RUN_WORKERS, thread_name_prefix="dry-run")
+
+
+def estimate_sql_cost(sql: str) -> CostEstimate:
+    """fetch_reference_dataと同じBigQueryクライアントで生成SQLをドライランする（完了まで待つ）"""
+    client = get_bigquery_client(st.secrets.cloud.project_id)
+    return get_cost_estimator().estimate(sql, client)
+
+
+def start_sql_cost_estimate(record_key: str, sql: str):
+    """
+    受信した生成SQLのドライランをバックグラウンドで開始し、完了後にセッションの集計に加えられるようにする
+    （集計への反映はrecord_pending_sql_costsで行う）
+
+    引数:
+        record_key: メッセージのキャッシュキー
+        sql: 見積もるSQL
+    """
+    estimator = get_cost_estimator()
+    estimate = estimator.peek(sql)
+    if estimate is not None:
+        record_sql_cost(record_key, estimate)
+        return
+    client = get_bigquery_client(st.secrets.cloud.project_id)
+    future = estimator.estimate_async(sql, client, get_dry_run_executor())
+    st.session_state.setdefault(PENDING_COST_KEY, []).append((record_key, future))
+
+
+def record_pending_sql_costs():
+    """完了したドライランの見積もりをセッションと日付ごとの集計に加える（実行中のものは次回に回す）"""
+    pending: List = st.session_state.get(PENDING_COST_KEY)
+    if not pending:
+        return
+    remaining = []
+    for record_key, future in pending:
+        if not future.done():
+            remaining.append((record_key, future))
+        elif future.exception() is None:
+            record_sql_cost(record_key, future.result())
+    st.session_state[PENDING_COST_KEY] = remaining
+
+
+def record_sql_cost(record_key: str, estimate: CostEstimate):
+    """
+    生成SQLの見積もりをセッションと日付ごとの集計に加える（同じメッセージは1回だけ）
+
+    引数:
+        record_key: メッセージのキャッシュキー
+        estimate: 見積もり結果
+    """
+    if estimate.error:
+        return
+    totals = st.session_state.setdefault(SESSION_COST_KEY, {})
+    if record_key in totals:
+        return
+    totals[record_key] = estimate.bytes_processed
+    get_cost_estimator().record(record_key, estimate)
+
+
+def session_total() -> Tuple[int, int]:
+    """
+    このセッションの集計
+
+    戻り値:
+        (SQLの件数, 推定スキャン量の合計)
+    """
+    totals = st.session_state.get(SESSION_COST_KEY, {})
+    return len(totals), sum(totals.values())
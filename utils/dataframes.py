@@ -0,0 +1,139 @@
+"""
+データレスポンスのDataFrame変換
+protobufのStruct行を1回だけ走査して列ごとに値を集め、スキーマの型に応じたArrow配列を作成してから
+pandasのDataFrameに変換する（数値列はコピーなしで変換される）
+"""
+from typing import List
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from google.protobuf.json_format import MessageToDict
+
+# スキーマの型名 → 変換先のArrow型
+_INTEGER_TYPES = {"INTEGER", "INT64", "INT"}
+_FLOAT_TYPES = {"FLOAT", "FLOAT64", "NUMERIC", "BIGNUMERIC", "DECIMAL"}
+_BOOL_TYPES = {"BOOLEAN", "BOOL"}
+_CAST_TYPES = {
+    "DATE": pa.date32(),
+    "DATETIME": pa.timestamp("us"),
+    "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+}
+
+# 整数列のダウンキャスト候補（小さい型から順に試す）
+_INT_DOWNCAST_TYPES = [
+    (pa.int8(), -2**7, 2**7 - 1),
+    (pa.int16(), -2**15, 2**15 - 1),
+    (pa.int32(), -2**31, 2**31 - 1),
+]
+
+# 文字列列をカテゴリ型にする条件（ユニーク値の割合がこれ以下）
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+
+def _cell(value):
+    """protobufのValueをPythonの値に変換する（存在しない場合はNone）"""
+    if value is None:
+        return None
+    kind = value.WhichOneof("kind")
+    if kind == "string_value":
+        return value.string_value
+    if kind == "number_value":
+        return value.number_value
+    if kind == "bool_value":
+        return value.bool_value
+    if kind is None or kind == "null_value":
+        return None
+    # RECORD型・REPEATED型の値
+    return MessageToDict(value)
+
+
+def _read_columns(rows, names: List[str]) -> List[list]:
+    """Structの行を1回だけ走査し、列ごとの値のリストを作成する"""
+    columns = [[] for _ in names]
+    appends = [c.append for c in columns]
+    pairs = list(zip(names, appends))
+    for row in rows:
+        get = row.fields.get
+        for name, append in pairs:
+            append(_cell(get(name)))
+    return columns
+
+
+def _downcast_int(array: pa.Array) -> pa.Array:
+    """値の範囲に収まる最小の整数型に変換する"""
+    if len(array) == array.null_count:
+        return array
+    bounds = pc.min_max(array)
+    low, high = bounds["min"].as_py(), bounds["max"].as_py()
+    for arrow_type, type_min, type_max in _INT_DOWNCAST_TYPES:
+        if type_min <= low and high <= type_max:
+            return array.cast(arrow_type)
+    return array
+
+
+def _to_arrow(values: list, field_type: str) -> pa.Array:
+    """
+    列の値をスキーマの型に応じたArrow配列に変換する
+
+    型変換に失敗した場合は、値から推論した型のまま返す
+    """
+    array = pa.array(values)
+    field_type = (field_type or "").upper()
+    try:
+        if field_type in _INTEGER_TYPES:
+            return _downcast_int(array.cast(pa.int64()))
+        if field_type in _FLOAT_TYPES:
+            return array.cast(pa.float64())
+        if field_type in _BOOL_TYPES:
+            return array.cast(pa.bool_())
+        if field_type in _CAST_TYPES:
+            return array.cast(_CAST_TYPES[field_type])
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return array
+
+    # 文字列列はユニーク値が少なければカテゴリ型（辞書エンコード）にする
+    if pa.types.is_string(array.type) and len(array) > 0:
+        encoded = array.dictionary_encode()
+        if len(encoded.dictionary) <= len(array) * CATEGORY_MAX_UNIQUE_RATIO:
+            return encoded
+    return array
+
+
+def data_result_to_dataframe(result) -> pd.DataFrame:
+    """
+    データレスポンスの取得結果（DataResult）をDataFrameに変換する
+
+    引数:
+        result: DataMessage.result（proto-plusのDataResult）
+
+    戻り値:
+        スキーマの型を反映したDataFrame（整数はダウンキャスト、文字列は必要に応じてカテゴリ型）
+    """
+    # proto-plusのラッパーを経由せず、元のprotobufを直接読む
+    pb = type(result).pb(result)
+    fields = list(pb.schema.fields)
+    names = [f.name for f in fields]
+    if not pb.data:
+        return pd.DataFrame({name: [] for name in names})
+
+    columns = _read_columns(pb.data, names)
+
+    arrays = {}
+    objects = {}
+    for field, values in zip(fields, columns):
+        try:
+            arrays[field.name] = _to_arrow(values, field.type_)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # 型が混在している列はPythonオブジェクトのまま扱う
+            objects[field.name] = values
+
+    if arrays:
+        # 数値列はArrowのバッファをそのまま参照し、変換済みの列から順にArrow側のメモリを解放する
+        df = pa.table(arrays).to_pandas(split_blocks=True, self_destruct=True)
+    else:
+        df = pd.DataFrame(index=pd.RangeIndex(len(pb.data)))
+    for name, values in objects.items():
+        df[name] = pd.Series(values, dtype=object)
+    # 列順をスキーマの順に揃える
+    return df[names] if objects else df
@@ -0,0 +1,289 @@
+"""
+会話・メッセージのローカル保存（SQLite）
+一度取得した会話とメッセージをローカルに保存し、会話を開くたびにAPIを呼ばずに表示できるようにする
+
+- サーバーから取得したメッセージは「同期済み」として保存し、以降は新しいものだけを差分取得する
+- チャット中に受信したメッセージは「仮保存」として即座に書き込み、次回の同期でサーバーの内容に置き換える
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import streamlit as st
+from google.cloud import geminidataanalytics
+
+from utils.render_cache import message_cache_key
+
+# ローカルキャッシュの保存先ディレクトリ
+CACHE_DIR = os.environ.get(
+    "JAMBOGPT_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), ".cache"),
+)
+LOCAL_STORE_PATH = os.path.join(CACHE_DIR, "history.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT PRIMARY KEY,
+    agent TEXT NOT NULL,
+    create_time INTEGER,
+    data BLOB NOT NULL,
+    -- 最後にメッセージを同期した時点の会話の最終利用時刻（これが変わっていなければ同期不要）
+    synced_last_used_time INTEGER,
+    -- これより古いメッセージが全て保存済みかどうか
+    history_complete INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS conversations_by_agent ON conversations(agent, create_time DESC);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    convo TEXT NOT NULL,
+    message_key TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    pending INTEGER NOT NULL DEFAULT 0,
+    data BLOB NOT NULL,
+    UNIQUE (convo, message_key)
+);
+CREATE INDEX IF NOT EXISTS messages_by_convo ON messages(convo, timestamp, id);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def to_micros(dt: Optional[datetime]) -> Optional[int]:
+    """日時をUNIX時間（マイクロ秒）に変換する"""
+    if dt is None:
+        return None
+    return int(dt.timestamp()) * 1_000_000 + dt.microsecond
+
+
+def micros_to_rfc3339(micros: int) -> str:
+    """UNIX時間（マイクロ秒）をAPIのフィルタで使うRFC3339形式に変換する"""
+    dt = datetime.fromtimestamp(micros // 1_000_000, tz=timezone.utc).replace(microsecond=micros % 1_000_000)
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _message_row(convo_name: str, message, pending: bool):
+    timestamp = to_micros(message.timestamp) or to_micros(datetime.now(timezone.utc))
+    # 仮保存のメッセージはIDがなく、同じ質問を繰り返すと内容も同じになるため一意なキーを振る
+    # 取得したメッセージはmessage_id（会話内で一意、行は会話ごとに一意）を使う
+    if pending:
+        key = f"pending:{uuid.uuid4().hex}"
+    elif message.message_id:
+        key = f"id:{message.message_id}"
+    else:
+        key = message_cache_key(message)
+    return (
+        convo_name,
+        key,
+        timestamp,
+        int(pending),
+        geminidataanalytics.Message.serialize(message),
+    )
+
+
+class LocalStore:
+    """
+    会話・メッセージを保存するSQLiteデータベース（全セッションで1つの接続を共有する）
+    """
+
+    def __init__(self, path: str = LOCAL_STORE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        """
+        ロックを取得してトランザクションを開始し、接続を返す
+        （検索索引など、他のモジュールが同じデータベースに独自のテーブルを持つ場合に使う）
+        """
+        with self._lock, self._conn:
+            yield self._conn
+
+    def _query(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _write(self, sql: str, rows, many: bool = False):
+        with self._lock, self._conn:
+            if many:
+                self._conn.executemany(sql, rows)
+            else:
+                self._conn.execute(sql, rows)
+
+    # ----------------------------------------
+    # 会話
+    # ----------------------------------------
+    def put_conversations(self, convos):
+        """会話を保存する（既存の同期状態は保持する）"""
+        rows = [
+            (c.name, c.agents[0], to_micros(c.create_time), geminidataanalytics.Conversation.serialize(c))
+            for c in convos if c.agents
+        ]
+        self._write(
+            """
+            INSERT INTO conversations (name, agent, create_time, data) VALUES (?, ?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET data = excluded.data, create_time = excluded.create_time
+            """,
+            rows,
+            many=True,
+        )
+
+    def conversations(self, agent_name: str, limit: int) -> List:
+        """エージェントの会話を新しい順に返す"""
+        rows = self._query(
+            "SELECT data FROM conversations WHERE agent = ? ORDER BY create_time DESC LIMIT ?",
+            (agent_name, limit),
+        )
+        return [geminidataanalytics.Conversation.deserialize(r[0]) for r in rows]
+
+    # ----------------------------------------
+    # メッセージ
+    # ----------------------------------------
+    def is_fresh(self, convo) -> bool:
+        """
+        保存済みのメッセージがサーバーと一致しているか（同期不要か）を返す
+
+        会話の最終利用時刻が前回の同期時から変わっておらず、仮保存のメッセージがない場合にTrue
+        """
+        last_used = to_micros(convo.last_used_time)
+        if last_used is None:
+            return False
+        rows = self._query(
+            """
+            SELECT synced_last_used_time,
+                   EXISTS(SELECT 1 FROM messages WHERE convo = ? AND pending = 1)
+            FROM conversations WHERE name = ?
+            """,
+            (convo.name, convo.name),
+        )
+        return bool(rows) and rows[0][0] == last_used and not rows[0][1]
+
+    def latest_synced_timestamp(self, convo_name: str) -> Optional[int]:
+        """同期済みメッセージの最新の時刻（なければNone）"""
+        rows = self._query(
+            "SELECT MAX(timestamp) FROM messages WHERE convo = ? AND pending = 0", (convo_name,)
+        )
+        return rows[0][0]
+
+    def oldest_synced_timestamp(self, convo_name: str) -> Optional[int]:
+        """同期済みメッセージの最古の時刻（なければNone）"""
+        rows = self._query(
+            "SELECT MIN(timestamp) FROM messages WHERE convo = ? AND pending = 0", (convo_name,)
+        )
+        return rows[0][0]
+
+    def is_complete(self, convo_name: str) -> bool:
+        """会話の最初のメッセージまで保存済みかどうか"""
+        rows = self._query("SELECT history_complete FROM conversations WHERE name = ?", (convo_name,))
+        return bool(rows and rows[0][0])
+
+    def add_synced(self, convo_name: str, messages, replace_pending: bool = False, replace_all: bool = False):
+        """
+        サーバーから取得したメッセージを保存する
+
+        引数:
+            convo_name: 会話のリソース名
+            messages: 保存するメッセージ
+            replace_pending: Trueの場合、仮保存のメッセージを削除する（サーバーの内容で置き換える）
+            replace_all: Trueの場合、保存済みのメッセージを全て削除してから保存する
+        """
+        rows = [_message_row(convo_name, m, pending=False) for m in messages]
+        with self._lock, self._conn:
+            if replace_all:
+                self._conn.execute("DELETE FROM messages WHERE convo = ?", (convo_name,))
+            elif replace_pending:
+                self._conn.execute("DELETE FROM messages WHERE convo = ? AND pending = 1", (convo_name,))
+            self._conn.executemany(
+                """
+                INSERT OR IGNORE INTO messages (convo, message_key, timestamp, pending, data)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+
+    def add_pending(self, convo_name: str, message):
+        """チャット中に受信したメッセージを仮保存する"""
+        self._write(
+            """
+            INSERT OR IGNORE INTO messages (convo, message_key, timestamp, pending, data)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            _message_row(convo_name, message, pending=True),
+        )
+
+    def mark_synced(self, convo, complete: Optional[bool] = None):
+        """
+        会話のメッセージを同期したことを記録する
+
+        引数:
+            convo: 同期した会話
+            complete: 指定した場合、最初のメッセージまで保存済みかどうかを更新する
+        """
+        self.put_conversations([convo])
+        self._write(
+            """
+            UPDATE conversations
+            SET synced_last_used_time = ?, history_complete = COALESCE(?, history_complete)
+            WHERE name = ?
+            """,
+            (to_micros(convo.last_used_time), None if complete is None else int(complete), convo.name),
+        )
+
+    def mark_complete(self, convo_name: str):
+        """会話の最初のメッセージまで保存済みであることを記録する"""
+        self._write("UPDATE conversations SET history_complete = 1 WHERE name = ?", (convo_name,))
+
+    def recent_messages(self, convo_name: str, limit: int) -> List:
+        """会話の最新のメッセージを時系列順に返す"""
+        rows = self._query(
+            "SELECT data FROM messages WHERE convo = ? ORDER BY timestamp DESC, id DESC LIMIT ?",
+            (convo_name, limit),
+        )
+        return [geminidataanalytics.Message.deserialize(r[0]) for r in reversed(rows)]
+
+    def messages_before(self, convo_name: str, before: int, limit: int) -> List:
+        """指定時刻より前のメッセージを、新しいものからlimit件まで時系列順に返す"""
+        rows = self._query(
+            """
+            SELECT data FROM messages WHERE convo = ? AND timestamp < ?
+            ORDER BY timestamp DESC, id DESC LIMIT ?
+            """,
+            (convo_name, before, limit),
+        )
+        return [geminidataanalytics.Message.deserialize(r[0]) for r in reversed(rows)]
+
+    # ----------------------------------------
+    # その他
+    # ----------------------------------------
+    def get_meta(self, key: str) -> Optional[str]:
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def set_meta(self, key: str, value: str):
+        self._write(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    def seconds_since(self, key: str) -> float:
+        """metaに記録した時刻（UNIX秒）からの経過秒数（記録がなければ無限大）"""
+        value = self.get_meta(key)
+        return time.time() - float(value) if value else float("inf")
+
+
+@st.cache_resource(show_spinner=False)
+def get_local_store() -> LocalStore:
+    """プロセス共有のローカル保存先を返す"""
+    return LocalStore()
@@ -0,0 +1,170 @@
+"""
+会話のメッセージの先読みキャッシュ
+サイドバーに表示した最近の会話について、最新のメッセージ（1ページ分）をバックグラウンドで読み込んでおき、
+会話を切り替えたときにAPIの往復を待たずに表示できるようにする
+
+- 会話名をキーにしたLRUで、全セッションで共有する（会話一覧自体が全セッション共通のため）
+- 値には読み込み時点の会話の最終利用時刻を付け、一覧の会話の方が新しい場合は読み直す
+- 切り替え時はキャッシュの内容をすぐに表示し、裏で最新の状態を確認する（state.fetch_messages_state）
+- 先読みは専用の少数のスレッドで行い、セッション開始時の取得（utils.bootstrap）を待たせない
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import streamlit as st
+
+from utils.local_store import to_micros
+
+# サイドバーの会話のうち、メッセージを先読みする件数（新しい順）
+PREFETCH_TOP_K = int(os.environ.get("MESSAGE_PREFETCH_TOP_K", "5"))
+# キャッシュに保持する会話数の上限
+MESSAGE_CACHE_MAX_CONVOS = int(os.environ.get("MESSAGE_CACHE_MAX_CONVOS", "200"))
+# 先読みに使うスレッド数（全セッションで共有。初期化の取得とは別にし、混雑時も先読みが割り込まないようにする）
+PREFETCH_WORKERS = int(os.environ.get("MESSAGE_PREFETCH_WORKERS", "2"))
+
+
+def convo_version(convo) -> Optional[int]:
+    """会話の最終利用時刻（UNIX時間のマイクロ秒）。変わっていればメッセージが追加されている"""
+    return to_micros(convo.last_used_time)
+
+
+@dataclass
+class CachedMessages:
+    """キャッシュした1つの会話のメッセージ"""
+    version: Optional[int]
+    messages: List
+    has_earlier: bool
+
+
+class MessageCache:
+    """
+    会話名 → 最新のメッセージのLRUキャッシュ
+
+    上限を超えた場合は最も長く使われていない会話から破棄する
+    同じ会話の先読みが重複しないよう、読み込み中の会話を記録する
+    """
+
+    def __init__(self, max_convos: int = MESSAGE_CACHE_MAX_CONVOS):
+        self._max_convos = max(1, max_convos)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, CachedMessages]" = OrderedDict()
+        # 読み込み中の会話名 → 読み込み中の最終利用時刻
+        self._inflight: Dict[str, Optional[int]] = {}
+        # 読み込みに失敗した会話名 → その最終利用時刻（再実行のたびに同じ会話の読み込みを繰り返さないため）
+        # キャッシュと同じ件数を上限に、古く失敗したものから忘れる
+        self._failed: "OrderedDict[str, Optional[int]]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._prefetched = 0
+
+    def get(self, convo_name: str) -> Optional[CachedMessages]:
+        """キャッシュした会話のメッセージを返す（なければNone）"""
+        with self._lock:
+            entry = self._entries.get(convo_name)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(convo_name)
+            self._hits += 1
+            return entry
+
+    def put(self, convo_name: str, version: Optional[int], loaded):
+        """
+        読み込んだメッセージを保存する
+
+        引数:
+            convo_name: 会話のリソース名
+            version: 読み込んだ時点の会話の最終利用時刻（convo_version）
+            loaded: (時系列順のメッセージのリスト, 以前のメッセージが残っている可能性があるかどうか)
+        """
+        messages, has_earlier = loaded
+        with self._lock:
+            current = self._entries.get(convo_name)
+            # 先に新しい状態が保存されていれば古い読み込み結果で上書きしない
+            if current is not None and (current.version or 0) > (version or 0):
+                return
+            self._entries[convo_name] = CachedMessages(version, list(messages), has_earlier)
+            self._entries.move_to_end(convo_name)
+            while len(self._entries) > self._max_convos:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, convo_name: str):
+        """会話のメッセージを破棄する（チャットでメッセージが追加された場合など）"""
+        with self._lock:
+            self._entries.pop(convo_name, None)
+
+    def prefetch(self, convos, load: Callable, executor: Executor) -> int:
+        """
+        キャッシュにない（または一覧の会話の方が新しい）会話のメッセージをバックグラウンドで読み込む
+
+        引数:
+            convos: 先読みする会話（先頭から順に読み込む）
+            load: 会話を受け取り、(メッセージのリスト, 以前のメッセージがあるか)を返す関数
+            executor: 読み込みを実行するスレッドプール
+
+        戻り値:
+            読み込みを開始した会話の数
+        """
+        started = 0
+        for convo in convos:
+            version = convo_version(convo)
+            with self._lock:
+                entry = self._entries.get(convo.name)
+                # セッションの会話一覧がキャッシュより古い場合（他のセッションが先に読み込んだ場合）も読み込まない
+                if entry is not None and (entry.version or 0) >= (version or 0):
+                    continue
+                if convo.name in self._inflight and self._inflight[convo.name] == version:
+                    continue
+                if convo.name in self._failed and self._failed[convo.name] == version:
+                    continue
+                self._inflight[convo.name] = version
+            executor.submit(self._load, convo, version, load)
+            started += 1
+        return started
+
+    def _load(self, convo, version, load):
+        try:
+            loaded = load(convo)
+        except Exception as e:
+            print(f"Error prefetching messages for {convo.name}: {e}")
+            with self._lock:
+                self._failed[convo.name] = version
+                self._failed.move_to_end(convo.name)
+                while len(self._failed) > self._max_convos:
+                    self._failed.popitem(last=False)
+            return
+        finally:
+            with self._lock:
+                if self._inflight.get(convo.name) == version:
+                    del self._inflight[convo.name]
+        self.put(convo.name, version, loaded)
+        with self._lock:
+            self._failed.pop(convo.name, None)
+            self._prefetched += 1
+
+    def stats(self) -> dict:
+        """キャッシュの利用状況（件数、読み込み中の件数、ヒット数、ミス数、先読みした件数）を返す"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "inflight": len(self._inflight),
+                "hits": self._hits,
+                "misses": self._misses,
+                "prefetched": self._prefetched,
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def get_message_cache() -> MessageCache:
+    """プロセス共有のメッセージの先読みキャッシュを返す"""
+    return MessageCache()
+
+
+@st.cache_resource(show_spinner=False)
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    """プロセス共有の先読み用スレッドプールを返す"""
+    return ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
@@ -0,0 +1,371 @@
+"""
+チャットの処理時間の計測
+1回の回答ごとに、最初のメッセージまでの時間・段階（スキーマ解決 → SQL生成 → データ取得 → チャート生成）ごとの時間・
+取得行数と、メッセージの描画時間を記録する
+
+- Prometheus形式: METRICS_PORTを指定すると http://0.0.0.0:{METRICS_PORT}/metrics で公開する
+- OpenTelemetry: OTEL_EXPORTER_OTLP_ENDPOINT（例: http://localhost:4318）を指定すると、
+  回答ごとのトレース（段階ごとのスパン）をOTLP/HTTP（JSON）でバックグラウンド送信する
+"""
+import json
+import os
+import queue
+import secrets
+import threading
+import urllib.request
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+import streamlit as st
+
+from utils.chat_stream import STAGES
+from utils.result_store import get_result_store
+from utils.templates import list_templates, load_template
+
+# Prometheus形式のメトリクスを公開するポート（未指定の場合は公開しない）
+METRICS_PORT = os.environ.get("METRICS_PORT")
+# トレースの送信先（OTLP/HTTPのエンドポイント、未指定の場合は送信しない）
+OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT")
+# トレースのサービス名
+OTEL_SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "jambogpt")
+# 送信待ちのトレースの上限（超えた分は破棄する）
+OTLP_QUEUE_SIZE = 1000
+
+# ヒストグラムのバケット
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+RENDER_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+
+def _escape(value) -> str:
+    """ラベルの値のエスケープ（バックスラッシュ・ダブルクォート・改行）"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    """Prometheus形式のラベル（例: {agent="JamboGPT",stage="sql"}）"""
+    items = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        items.append(extra)
+    return "{" + ",".join(items) + "}" if items else ""
+
+
+class Counter:
+    """ラベルごとの累積値"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help_text, labels
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labels, values)} {value}")
+        return lines
+
+
+class Histogram:
+    """ラベルごとの分布（バケットごとの件数・合計・件数）"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help_text, labels
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # ラベル → (バケットごとの件数（累積でない）, 合計, 件数)
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *label_values: str) -> int:
+        with self._lock:
+            entry = self._values.get(label_values)
+            return entry[2] if entry else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    labels = _format_labels(self.labels, values, f'le="{le}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {count}")
+        return lines
+
+
+class Gauge:
+    """取得時に関数で値を求める現在値（ラベル → 値の辞書を返す関数）"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...], collect: Callable[[], Dict[tuple, float]]):
+        self.name, self.help, self.labels = name, help_text, labels
+        self._collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for values, value in self._collect().items():
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {value}")
+        return lines
+
+
+class OtlpExporter:
+    """
+    トレースをOTLP/HTTP（JSON）で送信する
+
+    送信はバックグラウンドのスレッドで行い、送信先に接続できない場合は破棄する（画面の表示は待たせない）
+    """
+
+    def __init__(self, endpoint: str, service_name: str = OTEL_SERVICE_NAME):
+        self._url = endpoint.rstrip("/") + "/v1/traces"
+        self._service_name = service_name
+        self._queue = queue.Queue(maxsize=OTLP_QUEUE_SIZE)
+        self.sent = 0
+        self.dropped = 0
+        threading.Thread(target=self._run, name="otlp-exporter", daemon=True).start()
+
+    def export(self, spans: List[dict]):
+        """スパンを送信待ちに追加する（送信待ちが上限に達している場合は破棄する）"""
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += len(spans)
+
+    def _run(self):
+        while True:
+            spans = self._queue.get()
+            body = {
+                "resourceSpans": [{
+                    "resource": {"attributes": _otlp_attributes({"service.name": self._service_name})},
+                    "scopeSpans": [{"scope": {"name": "jambogpt.chat"}, "spans": spans}],
+                }],
+            }
+            request = urllib.request.Request(
+                self._url, data=json.dumps(body).encode("utf-8"),
+                headers={"Content-Type": "application/json"}, method="POST",
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=5):
+                    pass
+                self.sent += len(spans)
+            except Exception:
+                self.dropped += len(spans)
+
+
+def _otlp_attributes(attributes: dict) -> List[dict]:
+    """属性をOTLPのJSON形式に変換する"""
+    result = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            result.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            result.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            result.append({"key": key, "value": {"doubleValue": value}})
+        else:
+            result.append({"key": key, "value": {"stringValue": str(value)}})
+    return result
+
+
+def _span(trace_id: str, name: str, start: float, end: float, attributes: dict,
+          parent_id: Optional[str] = None, error: Optional[str] = None) -> dict:
+    """OTLPのスパン（開始・終了はUNIX時刻の秒）"""
+    span = {
+        "traceId": trace_id,
+        "spanId": secrets.token_hex(8),
+        "name": name,
+        "kind": 1,
+        "startTimeUnixNano": str(int(start * 1e9)),
+        "endTimeUnixNano": str(int(end * 1e9)),
+        "attributes": _otlp_attributes(attributes),
+        "status": {"code": 2, "message": error} if error else {"code": 1},
+    }
+    if parent_id:
+        span["parentSpanId"] = parent_id
+    return span
+
+
+def stage_durations(stage_times: Dict[str, float], finished_at: float) -> Dict[str, Tuple[float, float]]:
+    """
+    段階ごとの(開始, 終了)（開始からの秒数）
+
+    各段階は最初のメッセージを受信した時点から、次の段階の最初のメッセージ（最後の段階は受信の終了）までとする
+    """
+    ordered = sorted(stage_times.items(), key=lambda item: item[1])
+    result = {}
+    for i, (stage, start) in enumerate(ordered):
+        end = ordered[i + 1][1] if i + 1 < len(ordered) else finished_at
+        result[stage] = (start, max(start, end))
+    return result
+
+
+def template_label(agent) -> str:
+    """エージェントの作成に使ったテンプレート（説明文が一致するもの、見つからない場合は"custom"）"""
+    description = getattr(agent, "description", "")
+    for filename in list_templates():
+        template = load_template(filename)
+        if template and template.description == description:
+            return os.path.splitext(filename)[0]
+    return "custom"
+
+
+class ChatMetrics:
+    """
+    チャットのメトリクス（プロセスで共有）
+    """
+
+    def __init__(self, otlp_endpoint: Optional[str] = OTLP_ENDPOINT):
+        labels = ("agent", "template")
+        self.turns = Counter("jambogpt_chat_turns_total", "Chat turns by final status", labels + ("status",))
+        self.turn_duration = Histogram(
+            "jambogpt_chat_turn_duration_seconds", "Time from request to end of stream", labels + ("status",),
+        )
+        self.time_to_first_message = Histogram(
+            "jambogpt_chat_time_to_first_message_seconds", "Time from request to first streamed message", labels,
+        )
+        self.stage_duration = Histogram(
+            "jambogpt_chat_stage_duration_seconds", "Duration of each answer stage", labels + ("stage",),
+        )
+        self.message_offset = Histogram(
+            "jambogpt_chat_message_offset_seconds", "Time from request to each system message", labels + ("kind",),
+        )
+        self.rows_retrieved = Histogram(
+            "jambogpt_chat_rows_retrieved", "Rows retrieved per chat turn", labels, buckets=ROW_BUCKETS,
+        )
+        self.render_duration = Histogram(
+            "jambogpt_render_duration_seconds", "Time spent in show_message per message kind", ("kind",),
+            buckets=RENDER_BUCKETS,
+        )
+        self._metrics: list = [
+            self.turns, self.turn_duration, self.time_to_first_message, self.stage_duration,
+            self.message_offset, self.rows_retrieved, self.render_duration,
+        ]
+        self.exporter = OtlpExporter(otlp_endpoint) if otlp_endpoint else None
+
+    def add_gauge(self, name: str, help_text: str, labels: Tuple[str, ...], collect: Callable[[], Dict[tuple, float]]):
+        """取得時に値を求めるメトリクスを追加する（結果の保存のメモリ使用量など）"""
+        self._metrics.append(Gauge(name, help_text, labels, collect))
+
+    def record_turn(self, worker, agent_label: str, template: str):
+        """
+        1回分の回答（ChatStreamWorker）の計測値を記録し、トレースを送信する
+
+        引数:
+            worker: 受信が完了したChatStreamWorker
+            agent_label: エージェントの表示名
+            template: エージェントの作成に使ったテンプレート
+        """
+        status = "cancelled" if worker.cancelled else "error" if worker.error else "ok"
+        finished_at = worker.finished_at if worker.finished_at is not None else worker.elapsed()
+        labels = (agent_label, template)
+
+        self.turns.inc(*labels, status)
+        self.turn_duration.observe(finished_at, *labels, status)
+        if worker.first_message_at is not None:
+            self.time_to_first_message.observe(worker.first_message_at, *labels)
+        stages = stage_durations(worker.stage_times, finished_at)
+        for stage, (start, end) in stages.items():
+            self.stage_duration.observe(end - start, *labels, stage)
+        for kind, offset in worker.message_times:
+            self.message_offset.observe(offset, *labels, kind)
+        if status == "ok":
+            self.rows_retrieved.observe(worker.rows_retrieved, *labels)
+
+        if self.exporter is not None:
+            self.exporter.export(self._turn_spans(worker, stages, finished_at, agent_label, template, status))
+
+    def _turn_spans(self, worker, stages, finished_at, agent_label, template, status) -> List[dict]:
+        """回答全体のスパンと、段階ごとの子スパン"""
+        trace_id = secrets.token_hex(16)
+        base = worker.started_wall
+        attributes = {"agent": agent_label, "template": template}
+        root = _span(
+            trace_id, "chat.turn", base, base + finished_at,
+            dict(attributes, status=status, rows_retrieved=worker.rows_retrieved,
+                 time_to_first_message=worker.first_message_at or 0.0),
+            error=str(worker.error) if worker.error else None,
+        )
+        spans = [root]
+        labels = dict(STAGES)
+        for stage, (start, end) in stages.items():
+            spans.append(_span(
+                trace_id, f"chat.{stage}", base + start, base + end,
+                dict(attributes, stage=stage, label=labels.get(stage, stage)), parent_id=root["spanId"],
+            ))
+        return spans
+
+    def observe_render(self, kind: str, seconds: float):
+        """show_messageの描画時間を記録する"""
+        self.render_duration.observe(seconds, kind)
+
+    def render(self) -> str:
+        """全てのメトリクスをPrometheusのテキスト形式で返す"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(metrics: ChatMetrics, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """/metricsでPrometheus形式のメトリクスを返すサーバーをバックグラウンドで開始する"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # スクレイプごとのログは出力しない
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+@st.cache_resource(show_spinner=False)
+def get_metrics() -> ChatMetrics:
+    """プロセス共有のメトリクスを返す（METRICS_PORTが指定されていれば公開を開始する）"""
+    metrics = ChatMetrics()
+    store = get_result_store()
+
+    def result_store_bytes():
+        stats = store.stats()
+        return {("memory",): stats["bytes_resident"], ("disk",): stats["bytes_spilled"]}
+
+    metrics.add_gauge(
+        "jambogpt_result_store_bytes", "Bytes of retrieved results held in memory or spilled to disk",
+        ("location",), result_store_bytes,
+    )
+    if METRICS_PORT:
+        try:
+            serve_metrics(metrics, int(METRICS_PORT))
+        except OSError as e:
+            print(f"Error starting metrics server on port {METRICS_PORT}: {e}")
+    return metrics
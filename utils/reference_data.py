@@ -0,0 +1,202 @@
+"""
+referenceデータセットのマスタテーブルの取得とキャッシュ
+アプリ名・アクション種別のマスタを並列に取得し、メモリとローカルディスク（Parquet）に保持する
+
+- 取得はStorage Read API（Arrow）を優先し、使えない場合は通常のAPIで取得する
+- ディスクのキャッシュはPodの再起動後も使う
+- 有効期限切れ後は古いデータをそのまま返し、バックグラウンドで取得し直す（stale-while-revalidate）
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+from google.cloud import bigquery
+
+from utils.clients import get_bigquery_client
+from utils.local_store import CACHE_DIR
+
+# キャッシュの有効期限（秒）。期限切れ後は古いデータを返しつつ取得し直す
+REFERENCE_TTL_SECONDS = 3600
+# 取得に失敗したテーブルを再度取得するまでの間隔（秒）
+REFERENCE_RETRY_SECONDS = 60
+# ディスクキャッシュの保存先
+REFERENCE_CACHE_DIR = os.path.join(CACHE_DIR, "reference")
+
+# マスタテーブル名 → 取得するSQL（{project_id}を置換）
+REFERENCE_QUERIES = {
+    "application_name": """
+        SELECT application_id, application_name
+        FROM `{project_id}.reference.application_name`
+        ORDER BY CAST(application_id AS INT64)
+    """,
+    "log_point_type": """
+        SELECT type, action_name
+        FROM `{project_id}.reference.log_point_type`
+        ORDER BY CAST(type AS INT64)
+    """,
+}
+
+
+def query_to_arrow(client: bigquery.Client, sql: str) -> pa.Table:
+    """
+    SQLの結果をArrowのテーブルとして取得する
+
+    Storage Read APIを優先し、権限がないなどで失敗した場合は通常のAPIで取得し直す
+    （結果が1ページに収まる場合はライブラリ側で自動的に通常のAPIが使われる）
+    """
+    job = client.query(sql)
+    try:
+        return job.result().to_arrow(create_bqstorage_client=True)
+    except Exception:
+        # 結果は一時テーブルに保存済みのため、クエリは再実行せずに読み直す
+        return job.result().to_arrow(create_bqstorage_client=False)
+
+
+class ReferenceDataStore:
+    """
+    マスタテーブルのメモリ・ディスクキャッシュ（プロセスで共有）
+
+    返すDataFrameは全セッションで共有するため、呼び出し側で変更しないこと
+    """
+
+    def __init__(self, cache_dir: str = REFERENCE_CACHE_DIR, ttl: float = REFERENCE_TTL_SECONDS):
+        self._cache_dir = cache_dir
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # テーブル名 → (DataFrame, 取得時刻)
+        self._entries: Dict[str, Tuple[pd.DataFrame, float]] = {}
+        # テーブル名 → (直近の取得エラー, 失敗した時刻)
+        self._errors: Dict[str, Tuple[str, float]] = {}
+        # バックグラウンドで取得し直しているかどうか（同時に1回だけ）
+        self._refreshing = False
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self._cache_dir, f"{name}.parquet")
+
+    def _load_disk(self, name: str) -> Optional[Tuple[pd.DataFrame, float]]:
+        """ディスクキャッシュを読み込む（ファイルの更新時刻を取得時刻とする）"""
+        path = self._path(name)
+        try:
+            fetched_at = os.path.getmtime(path)
+            return pq.read_table(path).to_pandas(), fetched_at
+        except (OSError, pa.ArrowException):
+            return None
+
+    def _save_disk(self, name: str, table: pa.Table):
+        """ディスクキャッシュに書き込む（書き込み途中のファイルを読まないよう一時ファイルから置き換える）"""
+        os.makedirs(self._cache_dir, exist_ok=True)
+        path = self._path(name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+
+    def _fetch(self, client: bigquery.Client, project_id: str, names) -> Dict[str, str]:
+        """
+        マスタテーブルを並列に取得し、メモリとディスクのキャッシュを更新する
+
+        戻り値:
+            取得に失敗したテーブル名 → エラー内容
+        """
+        def fetch_one(name):
+            table = query_to_arrow(client, REFERENCE_QUERIES[name].format(project_id=project_id))
+            df = table.to_pandas()
+            try:
+                self._save_disk(name, table)
+            except OSError:
+                # ディスクに書けない場合もメモリのキャッシュは使う
+                pass
+            return df
+
+        errors = {}
+        with ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="reference-data") as executor:
+            futures = {name: executor.submit(fetch_one, name) for name in names}
+            for name, future in futures.items():
+                try:
+                    df = future.result()
+                except Exception as e:
+                    errors[name] = str(e)
+                    continue
+                with self._lock:
+                    self._entries[name] = (df, time.time())
+        with self._lock:
+            for name in names:
+                if name in errors:
+                    self._errors[name] = (errors[name], time.time())
+                else:
+                    self._errors.pop(name, None)
+        return errors
+
+    def _refresh_in_background(self, client: bigquery.Client, project_id: str):
+        """期限切れのマスタを全てバックグラウンドで取得し直す（取得中なら何もしない）"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self._fetch(client, project_id, list(REFERENCE_QUERIES))
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="reference-data-refresh", daemon=True).start()
+
+    def get(self, client: bigquery.Client, project_id: str) -> Tuple[Dict[str, Optional[pd.DataFrame]], Dict[str, str]]:
+        """
+        マスタテーブルを返す
+
+        - メモリにあればそれを返す
+        - なければディスクキャッシュを読み込み、それもなければ並列に取得する（この場合のみ待つ）
+        - 期限切れのデータはそのまま返し、バックグラウンドで取得し直す
+
+        戻り値:
+            (テーブル名 → DataFrame（取得できなかった場合はNone）, テーブル名 → 取得エラー)
+        """
+        now = time.time()
+        with self._lock:
+            entries = dict(self._entries)
+        for name in REFERENCE_QUERIES:
+            if name not in entries:
+                loaded = self._load_disk(name)
+                if loaded is not None:
+                    entries[name] = loaded
+                    with self._lock:
+                        self._entries.setdefault(name, loaded)
+
+        with self._lock:
+            failed_at = {name: failed for name, (_, failed) in self._errors.items()}
+        # 直前に失敗したテーブルは、しばらく再取得しない（表示のたびに待たせないため）
+        missing = [
+            name for name in REFERENCE_QUERIES
+            if name not in entries and now - failed_at.get(name, 0) > REFERENCE_RETRY_SECONDS
+        ]
+        if missing:
+            self._fetch(client, project_id, missing)
+            with self._lock:
+                entries = dict(self._entries)
+        stale = any(now - fetched_at > self._ttl for _, fetched_at in entries.values())
+        if stale and now - max(failed_at.values(), default=0) > REFERENCE_RETRY_SECONDS:
+            self._refresh_in_background(client, project_id)
+
+        with self._lock:
+            errors = {name: message for name, (message, _) in self._errors.items()}
+        data = {name: entries[name][0] if name in entries else None for name in REFERENCE_QUERIES}
+        return data, errors
+
+
+@st.cache_resource(show_spinner=False)
+def get_reference_store() -> ReferenceDataStore:
+    """プロセス共有のマスタテーブルのキャッシュを返す"""
+    return ReferenceDataStore()
+
+
+def load_reference_data(project_id: str) -> Tuple[Dict[str, Optional[pd.DataFrame]], Dict[str, str]]:
+    """fetch_reference_dataで使うマスタテーブルを取得する（キャッシュ優先）"""
+    return get_reference_store().get(get_bigquery_client(project_id), project_id)
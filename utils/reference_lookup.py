@@ -0,0 +1,118 @@
+"""
+マスタテーブルによる取得結果の名前付け
+取得結果のアプリID・アクション種別のコード列に、マスタテーブルの名前の列を追加する
+
+マスタテーブルからコード → 名前の索引を1回だけ作成し、
+結果のコード列をユニークなコードに分解（factorize）し、ユニークなコードだけを索引で変換する（行ごとのPython処理なし）
+"""
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# 名前を追加するコード列のパターン（user_appなどのアプリ名の列は既に名前のため対象外）
+_APPLICATION_ID_PATTERN = re.compile(r"^(?:(\w+)_)?application_id$")
+_ACTION_TYPE_PATTERN = re.compile(r"^(?:action_)?type$")
+
+
+def _name_column(column: str) -> Optional[Tuple[str, str]]:
+    """
+    コード列に対応する(マスタテーブル, 追加する列名)を返す（対象外の列はNone）
+
+    例: user_application_id → ("application_name", "user_application_name"), type → ("log_point_type", "action_name")
+    """
+    match = _APPLICATION_ID_PATTERN.match(column)
+    if match:
+        prefix = f"{match.group(1)}_" if match.group(1) else ""
+        return "application_name", f"{prefix}application_name"
+    if _ACTION_TYPE_PATTERN.match(column):
+        return "log_point_type", "action_name"
+    return None
+
+
+# マスタテーブル → (コード列, 名前列)
+_REFERENCE_KEYS = {
+    "application_name": ("application_id", "application_name"),
+    "log_point_type": ("type", "action_name"),
+}
+
+
+def _normalize_codes(values: pd.Series) -> pd.Series:
+    """
+    コードを文字列に揃える（マスタと結果で型が異なっても一致させるため）
+
+    整数値の浮動小数点（欠損値を含む整数列）は"1.0"ではなく"1"にする
+    """
+    if pd.api.types.is_float_dtype(values.dtype) and (values.dropna() % 1 == 0).all():
+        values = values.astype("Int64")
+    return values.astype("string")
+
+
+def referenced_columns(df: pd.DataFrame) -> List[str]:
+    """名前を追加できるコード列（名前の列が既にある場合は除く）"""
+    columns = []
+    for column in df.columns:
+        target = _name_column(str(column))
+        if target is not None and target[1] not in df.columns:
+            columns.append(column)
+    return columns
+
+
+class ReferenceLookup:
+    """
+    マスタテーブルのコード → 名前の索引
+    """
+
+    def __init__(self, reference_data: Dict[str, Optional[pd.DataFrame]]):
+        # マスタテーブル → 文字列のコードを索引にした名前のSeries
+        self._indexes: Dict[str, pd.Series] = {}
+        for table, (code_column, name_column) in _REFERENCE_KEYS.items():
+            df = reference_data.get(table)
+            if df is None or code_column not in df.columns or name_column not in df.columns:
+                continue
+            index = pd.Series(df[name_column].to_numpy(), index=_normalize_codes(df[code_column]).to_numpy())
+            self._indexes[table] = index[~index.index.duplicated()]
+
+    def enrich(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        コード列の直後に名前の列を追加したDataFrameを返す（対象の列がなければそのまま返す）
+
+        マスタにないコードの名前は欠損値になる
+        """
+        columns = [c for c in referenced_columns(df) if _name_column(str(c))[0] in self._indexes]
+        if not columns:
+            return df
+        df = df.copy(deep=False)
+        for column in columns:
+            table, new_column = _name_column(str(column))
+            if new_column in df.columns:
+                # typeとaction_typeの両方がある場合など
+                continue
+            # ユニークなコードだけを名前に変換し、各行には位置で割り当てる（欠損値・マスタにないコードは-1）
+            codes, uniques = pd.factorize(df[column])
+            unique_names = _normalize_codes(pd.Series(uniques)).map(self._indexes[table])
+            name_codes, categories = pd.factorize(unique_names)
+            row_codes = np.append(name_codes, -1)[codes]
+            df.insert(df.columns.get_loc(column) + 1, new_column, pd.Categorical.from_codes(row_codes, categories))
+        return df
+
+
+# 直近に作成した索引と元のマスタのDataFrame（マスタが同じ間は作り直さない）
+_lookup_lock = threading.Lock()
+_lookup: Optional[Tuple[tuple, ReferenceLookup]] = None
+
+
+def get_reference_lookup(reference_data: Dict[str, Optional[pd.DataFrame]]) -> ReferenceLookup:
+    """
+    マスタテーブルの索引を返す
+
+    マスタは再取得されるまで同じDataFrameが返されるため、DataFrameが変わった場合だけ作り直す
+    """
+    global _lookup
+    frames = tuple(reference_data.get(table) for table in _REFERENCE_KEYS)
+    with _lookup_lock:
+        if _lookup is None or any(a is not b for a, b in zip(_lookup[0], frames)):
+            _lookup = (frames, ReferenceLookup(reference_data))
+        return _lookup[1]
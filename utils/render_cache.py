@@ -0,0 +1,128 @@
+"""
+チャット履歴の描画用データのキャッシュ
+一度変換したDataFrame・Vega-Lite仕様・整形済みMarkdownをメッセージ単位で保持し、
+Streamlitの再実行のたびに同じ変換を繰り返さないようにする
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+import pandas as pd
+import streamlit as st
+
+# キャッシュ全体のメモリ上限（バイト）
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("RENDER_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+# メッセージオブジェクト → キャッシュキー（同じオブジェクトのシリアライズを繰り返さないため）
+_message_keys = {}
+
+
+def message_cache_key(msg) -> str:
+    """
+    メッセージのキャッシュキーを返す
+
+    メッセージ内容（message_id・timestampを含む）のハッシュを使う
+    （message_idは会話内でしか一意でなく、プロセス共有のキャッシュ・取得結果の保存先では他の会話のメッセージと衝突するため）
+    同じオブジェクトに対する2回目以降の呼び出しは計算済みのキーを返す
+    """
+    key = _message_keys.get(id(msg))
+    if key is not None:
+        return key
+    key = "sha1:" + hashlib.sha1(type(msg).serialize(msg)).hexdigest()
+    _message_keys[id(msg)] = key
+    # オブジェクトが破棄されたらキーも削除する（idの再利用で誤ったキーを返さないため）
+    weakref.finalize(msg, _message_keys.pop, id(msg), None)
+    return key
+
+
+def estimate_size(value) -> int:
+    """キャッシュする値のおおよそのメモリ使用量（バイト）を見積もる"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (dict, list)):
+        return len(json.dumps(value, default=str))
+    return sys.getsizeof(value)
+
+
+class RenderCache:
+    """
+    メモリ上限付きのLRUキャッシュ
+
+    上限を超えた場合は最も長く使われていないものから破棄する
+    """
+
+    def __init__(self, max_bytes: int = RENDER_CACHE_MAX_BYTES):
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def get_or_build(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        """
+        キャッシュ済みの値を返す。なければbuildで作成してキャッシュする
+
+        引数:
+            key: キャッシュキー（メッセージのキーと種類の組など）
+            build: 値を作成する関数
+
+        戻り値:
+            キャッシュ済み、または新しく作成した値
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[0]
+            self._misses += 1
+
+        value = build()
+        size = estimate_size(value)
+
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key][0]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            # 上限を超えた分を古いものから破棄（今回の値は残す）
+            while self._bytes > self._max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+        return value
+
+    def stats(self) -> dict:
+        """キャッシュの利用状況（件数、使用バイト数、ヒット数、ミス数）を返す"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def get_render_cache() -> RenderCache:
+    """プロセス共有の描画キャッシュを返す（キーはメッセージ内容に対応するため共有して安全）"""
+    return RenderCache()
+
+
+def cached_render(cache_key, kind: str, build: Callable[[], Any]) -> Any:
+    """
+    描画用データをキャッシュ経由で取得する
+
+    引数:
+        cache_key: message_cache_keyで求めたキー（Noneの場合はキャッシュせずに作成する）
+        kind: データの種類（"text", "dataframe", "vega"など）
+        build: データを作成する関数
+    """
+    if cache_key is None:
+        return build()
+    return get_render_cache().get_or_build((cache_key, kind), build)
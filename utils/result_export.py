@@ -0,0 +1,369 @@
+"""
+取得結果のエクスポート（CSV・Parquet・Excel）
+保存済みの取得結果、またはLIMITを外して再実行したSQLの結果を、一定行数ずつファイルに書き出してダウンロードできるようにする
+
+- 取得結果は行の範囲ごとに書き出し、DataFrame全体のコピー（全行の文字列化など）は作らない
+- 再実行したSQLの結果はBigQueryからページ単位で受け取り、そのままファイルに書き出す（全行をメモリに載せない）
+- 再実行の前にドライランで推定スキャン量を確認し、上限を超えるSQLは実行しない（課金の上限も設定する）
+- 再実行はバックグラウンドで行い、停止ボタンでBigQueryジョブをキャンセルできる
+- 書き出したファイルはローカルに一時保存し、同じ結果・形式は作り直さない
+"""
+import hashlib
+import importlib.util
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+from google.cloud import bigquery
+
+from utils.clients import get_bigquery_client
+from utils.cost_estimator import QUERY_MAX_BYTES_BILLED, estimate_sql_cost, format_bytes
+from utils.local_store import CACHE_DIR
+
+# 1回に書き出す行数
+EXPORT_CHUNK_ROWS = 50_000
+# LIMITを外して再実行する場合の最大行数
+EXPORT_MAX_ROWS = int(os.environ.get("EXPORT_MAX_ROWS", "1000000"))
+# 書き出したファイルの保存先と保持期間（秒）
+EXPORT_DIR = os.path.join(CACHE_DIR, "exports")
+EXPORT_RETENTION_SECONDS = 3600
+# 再実行の進捗の更新間隔（秒）
+EXPORT_POLL_SECONDS = 0.5
+# Excelのシートの最大行数（ヘッダー行を除く）
+XLSX_MAX_ROWS = 1_048_575
+
+# 形式 → (拡張子, MIMEタイプ)
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+# Excelの書き出しにはXlsxWriterが必要（インストールされていない場合は選択肢に出さない）
+XLSX_AVAILABLE = importlib.util.find_spec("xlsxwriter") is not None
+
+# 末尾のLIMIT句（OFFSETとセミコロンを含む）
+_TRAILING_LIMIT = re.compile(r"\s+LIMIT\s+\d+(?:\s+OFFSET\s+\d+)?\s*;?\s*$", re.IGNORECASE)
+
+
+def available_formats() -> list:
+    """選択できるエクスポート形式"""
+    return [name for name in EXPORT_FORMATS if name != "Excel" or XLSX_AVAILABLE]
+
+
+def strip_limit(sql: str) -> str:
+    """SQLの末尾のLIMIT句を外す（末尾以外のLIMITはサブクエリの一部のため残す）"""
+    return _TRAILING_LIMIT.sub("", sql.rstrip())
+
+
+class _CsvWriter:
+    """CSV（Excelで開けるようBOM付きUTF-8）"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "w", encoding="utf-8-sig", newline="")
+        self._header = True
+
+    def write(self, chunk: pd.DataFrame):
+        chunk.to_csv(self._file, header=self._header, index=False)
+        self._header = False
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetWriter:
+    """Parquet（最初の行の範囲のスキーマで全体を書き出す）"""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._writer = None
+
+    def write(self, chunk: pd.DataFrame):
+        if self._writer is None:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            self._writer = pq.ParquetWriter(self._path, table.schema)
+        else:
+            table = pa.Table.from_pandas(chunk, schema=self._writer.schema, preserve_index=False)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        else:
+            # 行がない場合も空のファイルを作る
+            pq.write_table(pa.table({}), self._path)
+
+
+class _XlsxWriter:
+    """Excel（XlsxWriterのconstant_memoryモードで1行ずつ書き出す）"""
+
+    def __init__(self, path: str):
+        import xlsxwriter
+
+        self._workbook = xlsxwriter.Workbook(path, {"constant_memory": True, "nan_inf_to_errors": True})
+        self._sheet = self._workbook.add_worksheet()
+        self._row = 0
+
+    def write(self, chunk: pd.DataFrame):
+        if self._row == 0:
+            self._sheet.write_row(0, 0, [str(c) for c in chunk.columns])
+            self._row = 1
+        for values in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+            if self._row > XLSX_MAX_ROWS:
+                return
+            self._sheet.write_row(self._row, 0, [v if isinstance(v, (int, float, bool, str)) or v is None else str(v)
+                                                 for v in values])
+            self._row += 1
+
+    def close(self):
+        self._workbook.close()
+
+
+_WRITERS = {"CSV": _CsvWriter, "Parquet": _ParquetWriter, "Excel": _XlsxWriter}
+
+
+def write_chunks(chunks: Iterable[pd.DataFrame], fmt: str, path: str) -> int:
+    """
+    DataFrameの行の範囲を順にファイルに書き出す（書き込み途中のファイルは残さない）
+
+    戻り値:
+        書き出した行数
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # 同じ結果を複数のセッションが同時に書き出しても一時ファイルが重ならないようにする
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    os.close(fd)
+    writer = _WRITERS[fmt](tmp_path)
+    rows = 0
+    try:
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+                rows += len(chunk)
+        finally:
+            writer.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return rows
+
+
+def dataframe_chunks(df: pd.DataFrame, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterable[pd.DataFrame]:
+    """DataFrameを行の範囲ごとに返す（ilocのスライスのためコピーしない）"""
+    if len(df) == 0:
+        yield df
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+class QueryExportJob:
+    """
+    SQLを再実行して結果をファイルに書き出す処理（バックグラウンドで実行する）
+
+    セッション状態に保持しておけば、Streamlitの再実行をまたいで進捗を表示し、途中で停止できる
+    BigQueryジョブにはmaximum_bytes_billedを設定し、推定を超えてスキャンする場合もBigQuery側で失敗させる
+    """
+
+    def __init__(self, client: bigquery.Client, sql: str, fmt: str, path: str, max_rows: int = EXPORT_MAX_ROWS):
+        self.fmt = fmt
+        self.path = path
+        self.rows = 0
+        self.cancelled = False
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.started_at = time.monotonic()
+        self._job = None
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, args=(client, sql, max_rows), daemon=True)
+        self._thread.start()
+
+    def _run(self, client, sql, max_rows):
+        try:
+            job_config = bigquery.QueryJobConfig(maximum_bytes_billed=QUERY_MAX_BYTES_BILLED)
+            job = client.query(sql, job_config=job_config)
+            with self._lock:
+                self._job = job
+                cancelled = self.cancelled
+            # ジョブの開始を待っている間に停止された場合
+            if cancelled:
+                job.cancel()
+                return
+            rows = job.result(page_size=EXPORT_CHUNK_ROWS, max_results=max_rows)
+            write_chunks(self._chunks(rows.to_dataframe_iterable()), self.fmt, self.path)
+        except Exception as e:
+            if not self.cancelled:
+                self.error = e
+        finally:
+            self.done = True
+
+    def _chunks(self, chunks: Iterable[pd.DataFrame]) -> Iterable[pd.DataFrame]:
+        for chunk in chunks:
+            if self.cancelled:
+                # 書き込み途中のファイルはwrite_chunksが削除する
+                raise RuntimeError("エクスポートを停止しました")
+            self.rows += len(chunk)
+            yield chunk
+
+    def elapsed(self) -> float:
+        """開始からの経過秒数"""
+        return time.monotonic() - self.started_at
+
+    def cancel(self):
+        """BigQueryジョブをキャンセルし、書き出しを中断する"""
+        with self._lock:
+            if self.cancelled or self.done:
+                return
+            self.cancelled = True
+            job = self._job
+        if job is not None:
+            try:
+                job.cancel()
+            except Exception as e:
+                print(f"Error cancelling BigQuery job {job.job_id}: {e}")
+
+
+def export_path(key, fmt: str) -> str:
+    """結果と形式に対応する書き出し先のパス"""
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+    return os.path.join(EXPORT_DIR, f"{digest}.{EXPORT_FORMATS[fmt][0]}")
+
+
+def _remove_expired_exports():
+    """保持期間を過ぎた書き出し済みファイルを削除する"""
+    now = time.time()
+    try:
+        names = os.listdir(EXPORT_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > EXPORT_RETENTION_SECONDS:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _export_controls(widget_key: str, button_label: str) -> Optional[str]:
+    """形式の選択と作成ボタンを表示し、ボタンが押された場合は選択された形式を返す"""
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        fmt = st.selectbox("形式", available_formats(), key=f"{widget_key}_format", label_visibility="collapsed")
+    with col2:
+        if st.button(button_label, key=f"{widget_key}_create"):
+            return fmt
+    return None
+
+
+def _download_button(path: str, fmt: str, file_name: str, widget_key: str):
+    """書き出し済みのファイルのダウンロードボタン"""
+    extension, mime = EXPORT_FORMATS[fmt]
+    with open(path, "rb") as f:
+        st.download_button(
+            f"⬇️ {file_name}.{extension}をダウンロード",
+            data=f,
+            file_name=f"{file_name}.{extension}",
+            mime=mime,
+            key=f"{widget_key}_download",
+            on_click="ignore",
+        )
+
+
+@st.fragment
+def display_result_export(load_df: Callable[[], pd.DataFrame], cache_key=None, widget_key: str = "export"):
+    """
+    取得結果をファイルに書き出してダウンロードするボタンを表示する
+
+    引数:
+        load_df: 取得結果を返す関数（結果の保存から取り出す）
+        cache_key: 書き出したファイルを再利用するためのキー（メッセージのキャッシュキー）
+        widget_key: ウィジェットのキーの接頭辞（メッセージごとに一意にする）
+    """
+    with st.expander("⬇️ ダウンロード"):
+        fmt = _export_controls(widget_key, "ファイルを作成")
+        if fmt is not None:
+            path = export_path((cache_key, "result"), fmt)
+            # 同じ結果・形式のファイルが残っていれば作り直さない
+            if cache_key is None or not os.path.exists(path):
+                _remove_expired_exports()
+                with st.spinner("ファイルを作成中..."):
+                    df = load_df()
+                    if fmt == "Excel" and len(df) > XLSX_MAX_ROWS:
+                        st.warning(f"Excelに書き出せるのは{XLSX_MAX_ROWS:,}行までです")
+                    try:
+                        write_chunks(dataframe_chunks(df), fmt, path)
+                    except (OSError, pa.ArrowException) as e:
+                        st.error(f"エクスポートに失敗しました: {e}")
+            st.session_state[f"{widget_key}_path"] = (fmt, path)
+        created = st.session_state.get(f"{widget_key}_path")
+        if created and os.path.exists(created[1]):
+            _download_button(created[1], created[0], "result", widget_key)
+
+
+@st.fragment
+def display_query_export(sql: str, widget_key: str = "query_export"):
+    """
+    SQLをLIMITなしで再実行し、結果をファイルに書き出してダウンロードするボタンを表示する
+
+    - 実行前にドライランし、推定スキャン量がQUERY_MAX_BYTES_BILLEDを超える場合（見積もれない場合も）は実行しない
+    - 実行中は進捗と停止ボタンを表示する（停止するとBigQueryジョブをキャンセルする）
+
+    引数:
+        sql: エージェントが生成したSQL
+        widget_key: ウィジェットのキーの接頭辞（メッセージごとに一意にする）
+    """
+    state = st.session_state
+    job_key = f"{widget_key}_job"
+    full_sql = strip_limit(sql)
+    st.caption(
+        f"LIMITなしで再実行し、最大{EXPORT_MAX_ROWS:,}行を書き出します"
+        f"（BigQueryの料金が発生します、推定スキャン量{format_bytes(QUERY_MAX_BYTES_BILLED)}まで）"
+    )
+    fmt = _export_controls(widget_key, "LIMITなしで再実行してエクスポート")
+    if fmt is not None and job_key not in state:
+        with st.spinner("推定スキャン量を確認中..."):
+            estimate = estimate_sql_cost(full_sql)
+        if estimate.error:
+            st.error(f"推定スキャン量を確認できないため実行しません: {estimate.error}")
+        elif estimate.bytes_processed > QUERY_MAX_BYTES_BILLED:
+            st.error(
+                f"推定スキャン量が{format_bytes(estimate.bytes_processed)}のため実行しません"
+                f"（上限 {format_bytes(QUERY_MAX_BYTES_BILLED)}）"
+            )
+        else:
+            _remove_expired_exports()
+            client = get_bigquery_client(st.secrets.cloud.project_id)
+            max_rows = min(EXPORT_MAX_ROWS, XLSX_MAX_ROWS) if fmt == "Excel" else EXPORT_MAX_ROWS
+            state[job_key] = QueryExportJob(client, full_sql, fmt, export_path((full_sql, EXPORT_MAX_ROWS), fmt), max_rows)
+
+    job = state.get(job_key)
+    if job is not None:
+        # 停止ボタンを押すと再実行され、その実行でキャンセルする（render_chat_turnと同じ）
+        progress = st.empty()
+        if st.button("⏹ 停止", key=f"{widget_key}_stop"):
+            job.cancel()
+        while not job.done:
+            progress.caption(f"⏳ SQLを実行してファイルを作成中... {job.rows:,}行 ｜ 経過 {job.elapsed():.1f}s")
+            time.sleep(EXPORT_POLL_SECONDS)
+        progress.empty()
+        del state[job_key]
+        if job.cancelled:
+            st.info("エクスポートを停止しました")
+        elif job.error:
+            st.error(f"エクスポートに失敗しました: {job.error}")
+        else:
+            state[f"{widget_key}_path"] = (job.fmt, job.path)
+            st.caption(f"{job.rows:,}行を書き出しました")
+    created = state.get(f"{widget_key}_path")
+    if created and os.path.exists(created[1]):
+        _download_button(created[1], created[0], "query_result", widget_key)
@@ -0,0 +1,136 @@
+"""
+取得結果のページ表示
+保存済みの取得結果（DataFrame）を並べ替え・絞り込みし、表示中のページの行だけをブラウザに送る
+
+- 並べ替え・絞り込みの結果は行の位置（整数配列）としてキャッシュし、DataFrameのコピーは作らない
+- ページ送りなどの操作はst.fragmentの範囲だけを再実行し、チャット全体は再描画しない
+"""
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.render_cache import cached_render
+
+# 1ページの行数の選択肢（先頭が既定値）
+PAGE_SIZES = [20, 50, 100, 500]
+# 絞り込みの対象を全ての列にする場合の選択肢
+ALL_COLUMNS = "（全ての列）"
+# 並べ替えなしの選択肢
+NO_SORT = "（並べ替えなし）"
+
+
+def filter_positions(df: pd.DataFrame, text: str, column: Optional[str] = None) -> np.ndarray:
+    """
+    文字列を含む行の位置を返す（大文字小文字を区別しない部分一致）
+
+    引数:
+        df: 取得結果
+        text: 絞り込む文字列（空の場合は全ての行）
+        column: 対象の列（Noneの場合は全ての列のいずれかに含む行）
+    """
+    if not text:
+        return np.arange(len(df))
+    columns = [column] if column is not None else list(df.columns)
+    mask = np.zeros(len(df), dtype=bool)
+    for name in columns:
+        values = df[name]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # カテゴリ型はカテゴリだけを判定して各行に割り当てる
+            matched = values.cat.categories.astype(str).str.contains(text, case=False, regex=False)
+            mask |= np.append(matched, False)[values.cat.codes.to_numpy()]
+        else:
+            mask |= values.astype("string").str.contains(text, case=False, regex=False, na=False).to_numpy()
+    return np.flatnonzero(mask)
+
+
+def sort_positions(df: pd.DataFrame, positions: np.ndarray, column: str, ascending: bool) -> np.ndarray:
+    """行の位置を列の値で並べ替える（安定ソート、欠損値は末尾）"""
+    values = df[column].iloc[positions].reset_index(drop=True)
+    if isinstance(values.dtype, pd.CategoricalDtype) and not values.cat.ordered:
+        # カテゴリ型はコード（初出順）で並ぶため、カテゴリを値の順に並べ直してから並べ替える
+        values = values.cat.reorder_categories(values.cat.categories.sort_values(), ordered=True)
+    order = values.sort_values(ascending=ascending, kind="stable", na_position="last").index.to_numpy()
+    return positions[order]
+
+
+def view_positions(
+    df: pd.DataFrame,
+    filter_text: str = "",
+    filter_column: Optional[str] = None,
+    sort_column: Optional[str] = None,
+    ascending: bool = True,
+) -> np.ndarray:
+    """絞り込み・並べ替えた後の行の位置"""
+    positions = filter_positions(df, filter_text, filter_column)
+    if sort_column is not None:
+        positions = sort_positions(df, positions, sort_column, ascending)
+    return positions
+
+
+@st.fragment
+def display_result_grid(load_df: Callable[[], pd.DataFrame], cache_key=None, widget_key: str = "result"):
+    """
+    取得結果を並べ替え・絞り込み・ページ送りできる表として表示する
+
+    引数:
+        load_df: 取得結果を返す関数（フラグメントの再実行のたびに結果の保存から取り出す）
+        cache_key: 行の位置をキャッシュするキー（メッセージのキャッシュキー）
+        widget_key: ウィジェットのキーの接頭辞（メッセージごとに一意にする）
+    """
+    # DataFrame自体を引数にするとセッションが保持し続けるため、毎回取り出す
+    df = load_df()
+    total_rows = len(df)
+    columns = [str(c) for c in df.columns]
+    filter_text, filter_column, sort_column, ascending = "", None, None, True
+
+    if total_rows > PAGE_SIZES[0]:
+        with st.expander("並べ替え・絞り込み"):
+            col1, col2 = st.columns(2)
+            with col1:
+                filter_text = st.text_input("絞り込み（部分一致）", key=f"{widget_key}_filter").strip()
+                selected = st.selectbox("絞り込む列", [ALL_COLUMNS] + columns, key=f"{widget_key}_filter_col")
+                filter_column = None if selected == ALL_COLUMNS else df.columns[columns.index(selected)]
+            with col2:
+                selected = st.selectbox("並べ替える列", [NO_SORT] + columns, key=f"{widget_key}_sort")
+                sort_column = None if selected == NO_SORT else df.columns[columns.index(selected)]
+                ascending = st.radio(
+                    "順序", ["昇順", "降順"], horizontal=True, key=f"{widget_key}_order",
+                ) == "昇順"
+
+    if filter_text or sort_column is not None:
+        kind = f"rows:{filter_text}:{filter_column}:{sort_column}:{ascending}"
+        positions = cached_render(
+            cache_key, kind, lambda: view_positions(df, filter_text, filter_column, sort_column, ascending),
+        )
+    else:
+        positions = None
+    view_rows = total_rows if positions is None else len(positions)
+
+    page_size = PAGE_SIZES[0]
+    page = 1
+    if view_rows > PAGE_SIZES[0]:
+        col1, col2, _ = st.columns([1, 1, 2])
+        with col1:
+            page_size = st.selectbox("表示件数", PAGE_SIZES, key=f"{widget_key}_page_size")
+        pages = -(-view_rows // page_size)
+        # 絞り込みなどでページ数が減った場合は最終ページに合わせる
+        page_key = f"{widget_key}_page"
+        if st.session_state.get(page_key, 1) > pages:
+            st.session_state[page_key] = pages
+        with col2:
+            page = int(st.number_input("ページ", min_value=1, max_value=pages, step=1, key=page_key))
+
+    start = (page - 1) * page_size
+    end = min(start + page_size, view_rows)
+    # 表示中のページの行だけを取り出して送る
+    if positions is None:
+        page_df = df.iloc[start:end]
+    else:
+        page_df = df.iloc[positions[start:end]]
+    st.dataframe(page_df)
+
+    if view_rows > page_size or view_rows != total_rows:
+        filtered = f"（絞り込み後 {view_rows}件）" if view_rows != total_rows else ""
+        st.caption(f"表示: {start + 1 if view_rows else 0}–{end}件 / 全{total_rows}件{filtered}")
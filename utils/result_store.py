@@ -0,0 +1,247 @@
+"""
+取得結果（DataFrame）の保存
+データレスポンスから作成したDataFrameを全セッションで共有し、Podごとのメモリ上限を超えた分はディスクに退避する
+
+- メモリ上限を超えると、最も長く使われていない結果からArrow IPCファイルに書き出してメモリから破棄する
+- 退避した結果は参照時にArrow IPCファイルから全体を読み戻す（再度メモリに載せてファイルは削除し、上限を超えた分は別の結果を退避する）
+- ファイルの読み書きはロックの外で行い、他のセッションの結果の参照を待たせない
+- ディスクの使用量にも上限があり、超えた分は古いファイルから削除する（削除された結果は作り直す）
+"""
+import hashlib
+import itertools
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import streamlit as st
+
+from utils.local_store import CACHE_DIR
+from utils.render_cache import estimate_size
+
+# メモリに保持する結果の上限（バイト）
+RESULT_STORE_MAX_BYTES = int(os.environ.get("RESULT_STORE_MAX_MB", "512")) * 1024 * 1024
+# ディスクに退避する結果の上限（バイト）
+RESULT_SPILL_MAX_BYTES = int(os.environ.get("RESULT_SPILL_MAX_MB", "4096")) * 1024 * 1024
+# 退避先のディレクトリ（Podごとに使い捨てのため、起動時に中身を削除する）
+RESULT_SPILL_DIR = os.path.join(CACHE_DIR, "results")
+
+
+class ResultStore:
+    """
+    メモリ上限付きのLRUの結果保存（上限を超えた分はディスクに退避する）
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = RESULT_STORE_MAX_BYTES,
+        spill_max_bytes: int = RESULT_SPILL_MAX_BYTES,
+        spill_dir: str = RESULT_SPILL_DIR,
+    ):
+        self._max_bytes = max_bytes
+        self._spill_max_bytes = spill_max_bytes
+        self._spill_dir = spill_dir
+        self._lock = threading.Lock()
+        # キー → (DataFrame, バイト数)
+        self._resident = OrderedDict()
+        # キー → (ファイルパス, ファイルサイズ)
+        self._spilled = OrderedDict()
+        # キー → DataFrame（メモリから外し、ディスクに書き出している途中のもの）
+        self._spilling = {}
+        self._spill_seq = itertools.count()
+        self._bytes_resident = 0
+        self._bytes_spilled = 0
+        self._hits = 0
+        self._misses = 0
+        self._spills = 0
+        self._reloads = 0
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    def _spill_path(self, key: Hashable) -> str:
+        # 同じキーを続けて退避・読み戻しても書き込み先が重ならないよう通し番号を付ける
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self._spill_dir, f"{digest}.{next(self._spill_seq)}.arrow")
+
+    def _write_spill(self, path: str, df: pd.DataFrame) -> Optional[int]:
+        """
+        DataFrameをArrow IPCファイルに書き出す
+
+        戻り値:
+            ファイルサイズ（Arrowに変換できない列がある場合などはNone）
+        """
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            os.makedirs(self._spill_dir, exist_ok=True)
+            with pa.OSFile(path, "wb") as sink, ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            return os.path.getsize(path)
+        except (OSError, pa.ArrowException):
+            _remove(path)
+            return None
+
+    def _read_spill(self, path: str) -> Optional[pd.DataFrame]:
+        """退避したファイルを読み込み、DataFrameに変換する（to_pandasで全体をメモリにコピーする）"""
+        try:
+            with pa.memory_map(path, "r") as source:
+                return ipc.open_file(source).read_all().to_pandas()
+        except (OSError, pa.ArrowException):
+            return None
+
+    def _add(self, key: Hashable, df: pd.DataFrame, garbage: List[str]) -> List[Tuple[Hashable, pd.DataFrame]]:
+        """
+        結果をメモリに追加し、メモリ上限を超えた分を古い結果から退避対象として取り出す（ロックを保持して呼ぶ）
+        最後に追加・参照した結果はメモリに残す
+
+        ファイルの読み書きは全セッションの参照を止めないよう、ロックを外してから_flushで行う
+
+        引数:
+            garbage: 削除するファイルのパスを追加するリスト（同じキーの退避済みのファイルなど）
+
+        戻り値:
+            退避する(キー, DataFrame)のリスト
+        """
+        # 同じキーの退避済み・退避中の内容は使わない（二重に数えないため）
+        spilled = self._spilled.pop(key, None)
+        if spilled is not None:
+            self._bytes_spilled -= spilled[1]
+            garbage.append(spilled[0])
+        self._spilling.pop(key, None)
+        previous = self._resident.pop(key, None)
+        if previous is not None:
+            self._bytes_resident -= previous[1]
+
+        size = estimate_size(df)
+        self._resident[key] = (df, size)
+        self._bytes_resident += size
+        victims = []
+        while self._bytes_resident > self._max_bytes and len(self._resident) > 1:
+            victim, (victim_df, victim_size) = self._resident.popitem(last=False)
+            self._bytes_resident -= victim_size
+            # 書き出しが終わるまでの間に参照された場合はそのままメモリに戻せるようにする
+            self._spilling[victim] = victim_df
+            victims.append((victim, victim_df))
+        return victims
+
+    def _flush(self, victims: List[Tuple[Hashable, pd.DataFrame]], garbage: List[str]):
+        """_addで取り出した結果をディスクに書き出し、不要なファイルを削除する（ロックを外して呼ぶ）"""
+        for path in garbage:
+            _remove(path)
+        for key, df in victims:
+            path = self._spill_path(key)
+            file_size = self._write_spill(path, df)
+            expired = []
+            with self._lock:
+                if self._spilling.get(key) is not df:
+                    # 書き出し中にメモリに戻された（または作り直された）
+                    expired.append(path)
+                else:
+                    del self._spilling[key]
+                    if file_size is not None:
+                        self._spilled[key] = (path, file_size)
+                        self._bytes_spilled += file_size
+                        self._spills += 1
+                # ディスクの上限を超えた分は古いファイルから削除する
+                while self._bytes_spilled > self._spill_max_bytes and self._spilled:
+                    _, (old_path, old_size) = self._spilled.popitem(last=False)
+                    self._bytes_spilled -= old_size
+                    expired.append(old_path)
+            for old_path in expired:
+                _remove(old_path)
+
+    def get(self, key: Hashable) -> Optional[pd.DataFrame]:
+        """
+        保存済みの結果を返す（退避済みの場合は読み戻す、なければNone）
+        """
+        garbage = []
+        with self._lock:
+            entry = self._resident.get(key)
+            if entry is not None:
+                self._resident.move_to_end(key)
+                self._hits += 1
+                return entry[0]
+            df = self._spilling.get(key)
+            if df is not None:
+                # 書き出し中の結果はそのままメモリに戻す（書き出したファイルは_flushで削除される）
+                self._hits += 1
+                victims = self._add(key, df, garbage)
+            else:
+                spilled = self._spilled.pop(key, None)
+                if spilled is None:
+                    return None
+                path, file_size = spilled
+                self._bytes_spilled -= file_size
+        if df is not None:
+            self._flush(victims, garbage)
+            return df
+
+        df = self._read_spill(path)
+        _remove(path)
+        if df is None:
+            return None
+        with self._lock:
+            self._hits += 1
+            self._reloads += 1
+            entry = self._resident.get(key)
+            if entry is not None:
+                # 読み戻している間に他のセッションが作り直した
+                return entry[0]
+            victims = self._add(key, df, garbage)
+        self._flush(victims, garbage)
+        return df
+
+    def get_or_create(self, key: Hashable, build: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        """
+        保存済みの結果を返す。なければbuildで作成して保存する
+
+        引数:
+            key: 結果のキー（メッセージのキャッシュキー、Noneの場合は保存せずに作成する）
+            build: DataFrameを作成する関数
+        """
+        if key is None:
+            return build()
+        df = self.get(key)
+        if df is not None:
+            return df
+        with self._lock:
+            self._misses += 1
+
+        df = build()
+
+        garbage = []
+        with self._lock:
+            if key in self._resident:
+                return self._resident[key][0]
+            victims = self._add(key, df, garbage)
+        self._flush(victims, garbage)
+        return df
+
+    def stats(self) -> dict:
+        """利用状況（メモリ・ディスクの件数とバイト数、ヒット数、退避・読み戻しの回数）を返す"""
+        with self._lock:
+            return {
+                "resident_entries": len(self._resident),
+                "bytes_resident": self._bytes_resident,
+                "spilled_entries": len(self._spilled),
+                "bytes_spilled": self._bytes_spilled,
+                "hits": self._hits,
+                "misses": self._misses,
+                "spills": self._spills,
+                "reloads": self._reloads,
+            }
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+@st.cache_resource(show_spinner=False)
+def get_result_store() -> ResultStore:
+    """プロセス共有の結果保存を返す（キーはメッセージ内容に対応するため共有して安全）"""
+    return ResultStore()
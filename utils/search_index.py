@@ -0,0 +1,292 @@
+"""
+会話履歴の全文検索
+ローカルに保存したメッセージ（質問・生成SQL・テキスト回答）の転置索引をSQLiteに持ち、
+サイドバーから過去の会話をキーワードで探せるようにする
+
+- 日本語（ひらがな・カタカナ・漢字）は2文字ずつのN-gram、英数字は単語単位で索引する
+- 索引は保存済みのメッセージの続きから差分で更新する（全体の作り直しはしない）
+- 順位付けはBM25、結果は会話ごとに最もスコアの高いメッセージを1件だけ返す
+"""
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import streamlit as st
+from google.cloud import geminidataanalytics
+
+from utils.local_store import LocalStore, get_local_store
+
+# BM25のパラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 1回の差分更新で索引するメッセージ数の上限（初回の構築で画面が長時間止まらないようにする）
+INDEX_BATCH_SIZE = 5000
+# 検索結果の抜粋の文字数
+SNIPPET_CHARS = 60
+# 候補がこの件数以下になったら、残りの語は候補に絞って索引を引く
+_NARROW_CANDIDATES = 500
+
+# ガードレール付きの質問から、ユーザーが入力した部分だけを取り出すための区切り
+_QUESTION_MARKER = "【ユーザーの質問】"
+
+_TOKEN_PATTERN = re.compile(r"[0-9a-z_]+|[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_docs (
+    message_id INTEGER PRIMARY KEY,
+    convo TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS search_docs_by_convo ON search_docs(convo);
+
+CREATE TABLE IF NOT EXISTS search_postings (
+    token TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (token, message_id)
+) WITHOUT ROWID;
+"""
+
+_HIGH_WATER_KEY = "search_index_high_water"
+
+
+def tokenize(text: str, split_words: bool = True) -> List[str]:
+    """
+    検索用に文字列を語に分割する
+
+    - 全角/半角を統一して小文字化する
+    - 英数字は単語単位（split_words=Trueの場合、"user_id"は"user_id"・"user"・"id"の3語）
+    - 日本語は2文字ずつのN-gram（1文字だけの場合はその1文字）
+
+    引数:
+        text: 分割する文字列
+        split_words: "_"区切りの単語を分けた語も含めるか（索引時はTrue、検索時はFalse）
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(text):
+        if run.isascii():
+            tokens.append(run)
+            if split_words and "_" in run:
+                tokens.extend(part for part in run.split("_") if part)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def message_search_text(msg) -> Optional[Tuple[str, str]]:
+    """
+    メッセージから検索対象の文字列を取り出す
+
+    戻り値:
+        (種類, 文字列)。種類は "question" / "answer" / "sql"（検索対象外のメッセージはNone）
+    """
+    if 'user_message' in msg:
+        text = msg.user_message.text
+        # ガードレール（システム指示）の部分は全ての質問に共通なので索引しない
+        if _QUESTION_MARKER in text:
+            text = text.split(_QUESTION_MARKER, 1)[1]
+        return "question", text.strip()
+    m = msg.system_message
+    if 'text' in m:
+        return "answer", "".join(m.text.parts)
+    if 'data' in m and m.data.generated_sql:
+        return "sql", m.data.generated_sql
+    return None
+
+
+def _snippet(text: str, query: str) -> str:
+    """最初に一致した位置の前後を抜粋する（一致しない場合は先頭から）"""
+    normalized = unicodedata.normalize("NFKC", text)
+    flat = " ".join(normalized.split())
+    pos = flat.lower().find(unicodedata.normalize("NFKC", query).lower().strip())
+    start = max(0, pos - SNIPPET_CHARS // 4) if pos > 0 else 0
+    snippet = flat[start:start + SNIPPET_CHARS]
+    if start > 0:
+        snippet = "…" + snippet
+    if start + SNIPPET_CHARS < len(flat):
+        snippet += "…"
+    return snippet
+
+
+@dataclass
+class SearchHit:
+    """検索結果（会話ごとに1件）"""
+    convo: geminidataanalytics.Conversation
+    kind: str
+    snippet: str
+    score: float
+
+
+class SearchIndex:
+    """
+    ローカル保存先のメッセージに対する転置索引
+
+    索引語→メッセージの対応（postings）はSQLiteに置き、スコア計算に使う文書の長さと会話はメモリに持つ
+    """
+
+    def __init__(self, store: LocalStore):
+        self._store = store
+        self._lock = threading.Lock()
+        # メッセージ（messages.id）→ (会話のリソース名, 語数)
+        self._docs: Dict[int, Tuple[str, int]] = {}
+        self._total_length = 0
+        with store.transaction() as conn:
+            conn.executescript(_SCHEMA)
+            for message_id, convo, length in conn.execute("SELECT message_id, convo, length FROM search_docs"):
+                self._docs[message_id] = (convo, length)
+                self._total_length += length
+
+    def update(self) -> int:
+        """
+        前回の更新以降に保存されたメッセージを索引に追加する
+
+        チャット中に仮保存したメッセージは同期時に置き換わるため索引しない
+
+        戻り値:
+            索引したメッセージ数
+        """
+        with self._lock, self._store.transaction() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = ?", (_HIGH_WATER_KEY,)).fetchone()
+            high_water = int(row[0]) if row else 0
+            rows = conn.execute(
+                "SELECT id, convo, data FROM messages WHERE id > ? AND pending = 0 ORDER BY id LIMIT ?",
+                (high_water, INDEX_BATCH_SIZE),
+            ).fetchall()
+            if not rows:
+                return 0
+
+            docs = []
+            postings = []
+            for message_id, convo, data in rows:
+                extracted = message_search_text(geminidataanalytics.Message.deserialize(data))
+                if not extracted or not extracted[1]:
+                    continue
+                kind, text = extracted
+                counts = Counter(tokenize(text))
+                if not counts:
+                    continue
+                docs.append((message_id, convo, kind, sum(counts.values()), text))
+                postings.extend((token, message_id, tf) for token, tf in counts.items())
+
+            conn.executemany("INSERT OR REPLACE INTO search_docs VALUES (?, ?, ?, ?, ?)", docs)
+            conn.executemany("INSERT OR REPLACE INTO search_postings VALUES (?, ?, ?)", postings)
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (_HIGH_WATER_KEY, str(rows[-1][0])),
+            )
+            for message_id, convo, _, length, _ in docs:
+                self._docs[message_id] = (convo, length)
+                self._total_length += length
+            return len(docs)
+
+    def _scores(self, conn, tokens: List[str]) -> Dict[int, float]:
+        """全ての語を含むメッセージのBM25スコアを計算する"""
+        doc_count = len(self._docs)
+        avg_length = self._total_length / doc_count
+        doc_freq = {
+            t: conn.execute("SELECT COUNT(*) FROM search_postings WHERE token = ?", (t,)).fetchone()[0]
+            for t in tokens
+        }
+        if not all(doc_freq.values()):
+            return {}
+
+        # 出現数の少ない語から順に引いて候補を絞り込む
+        scores: Dict[int, float] = {}
+        for i, token in enumerate(sorted(tokens, key=doc_freq.get)):
+            if i > 0 and len(scores) <= _NARROW_CANDIDATES:
+                ids = list(scores)
+                rows = conn.execute(
+                    f"SELECT message_id, tf FROM search_postings WHERE token = ? "
+                    f"AND message_id IN ({','.join('?' * len(ids))})",
+                    [token, *ids],
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT message_id, tf FROM search_postings WHERE token = ?", (token,)
+                ).fetchall()
+
+            df = doc_freq[token]
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            matched = {}
+            for message_id, tf in rows:
+                if i > 0 and message_id not in scores:
+                    continue
+                length = self._docs[message_id][1]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                matched[message_id] = scores.get(message_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+            scores = matched
+            if not scores:
+                break
+        return scores
+
+    def search(self, query: str, agent_name: Optional[str] = None, limit: int = 20) -> List[SearchHit]:
+        """
+        キーワードに一致する会話をスコア順に返す（全ての語を含むメッセージのみ対象）
+
+        引数:
+            query: 検索キーワード
+            agent_name: 指定した場合、このエージェントの会話のみ対象にする
+            limit: 返す会話数の上限
+        """
+        self.update()
+        tokens = list(dict.fromkeys(tokenize(query, split_words=False)))
+        if not tokens or not self._docs:
+            return []
+
+        with self._store.transaction() as conn:
+            scores = self._scores(conn, tokens)
+            if not scores:
+                return []
+            allowed = None
+            if agent_name:
+                allowed = {r[0] for r in conn.execute("SELECT name FROM conversations WHERE agent = ?", (agent_name,))}
+
+            # 会話ごとに最もスコアの高いメッセージだけを残す
+            best: Dict[str, Tuple[float, int]] = {}
+            for message_id, score in scores.items():
+                convo = self._docs[message_id][0]
+                if allowed is not None and convo not in allowed:
+                    continue
+                if convo not in best or score > best[convo][0]:
+                    best[convo] = (score, message_id)
+            top = heapq.nlargest(limit, best.values())
+
+            # 表示する分だけ本文と会話を読み込む
+            hits = []
+            for score, message_id in top:
+                row = conn.execute(
+                    """
+                    SELECT d.kind, d.text, c.data
+                    FROM search_docs d JOIN conversations c ON c.name = d.convo
+                    WHERE d.message_id = ?
+                    """,
+                    (message_id,),
+                ).fetchone()
+                # 会話がローカルに保存されていない場合は表示できないため除外する
+                if row is None:
+                    continue
+                kind, text, convo_data = row
+                hits.append(SearchHit(
+                    convo=geminidataanalytics.Conversation.deserialize(convo_data),
+                    kind=kind,
+                    snippet=_snippet(text, query),
+                    score=score,
+                ))
+        return hits
+
+
+@st.cache_resource(show_spinner=False)
+def get_search_index() -> SearchIndex:
+    """プロセス共有の検索索引を返す"""
+    return SearchIndex(get_local_store())
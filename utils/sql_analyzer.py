@@ -0,0 +1,407 @@
+"""
+生成SQLの解析（BigQuery標準SQL）
+字句解析でコメント・文字列・バッククォートを正しく読み飛ばし、クエリブロック（SELECT）ごとに
+参照テーブル・CTE・WHERE/ON句の条件を集める
+
+テンプレートのルール（contexts/jambo_default.yaml）に沿って、次のクエリを実行コストの高いものとして検出する
+- パーティション分割されたlog系テーブルを`timestamp_jst`の範囲指定なしで参照している
+- LIMITが付いていない
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+# timestamp_jstでパーティション分割されたテーブル
+PARTITIONED_TABLES = {"transaction_log", "log_web_payment_point", "log_point"}
+PARTITION_COLUMN = "timestamp_jst"
+
+_TOKEN_PATTERN = re.compile(
+    r"""
+      (?P<ws>\s+)
+    | (?P<comment>--[^\n]*|\#[^\n]*|/\*.*?(?:\*/|\Z))
+    | (?P<string>(?:[rRbB]{1,2})?(?:'''.*?(?:'''|\Z)|\"\"\".*?(?:\"\"\"|\Z)|'(?:\\.|[^'\\\n])*'?|"(?:\\.|[^"\\\n])*"?))
+    | (?P<quoted>`(?:\\.|[^`\\])*`?)
+    | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<param>@@?\w+)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<op>>=|<=|<>|!=|\|\||=>|[(),.;=<>+\-*/%\[\]{}:|&^~?!])
+    | (?P<other>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+# 列名として扱わない語（句のキーワード・日付の単位・型名付きリテラルなど）
+_KEYWORDS = {
+    "ALL", "AND", "ANY", "ARRAY", "AS", "ASC", "BETWEEN", "BY", "CASE", "CAST", "CROSS", "CURRENT_DATE",
+    "CURRENT_DATETIME", "CURRENT_TIMESTAMP", "DATE", "DATETIME", "DAY", "DAYOFWEEK", "DESC", "DISTINCT", "ELSE",
+    "END", "EXCEPT", "EXISTS", "EXTRACT", "FALSE", "FOLLOWING", "FROM", "FULL", "GROUP", "HAVING", "HOUR", "IF",
+    "IN", "INNER", "INTERSECT", "INTERVAL", "IS", "ISOWEEK", "JOIN", "LEFT", "LIKE", "LIMIT", "MINUTE", "MONTH",
+    "NOT", "NULL", "NULLS", "OFFSET", "ON", "OR", "ORDER", "OUTER", "OVER", "PARTITION", "PRECEDING", "QUALIFY",
+    "QUARTER", "RANGE", "RECURSIVE", "RIGHT", "ROWS", "SECOND", "SELECT", "STRUCT", "THEN", "TIME", "TIMESTAMP",
+    "TRUE", "UNBOUNDED", "UNION", "UNNEST", "USING", "WEEK", "WHEN", "WHERE", "WINDOW", "WITH", "YEAR",
+}
+# 句の切り替えとなるキーワード → 句の名前
+_CLAUSES = {
+    "SELECT": "select", "FROM": "from", "WHERE": "where", "GROUP": "group", "HAVING": "having",
+    "QUALIFY": "qualify", "WINDOW": "window", "ORDER": "order", "LIMIT": "limit", "ON": "on", "USING": "using",
+}
+# 条件を集める句
+_PREDICATE_CLAUSES = {"where", "on", "having", "qualify"}
+# 比較の演算子（BETWEEN・IN・LIKEはキーワードとして別に扱う）
+_COMPARISON_OPS = {"=", "<", ">", "<=", ">=", "<>", "!="}
+# パーティションの絞り込みになる演算子
+_RANGE_OPS = {"=", "<", ">", "<=", ">=", "BETWEEN", "IN"}
+
+
+@dataclass
+class _Token:
+    kind: str
+    text: str
+    start: int
+    end: int
+
+    @property
+    def upper(self) -> str:
+        return self.text.upper() if self.kind == "word" else self.text
+
+
+@dataclass
+class TableRef:
+    """FROM/JOIN句で参照しているテーブル"""
+    name: str
+    alias: Optional[str] = None
+    is_cte: bool = False
+
+    @property
+    def table_id(self) -> str:
+        return self.name.split(".")[-1]
+
+
+@dataclass
+class Predicate:
+    """WHERE/ON/HAVING/QUALIFY句の条件（列と演算子）"""
+    column: str
+    op: str
+    clause: str
+
+    @property
+    def column_name(self) -> str:
+        return self.column.split(".")[-1].lower()
+
+    @property
+    def qualifier(self) -> Optional[str]:
+        parts = self.column.split(".")
+        return parts[-2].lower() if len(parts) > 1 else None
+
+
+@dataclass
+class _Block:
+    """1つのクエリブロック（SELECT ... ）"""
+    depth: int
+    tables: List[TableRef] = field(default_factory=list)
+    predicates: List[Predicate] = field(default_factory=list)
+    clause: str = "select"
+    # CTEの本体の場合はそのCTE名、FROM句のサブクエリの場合は外側のブロック
+    cte_name: Optional[str] = None
+    parent: Optional["_Block"] = None
+    # 解析中の条件（AND/ORで区切られる単位）
+    columns: List[str] = field(default_factory=list)
+    op: Optional[str] = None
+    in_between: bool = False
+
+    def flush_predicate(self):
+        if self.op and self.clause in _PREDICATE_CLAUSES:
+            for column in dict.fromkeys(self.columns):
+                self.predicates.append(Predicate(column=column, op=self.op, clause=self.clause))
+        self.columns = []
+        self.op = None
+        self.in_between = False
+
+
+@dataclass
+class SqlAnalysis:
+    """SQLの解析結果"""
+    # 参照している実テーブル（CTEを除く、記述どおりの名前、ソート済み・重複なし）
+    tables: List[str]
+    # 定義されているCTE名
+    ctes: List[str]
+    predicates: List[Predicate]
+    # 全てのクエリ文の最も外側にLIMITがあるか
+    has_limit: bool
+    # timestamp_jstの範囲指定なしで参照しているパーティション分割テーブル
+    unpruned_tables: List[str]
+
+    @property
+    def issues(self) -> List[str]:
+        """ルール違反の説明"""
+        issues = [
+            f"`{t}` を `{PARTITION_COLUMN}` の期間指定なしで参照しています（全パーティションをスキャン）"
+            for t in self.unpruned_tables
+        ]
+        if self.tables and not self.has_limit:
+            issues.append("LIMITが指定されていません")
+        return issues
+
+    @property
+    def risk(self) -> str:
+        """実行コストのリスク（"high" / "medium" / "low"）"""
+        if self.unpruned_tables:
+            return "high"
+        if self.tables and not self.has_limit:
+            return "medium"
+        return "low"
+
+
+def tokenize(sql: str) -> List[_Token]:
+    """SQLを字句に分割する（空白とコメントは除く）"""
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(sql):
+        kind = match.lastgroup
+        if kind in ("ws", "comment"):
+            continue
+        tokens.append(_Token(kind, match.group(), match.start(), match.end()))
+    return _merge_paths(tokens)
+
+
+def _merge_paths(tokens: List[_Token]) -> List[_Token]:
+    """空白を挟まずに「.」でつながった名前（t.col、`p.d`.tなど）を1つの字句にまとめる"""
+    merged: List[_Token] = []
+    for token in tokens:
+        if (
+            len(merged) >= 2
+            and token.kind in ("word", "quoted")
+            and merged[-1].text == "." and merged[-1].start == merged[-2].end and token.start == merged[-1].end
+            and merged[-2].kind in ("name", "word", "quoted")
+        ):
+            dot = merged.pop()
+            prev = merged.pop()
+            merged.append(_Token("name", prev.text + dot.text + token.text, prev.start, token.end))
+        else:
+            merged.append(token)
+    return merged
+
+
+def _unquote(text: str) -> str:
+    return text.replace("`", "")
+
+
+def _is_column(tokens: List[_Token], i: int) -> bool:
+    """i番目の字句が列の参照かどうか（関数名・キーワードは除く）"""
+    token = tokens[i]
+    if token.kind not in ("word", "quoted", "name"):
+        return False
+    if token.kind == "word" and token.upper in _KEYWORDS:
+        return False
+    next_token = tokens[i + 1] if i + 1 < len(tokens) else None
+    return not (next_token and next_token.text == "(")
+
+
+def _parse_table(tokens: List[_Token], i: int, ctes: Set[str]):
+    """
+    FROM/JOINの直後（i番目から）のテーブル名と別名を読む
+
+    戻り値:
+        (TableRef、読み終えた次の位置)。サブクエリ・UNNESTなどテーブルでない場合は(None, i)
+    """
+    if i >= len(tokens) or tokens[i].kind not in ("word", "quoted", "name") or tokens[i].upper == "UNNEST":
+        return None, i
+    if i + 1 < len(tokens) and tokens[i + 1].text == "(":
+        # テーブル関数
+        return None, i
+    # ハイフンを含むプロジェクトID（my-project.dataset.table）は空白なしで続く字句をつなげる
+    end = i
+    text = tokens[i].text
+    while (
+        end + 2 < len(tokens) and tokens[end + 1].text == "-"
+        and tokens[end + 1].start == tokens[end].end and tokens[end + 2].start == tokens[end + 1].end
+    ):
+        text += "-" + tokens[end + 2].text
+        end += 2
+    name = _unquote(text)
+    i = end + 1
+
+    alias = None
+    if i < len(tokens) and tokens[i].upper == "AS":
+        i += 1
+    if i < len(tokens) and tokens[i].kind in ("word", "quoted") and tokens[i].upper not in _KEYWORDS:
+        alias = _unquote(tokens[i].text)
+        i += 1
+    return TableRef(name=name, alias=alias, is_cte=name.lower() in ctes), i
+
+
+def analyze_sql(sql: str) -> SqlAnalysis:
+    """
+    SQLを解析し、参照テーブル・CTE・条件・ルール違反を返す
+
+    引数:
+        sql: 解析対象のSQL文字列（複数の文を含んでもよい）
+    """
+    tokens = tokenize(sql or "")
+    blocks: List[_Block] = []
+    stack: List[_Block] = []
+    ctes: Dict[str, None] = {}
+    depth = 0
+    # WITH句の深さ（CTEの定義を読んでいる間だけ設定）
+    with_depth: Optional[int] = None
+    pending_cte: Optional[str] = None
+    pending_parent: Optional[_Block] = None
+    statement_is_query = False
+    statement_has_limit = False
+    statement_limits: List[bool] = []
+
+    def current() -> Optional[_Block]:
+        return stack[-1] if stack and stack[-1].depth == depth else None
+
+    def end_statement():
+        nonlocal statement_is_query, statement_has_limit
+        if statement_is_query:
+            statement_limits.append(statement_has_limit)
+        statement_is_query = statement_has_limit = False
+
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        upper = token.upper
+        block = current()
+
+        if token.text == "(":
+            depth += 1
+        elif token.text == ")":
+            while stack and stack[-1].depth >= depth:
+                stack.pop().flush_predicate()
+            depth = max(0, depth - 1)
+        elif token.text == ";" and depth == 0:
+            while stack:
+                stack.pop().flush_predicate()
+            end_statement()
+        elif upper == "WITH" and token.kind == "word":
+            with_depth = depth
+        elif (
+            with_depth == depth and token.kind in ("word", "quoted") and i + 2 < len(tokens)
+            and tokens[i + 1].upper == "AS" and tokens[i + 2].text == "("
+        ):
+            # CTEの定義（name AS (...)）
+            name = _unquote(token.text)
+            ctes[name.lower()] = None
+            pending_cte = name
+        elif upper == "SELECT" and token.kind == "word":
+            if with_depth == depth:
+                with_depth = None
+            if block is not None:
+                # UNIONなどで続くSELECTは別のブロックにする
+                stack.pop().flush_predicate()
+            block = _Block(depth=depth)
+            if pending_cte and depth > 0:
+                block.cte_name, pending_cte = pending_cte, None
+            if pending_parent is not None and depth > 0:
+                block.parent, pending_parent = pending_parent, None
+            blocks.append(block)
+            stack.append(block)
+            if depth == 0:
+                statement_is_query = True
+        elif block is not None and upper in _CLAUSES and token.kind == "word":
+            block.flush_predicate()
+            block.clause = _CLAUSES[upper]
+            if upper == "LIMIT" and depth == 0:
+                statement_has_limit = True
+            if upper == "FROM":
+                if i + 1 < len(tokens) and tokens[i + 1].text == "(":
+                    pending_parent = block
+                ref, i = _parse_table(tokens, i + 1, ctes)
+                if ref:
+                    block.tables.append(ref)
+                continue
+        elif block is not None and upper == "JOIN" and token.kind == "word":
+            block.flush_predicate()
+            block.clause = "from"
+            if i + 1 < len(tokens) and tokens[i + 1].text == "(":
+                pending_parent = block
+            ref, i = _parse_table(tokens, i + 1, ctes)
+            if ref:
+                block.tables.append(ref)
+            continue
+        elif block is not None and token.text == "," and block.clause == "from":
+            if i + 1 < len(tokens) and tokens[i + 1].text == "(":
+                pending_parent = block
+            ref, i = _parse_table(tokens, i + 1, ctes)
+            if ref:
+                block.tables.append(ref)
+            continue
+
+        # 条件の列と演算子を集める（関数の引数など、括弧の内側も外側のブロックの条件として扱う）
+        target = stack[-1] if stack else None
+        if target is not None and target.clause in _PREDICATE_CLAUSES and upper not in _CLAUSES:
+            if upper in ("AND", "OR") and token.kind == "word":
+                if upper == "AND" and target.in_between:
+                    target.in_between = False
+                else:
+                    target.flush_predicate()
+            elif token.text in _COMPARISON_OPS:
+                target.op = target.op or token.text
+            elif upper in ("BETWEEN", "IN", "LIKE") and token.kind == "word":
+                target.op = target.op or upper
+                target.in_between = upper == "BETWEEN"
+            elif _is_column(tokens, i):
+                target.columns.append(_unquote(token.text))
+        i += 1
+
+    while stack:
+        stack.pop().flush_predicate()
+    end_statement()
+
+    refs = [t for b in blocks for t in b.tables]
+    return SqlAnalysis(
+        tables=sorted({t.name for t in refs if not t.is_cte}),
+        ctes=list(ctes),
+        predicates=[p for b in blocks for p in b.predicates],
+        has_limit=all(statement_limits),
+        unpruned_tables=sorted({
+            t.name for b in blocks for t in b.tables
+            if not t.is_cte and t.table_id.lower() in PARTITIONED_TABLES and not _is_pruned(b, t, blocks)
+        }),
+    )
+
+
+def _has_partition_filter(block: _Block, qualifiers: Optional[Set[str]]) -> bool:
+    """
+    ブロックの条件に、パーティション列の範囲指定があるか
+
+    引数:
+        qualifiers: 列が修飾されている場合に一致すべき名前（Noneの場合は修飾を問わない）
+    """
+    for p in block.predicates:
+        if p.clause in ("where", "on") and p.op in _RANGE_OPS and p.column_name == PARTITION_COLUMN:
+            if p.qualifier is None or qualifiers is None or p.qualifier in qualifiers:
+                return True
+    return False
+
+
+def _is_pruned(block: _Block, table: Optional[TableRef], blocks: List[_Block], seen: Optional[Set[int]] = None) -> bool:
+    """
+    テーブルの参照がパーティションの範囲指定で絞り込まれているか
+
+    同じブロックの条件に加え、サブクエリ・CTEの外側で指定された条件も（BigQueryが内側に適用するため）対象にする
+    """
+    seen = seen if seen is not None else set()
+    if id(block) in seen:
+        return False
+    seen.add(id(block))
+
+    if table is None:
+        # FROM句のサブクエリ：外側では別名で参照されるため、修飾を問わず条件を探す
+        qualifiers = None
+    else:
+        qualifiers = {table.table_id.lower(), table.name.lower()}
+        if table.alias:
+            qualifiers.add(table.alias.lower())
+    if _has_partition_filter(block, qualifiers):
+        return True
+
+    if block.parent is not None and _is_pruned(block.parent, None, blocks, seen):
+        return True
+    if block.cte_name:
+        for b in blocks:
+            for ref in b.tables:
+                if ref.is_cte and ref.name.lower() == block.cte_name.lower() and _is_pruned(b, ref, blocks, seen):
+                    return True
+    return False
@@ -1,7 +1,12 @@
-"""テンプレート管理ユーティリティ"""
+"""
+テンプレート管理ユーティリティ
+テンプレートは1ファイルにつき1回だけ解析してメモリに保持し、contexts/の変更を監視して再読み込みする
+"""
 import os
+import threading
 import yaml
-from typing import List, Dict, Optional
+import streamlit as st
+from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
 
 CONTEXTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "contexts")
@@ -27,16 +32,18 @@ class TemplateConfig:
 
 def list_templates() -> List[str]:
     """contexts/内のYAMLファイル一覧を取得"""
-    if not os.path.exists(CONTEXTS_DIR):
-        return []
-    return [f for f in os.listdir(CONTEXTS_DIR) if f.endswith('.yaml')]
+    return get_template_registry().names()
 
 
 def load_template(filename: str) -> Optional[TemplateConfig]:
-    """YAMLテンプレートを読み込み"""
-    filepath = os.path.join(CONTEXTS_DIR, filename)
-    if not os.path.exists(filepath):
-        return None
+    """
+    YAMLテンプレートを読み込み（解析済みのものを返す。全セッションで共有するため変更しないこと）
+    """
+    return get_template_registry().get(filename)
+
+
+def _parse_template(filename: str, filepath: str) -> Optional[TemplateConfig]:
+    """YAMLテンプレートを解析してTemplateConfigを作成"""
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
             data = yaml.safe_load(f)
@@ -67,6 +74,114 @@ def load_template(filename: str) -> Optional[TemplateConfig]:
         return None
 
 
+# ファイルの内容が変わらない監視イベント
+_IGNORED_EVENTS = {"opened", "closed_no_write"}
+
+
+class TemplateRegistry:
+    """
+    解析済みテンプレートのキャッシュ（ファイルパスと更新時刻がキー）
+
+    watchdogでディレクトリを監視できる場合は、変更の通知があったファイルだけを読み直す（それ以外はメモリから返す）
+    監視できない場合は、参照のたびに更新時刻を確認して変わっていれば読み直す
+    """
+
+    def __init__(self, directory: str = CONTEXTS_DIR):
+        self._dir = directory
+        self._lock = threading.Lock()
+        # ファイルパス → (更新時刻, 解析結果)。解析に失敗したファイルもNoneとして保持し、変更されるまで読み直さない
+        self._entries: Dict[str, Tuple[int, Optional[TemplateConfig]]] = {}
+        self._names: Optional[List[str]] = None
+        # 変更通知のたびに増やす（読み込み中に変更された結果を保存しないため）
+        self._generation = 0
+        self._observer = self._start_watching()
+
+    def _start_watching(self):
+        """contexts/の変更監視を開始する（開始できない場合はNone）"""
+        if not os.path.isdir(self._dir):
+            return None
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return None
+
+        registry = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # 読み込み時のopen/closeの通知は無視する（自分の読み込みで無効化しないため）
+                if event.event_type in _IGNORED_EVENTS:
+                    return
+                paths = [event.src_path, getattr(event, "dest_path", "")]
+                registry.invalidate(*(os.fsdecode(p) for p in paths if p))
+
+        try:
+            observer = Observer()
+            observer.daemon = True
+            observer.schedule(_Handler(), self._dir, recursive=False)
+            observer.start()
+            return observer
+        except Exception as e:
+            print(f"Template watcher unavailable, falling back to mtime checks: {e}")
+            return None
+
+    @property
+    def watching(self) -> bool:
+        return self._observer is not None and self._observer.is_alive()
+
+    def invalidate(self, *paths: str):
+        """指定ファイルの解析結果とファイル一覧を破棄する"""
+        with self._lock:
+            self._generation += 1
+            self._names = None
+            for path in paths:
+                self._entries.pop(os.path.abspath(path), None)
+
+    def names(self) -> List[str]:
+        """YAMLファイル名の一覧"""
+        with self._lock:
+            if self._names is not None and self.watching:
+                return list(self._names)
+        if not os.path.exists(self._dir):
+            return []
+        with self._lock:
+            generation = self._generation
+        names = [f for f in os.listdir(self._dir) if f.endswith('.yaml')]
+        with self._lock:
+            if self._generation == generation:
+                self._names = names
+        return list(names)
+
+    def get(self, filename: str) -> Optional[TemplateConfig]:
+        """解析済みのテンプレートを返す（ファイルがない場合・解析に失敗した場合はNone）"""
+        filepath = os.path.abspath(os.path.join(self._dir, filename))
+        with self._lock:
+            entry = self._entries.get(filepath)
+            generation = self._generation
+        if entry is not None and self.watching:
+            return entry[1]
+
+        try:
+            mtime = os.stat(filepath).st_mtime_ns
+        except OSError:
+            return None
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+        template = _parse_template(filename, filepath)
+        with self._lock:
+            if self._generation == generation:
+                self._entries[filepath] = (mtime, template)
+        return template
+
+
+@st.cache_resource(show_spinner=False)
+def get_template_registry() -> TemplateRegistry:
+    """プロセス共有のテンプレートキャッシュを返す"""
+    return TemplateRegistry()
+
+
 def _build_system_instruction(base_instruction: str, tables: List[TableConfig], relationships: List[str]) -> str:
     """テーブル説明とリレーションをSystem Instructionに組み込む"""
     sections = [base_instruction.rstrip()]
@@ -0,0 +1,107 @@
+"""
+ユーザーデータを含むテキスト回答の整形
+「user_id: xxx 種類: N回 ...」形式のテキストを、ユーザーごとの箇条書きMarkdownに変換する
+
+正規表現は事前にコンパイルし、テキストを先頭から1回走査して整形する
+ストリーミングで届くテキストのパーツを順に渡すと、整形済みのユーザーは再走査しない
+"""
+import re
+from typing import List
+
+# ユーザーの区切り（"user_id: 16進数"）
+_USER_PATTERN = re.compile(r'user_id:\s*[a-f0-9]+')
+# 回数データ（"種類名: N回"）
+_ITEM_PATTERN = re.compile(r'([^:]+?):\s*(\d+)回')
+
+
+def _format_user_block(user_id: str, data: str, lines: List[str]):
+    """1ユーザー分の回数データを箇条書きにしてlinesに追加する"""
+    data = data.strip()
+    items = _ITEM_PATTERN.findall(data)
+    if items:
+        lines.append(f"**{user_id}**")
+        for item_name, count in items:
+            item_name = item_name.strip()
+            if item_name:
+                lines.append(f"  - {item_name}: {count}回")
+    else:
+        # パターンにマッチしない場合はそのまま
+        lines.append(f"**{user_id}** {data}")
+    lines.append("")
+
+
+class UserDataFormatter:
+    """
+    ユーザーデータを含むテキストを少しずつ受け取りながら整形する
+
+    使い方:
+        formatter = UserDataFormatter()
+        for part in parts:
+            formatter.feed(part)
+        markdown = formatter.finish()
+
+    次のユーザーの区切りが確定したユーザーは整形済みとして保持し、以降は最後のユーザー分だけを走査する
+    """
+
+    def __init__(self):
+        self._text = ""
+        # 整形済みの行
+        self._lines: List[str] = []
+        # 整形中のユーザー（区切りが見つかっていない場合はNone）とそのデータの開始位置
+        self._user_id = None
+        self._data_start = 0
+
+    def _scan(self, lines: List[str], final: bool):
+        """
+        未整形部分のユーザー区切りを順に処理し、区切りの手前までのユーザーを整形してlinesに追加する
+
+        戻り値:
+            (整形中のユーザー, そのデータの開始位置)
+        """
+        text = self._text
+        user_id, data_start = self._user_id, self._data_start
+        for match in _USER_PATTERN.finditer(text, data_start):
+            # 区切りの16進数が次のパーツに続いている可能性がある場合は確定しない
+            if not final and match.end() == len(text):
+                break
+            if user_id is None:
+                # 最初の区切りより前のテキスト
+                prefix = text[:match.start()].strip()
+                if prefix:
+                    lines.extend([prefix, ""])
+            else:
+                _format_user_block(user_id, text[data_start:match.start()], lines)
+            user_id = match.group().strip()
+            data_start = match.end()
+        return user_id, data_start
+
+    def feed(self, part: str):
+        """テキストの続きを追加し、区切りが確定したユーザーまで整形する"""
+        self._text += part
+        self._user_id, self._data_start = self._scan(self._lines, final=False)
+
+    def markdown(self) -> str:
+        """ここまでに受け取ったテキストの整形結果"""
+        lines = list(self._lines)
+        user_id, data_start = self._scan(lines, final=True)
+        # user_id:パターンが見つからない場合はそのまま返す
+        if user_id is None:
+            return self._text
+        _format_user_block(user_id, self._text[data_start:], lines)
+        return "\n".join(lines)
+
+    def finish(self) -> str:
+        """全てのテキストを受け取った後の整形結果"""
+        return self.markdown()
+
+
+def format_user_data_text(text: str) -> str:
+    """
+    ユーザーデータを含むテキストを見やすく整形する
+
+    user_id:で始まる複数ユーザーの情報を改行で区切り、
+    各種類の回数を箇条書き形式に整形する
+    """
+    formatter = UserDataFormatter()
+    formatter.feed(text)
+    return formatter.finish()